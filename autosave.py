@@ -0,0 +1,192 @@
+from collections import deque
+import glob
+import os
+import queue
+import sys
+import threading
+import time
+from project import ProjectFile
+
+# Per-user directory of the autosave files
+def autosave_directory():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state")
+    return os.path.join(base, "tkinter-paint", "autosave")
+
+# Locks the open file without waiting, the lock is released when the file is closed or the process ends (also by a crash)
+def _lock(file):
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class Autosave(object):
+    """
+    Background autosave of the drawing. The drawing state is captured on the Tk thread as an immutable snapshot
+    (a tuple of the visible shapes, which are never mutated after they are committed, and a copy of the settings),
+    the serialization and fsync run on a worker thread. The autosave file is an incremental project file, so an autosave
+    appends only the changes since the previous one (images aren't encoded again). A save is requested every interval
+    milliseconds (if something was edited) or after the given number of edits. While a save is running, no other save
+    is queued (backpressure), the newer state is saved by the next request.
+
+    Every session has its own autosave file in the per-user directory and holds a lock on the lock file next to it while
+    it runs. An autosave file whose lock is free was left by a session that didn't end normally, it can be recovered
+    (and it's never touched by the other running sessions).
+
+    Attributes
+    ----------
+    directory : string
+        directory of the autosave files
+    path : string
+        path of the autosave file of this session (a native project file)
+    interval : int
+        autosave period in milliseconds
+    edits : int
+        number of edits that trigger an autosave before the period elapses
+    durations : deque
+        durations of the last autosaves on the worker thread in seconds
+    stalls : deque
+        durations of the last snapshots on the Tk thread in seconds
+    idle : Event
+        set while no autosave is running on the worker thread
+    """
+
+    DEFAULT_INTERVAL = 30000
+    DEFAULT_EDITS = 25
+
+    def __init__(self, root, directory, snapshot, interval=DEFAULT_INTERVAL, edits=DEFAULT_EDITS):
+        self.root = root
+        self.directory = directory
+        self.snapshot = snapshot
+        self.lock_file = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self.claim(os.path.join(directory, "autosave-%d-%d.tkp" % (os.getpid(), int(time.time() * 1000))))
+        except OSError:
+            # The autosaves fail (and are counted as errors), the drawing can still be edited and saved
+            self.path = os.path.join(directory, "autosave-%d.tkp" % os.getpid())
+        self.project = ProjectFile(self.path)
+        self.interval = interval
+        self.edits = edits
+        self.durations = deque(maxlen=100)
+        self.stalls = deque(maxlen=100)
+        self.errors = 0
+        self.skipped = 0
+        self.pending_edits = 0
+        self.idle = threading.Event()
+        self.idle.set()
+        self.jobs = queue.Queue(maxsize=1)
+        self.worker = threading.Thread(target=self.work, name="Autosave", daemon=True)
+        self.worker.start()
+        self.timer = self.root.after(self.interval, self.tick)
+
+    # Called by the application after every edit of the drawing
+    def edit(self):
+        self.pending_edits += 1
+        if self.pending_edits >= self.edits:
+            self.request()
+
+    def tick(self):
+        if self.pending_edits:
+            self.request()
+        self.timer = self.root.after(self.interval, self.tick)
+
+    # Takes the snapshot on the Tk thread and hands it to the worker, unless the previous autosave is still running
+    def request(self):
+        if not self.idle.is_set():
+            self.skipped += 1
+            return
+        start = time.perf_counter()
+        shapes, settings = self.snapshot()
+        self.stalls.append(time.perf_counter() - start)
+        self.pending_edits = 0
+        self.idle.clear()
+        self.jobs.put((tuple(shapes), dict(settings)))
+
+    def work(self):
+        while True:
+            shapes, settings = self.jobs.get()
+            start = time.perf_counter()
+            try:
+                self.project.save_shapes(shapes, settings)
+                self.durations.append(time.perf_counter() - start)
+            except Exception:
+                self.errors += 1
+            finally:
+                self.idle.set()
+
+    # Autosave metrics: count, mean and maximum of autosave durations and of the Tk thread stalls (in milliseconds)
+    def stats(self):
+        def summary(values):
+            values = list(values)
+            if not values:
+                return {"count": 0, "mean_ms": 0.0, "max_ms": 0.0}
+            return {"count": len(values), "mean_ms": 1000 * sum(values) / len(values), "max_ms": 1000 * max(values)}
+        return {"save": summary(self.durations), "stall": summary(self.stalls), "skipped": self.skipped, "errors": self.errors}
+
+    # Locks the lock file of the autosave file at path, returns False if another session holds the lock
+    def claim(self, path):
+        lock_file = open(os.path.splitext(path)[0] + ".lock", "a+b")
+        if not _lock(lock_file):
+            lock_file.close()
+            return False
+        self.path = path
+        self.lock_file = lock_file
+        return True
+
+    # Claims the newest autosave file left by a session that didn't end normally, returns its path (None if there is none)
+    # The autosave of this session becomes the claimed file, so the recovered drawing is autosaved into it
+    def recover(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, "autosave-*.tkp")), key=os.path.getmtime, reverse=True)
+        for path in paths:
+            if path == self.path:
+                continue
+            own_path, own_lock = self.path, self.lock_file
+            if not self.claim(path):
+                continue
+            # The other session may have ended (and removed the file) before the lock was taken
+            if os.path.exists(path):
+                if own_lock is not None:
+                    own_lock.close()
+                    _remove(os.path.splitext(own_path)[0] + ".lock")
+                self.project = ProjectFile(path)
+                return path
+            self.lock_file.close()
+            self.path, self.lock_file = own_path, own_lock
+        return None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # Removes the autosave file (the drawing was closed or discarded on purpose)
+    def discard(self):
+        self.pending_edits = 0
+        # Waits for a running autosave (at most one is queued), so it doesn't recreate the file after it was removed
+        self.idle.wait()
+        _remove(self.path)
+        _remove(self.path + ".tmp")
+
+    # Ends the session normally: the autosave file is removed and the lock is released
+    def stop(self):
+        self.root.after_cancel(self.timer)
+        self.discard()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+            _remove(os.path.splitext(self.path)[0] + ".lock")
@@ -0,0 +1,387 @@
+import io
+import math
+from tkinter import PhotoImage
+from imaging import ppm_data
+
+class RasterBackground(object):
+    """
+    Raster layer under the live canvas items. Shapes that can't be undone anymore are baked into it, so they stop being
+    canvas items and the canvas redraw cost doesn't grow with the length of the drawing session.
+    The layer is one PhotoImage that is updated in place, only the dirty rectangle of newly baked shapes is copied into it.
+    The PhotoImage covers only the region shown by the canvas view (scaled by its zoom), the layer image grows
+    with the document. Without a background color the layer is transparent (RGBA), e.g. one layer of the drawing.
+    The layer image is created when the first shape is drawn into it, so an empty layer costs no memory (and Pillow
+    isn't imported until something is drawn).
+
+    A layer that is not being edited can also show live shapes (cover()): they are drawn over the baked shapes and
+    the image without them is kept as the base, so uncover() gives the baked shapes back without rendering them again.
+
+    Attributes
+    ----------
+    canvas : Canvas
+        the Tk canvas the layer is displayed on
+    image : Image
+        PIL image with the baked shapes (and the shapes of the overlay), None until the first shape is drawn
+    shapes : dict
+        baked shapes in drawing order, the dict is used as an ordered set
+    overlay : dict
+        live shapes drawn over the baked shapes (hidden ones are not drawn), the dict is used as an ordered set
+    base : Image
+        the image with the baked shapes only, None if there is no overlay
+    dirty : tuple
+        rectangle (x1, y1, x2, y2) of the image that was not copied to the PhotoImage yet, None if there is none
+    box : tuple
+        document area (x1, y1, x2, y2) covered by the PhotoImage, None if the whole image is shown (before show())
+    zoom : float
+        canvas pixels per image pixel of the PhotoImage
+    tag : string
+        canvas tag of the PhotoImage item (None if it has none)
+    index : SpatialIndex
+        spatial index of the scene, finds the shapes in a redrawn area (None if the shapes are scanned)
+    """
+
+    # The image grows in steps of GROW pixels, so a drawing that is extended little by little isn't copied every time
+    GROW = 512
+
+    def __init__(self, canvas, width, height, background="white", tag=None, index=None):
+        self.canvas = canvas
+        self.background = background
+        self.tag = tag
+        self.index = index
+        self.size = (width, height)
+        self.image = None
+        self.draw = None
+        self.shapes = {}
+        self.overlay = {}
+        self.base = None
+        self.dirty = None
+        self.photo = None
+        self.item = None
+        self.box = None
+        self.zoom = 1.0
+
+    def new_image(self, size):
+        from PIL import Image
+        import raster
+        if self.background is None:
+            return Image.new("RGBA", size, (0, 0, 0, 0))
+        return Image.new("RGB", size, raster.color(self.background))
+
+    # Draws the shapes into the layer image, the PhotoImage is updated later by flush()
+    # Shapes of the overlay are already drawn in the image, they're drawn only into the base
+    def bake(self, shapes):
+        import raster
+        for shape in shapes:
+            box = shape.bbox()
+            self.grow(box[2], box[3])
+            if shape in self.overlay:
+                del self.overlay[shape]
+            else:
+                raster.draw_shape(self.draw, self.image, shape)
+                self.extend_dirty(box)
+            if self.base is not None:
+                raster.draw_shape(self.base_draw, self.base, shape)
+            self.shapes[shape] = None
+        if self.base is not None and not self.overlay:
+            self.base = None
+
+    # Draws the live shapes over the baked shapes (the layer is not edited, so its live shapes aren't canvas items)
+    def cover(self, shapes):
+        import raster
+        if not shapes:
+            return
+        self.keep_base()
+        for shape in shapes:
+            self.overlay[shape] = None
+            if not shape.hidden:
+                box = shape.bbox()
+                self.grow(box[2], box[3])
+                raster.draw_shape(self.draw, self.image, shape)
+                self.extend_dirty(box)
+
+    # Removes the overlay, returns its live shapes (they become canvas items again), the base image is shown again
+    def uncover(self):
+        shapes = list(self.overlay)
+        if self.base is not None:
+            self.image, self.draw = self.base, self.base_draw
+            self.base = None
+            self.overlay = {}
+            self.dirty = (0, 0) + self.image.size
+        return shapes
+
+    # A live shape of the overlay was hidden or shown (undo or redo while the layer is not edited), a shown shape that
+    # isn't in the overlay yet (e.g. an erased baked shape) is added to it, the area of the shape is rendered again
+    def update(self, shape):
+        self.keep_base()
+        self.overlay[shape] = None
+        box = shape.bbox()
+        self.grow(box[2], box[3])
+        self.redraw(box)
+
+    # Removes a shape from the overlay (e.g. a deleted shape of a discarded redo step)
+    def discard(self, shape):
+        if shape in self.overlay:
+            del self.overlay[shape]
+            if not shape.hidden:
+                self.redraw(shape.bbox())
+
+    # Keeps a copy of the image without the overlay
+    def keep_base(self):
+        from PIL import ImageDraw
+        if self.base is None:
+            self.grow(0, 0)
+            self.base = self.image.copy()
+            self.base_draw = ImageDraw.Draw(self.base)
+
+    # Enlarges the image, so it covers the document area up to (x, y), the first call creates it
+    def grow(self, x, y):
+        from PIL import ImageDraw
+        width, height = self.size if self.image is None else self.image.size
+        if self.image is not None and x <= width and y <= height:
+            return
+        size = (max(width, int(math.ceil(x / self.GROW)) * self.GROW), max(height, int(math.ceil(y / self.GROW)) * self.GROW))
+        image = self.new_image(size)
+        if self.image is not None:
+            image.paste(self.image, (0, 0))
+        self.image = image
+        self.draw = ImageDraw.Draw(image)
+        if self.base is not None:
+            base = self.new_image(size)
+            base.paste(self.base, (0, 0))
+            self.base = base
+            self.base_draw = ImageDraw.Draw(base)
+
+    # Removes baked shapes from the layer (e.g. erased shapes): the area they covered is rendered again
+    # from the remaining baked shapes
+    def unbake(self, shapes):
+        for shape in shapes:
+            self.shapes.pop(shape, None)
+            self.overlay.pop(shape, None)
+            self.redraw(self.index.box(shape) if self.index is not None else shape.bbox())
+
+    # Renders the area (x1, y1, x2, y2) of the image again from the baked shapes and the overlay
+    def redraw(self, box):
+        import raster
+        width, height = self.image.size
+        x1, y1 = max(0, int(box[0]) - 2), max(0, int(box[1]) - 2)
+        x2, y2 = min(width, int(box[2]) + 3), min(height, int(box[3]) + 3)
+        if x1 >= x2 or y1 >= y2:
+            return
+        # The area is rendered with a margin that is cropped, like the tiles of raster.render_tiled()
+        margin = raster.TILE_MARGIN
+        area_box = (x1 - margin, y1 - margin, x2 + margin, y2 + margin)
+        # The spatial index finds the shapes in the area with their cached boxes, the layer's shapes aren't scanned
+        if self.index is not None:
+            near = self.index.query(area_box)
+            covering = [other for other in near if other in self.shapes]
+            covered = [other for other in near if other in self.overlay]
+        else:
+            covering = [other for other in self.shapes if raster.intersects(other.bbox(), area_box)]
+            covered = [other for other in self.overlay if not other.hidden and raster.intersects(other.bbox(), area_box)]
+        crop = (margin, margin, margin + x2 - x1, margin + y2 - y1)
+        if self.base is not None:
+            area = raster.render_box(covering, self.background, area_box[:2], 1.0, (x2 - x1 + 2 * margin, y2 - y1 + 2 * margin))
+            self.base.paste(area.crop(crop), (x1, y1))
+            covering += covered
+            covering.sort(key=lambda other: other.uid)
+        area = raster.render_box(covering, self.background, area_box[:2], 1.0, (x2 - x1 + 2 * margin, y2 - y1 + 2 * margin))
+        self.image.paste(area.crop(crop), (x1, y1))
+        self.extend_dirty((x1, y1, x2, y2))
+
+    def extend_dirty(self, box):
+        x1, y1, x2, y2 = box
+        if self.dirty:
+            x1, y1 = min(x1, self.dirty[0]), min(y1, self.dirty[1])
+            x2, y2 = max(x2, self.dirty[2]), max(y2, self.dirty[3])
+        self.dirty = (x1, y1, x2, y2)
+
+    # Shows the document area box (x1, y1, x2, y2) at the given zoom (the region materialized by the canvas view),
+    # the PhotoImage is created again in the size of the area
+    def show(self, box, zoom=1.0):
+        x1, y1, x2, y2 = box
+        self.box = (max(0, int(x1)), max(0, int(y1)), max(1, int(math.ceil(x2))), max(1, int(math.ceil(y2))))
+        self.zoom = zoom
+        if self.photo is not None:
+            self.canvas.delete(self.item)
+            self.photo = self.item = None
+        if self.shapes or self.overlay:
+            self.dirty = self.box
+            self.flush()
+
+    # Copies the dirty rectangle of the layer image into the PhotoImage, scaled by the zoom
+    def flush(self):
+        from PIL import Image
+        if not self.dirty:
+            return
+        width, height = self.image.size
+        box = self.box or (0, 0, width, height)
+        x1, y1 = max(box[0], int(self.dirty[0]) - 1), max(box[1], int(self.dirty[1]) - 1)
+        x2, y2 = min(box[2], width, int(self.dirty[2]) + 2), min(box[3], height, int(self.dirty[3]) + 2)
+        self.dirty = None
+        if x1 >= x2 or y1 >= y2:
+            return
+        zoom = self.zoom
+        # Canvas position of the PhotoImage
+        left, top = int(box[0] * zoom), int(box[1] * zoom)
+        if self.photo is None:
+            # The PhotoImage is created with the first baked shape, an empty PhotoImage is transparent
+            self.photo = PhotoImage(width=max(1, int(math.ceil(box[2] * zoom)) - left),
+                                    height=max(1, int(math.ceil(box[3] * zoom)) - top))
+            self.item = self.canvas.create_image(left, top, anchor="nw", image=self.photo, tags=self.tag)
+            self.canvas.tag_lower(self.item)
+        if zoom == 1.0:
+            region = self.image.crop((x1, y1, x2, y2))
+            x, y = x1, y1
+        else:
+            # The rectangle is resampled on the canvas pixel grid, so partial updates match the rest of the PhotoImage
+            x, y = int(x1 * zoom), int(y1 * zoom)
+            right, bottom = min(int(math.ceil(x2 * zoom)), int(width * zoom)), min(int(math.ceil(y2 * zoom)), int(height * zoom))
+            if x >= right or y >= bottom:
+                return
+            region = self.image.resize((right - x, bottom - y), Image.BILINEAR,
+                                       box=(x / zoom, y / zoom, right / zoom, bottom / zoom))
+        if region.mode == "RGBA":
+            # PPM has no alpha channel, transparent layers are copied as PNG data (put replaces the pixels and their alpha)
+            buffer = io.BytesIO()
+            region.save(buffer, format="PNG", compress_level=1)
+            self.photo.tk.call(self.photo.name, "put", buffer.getvalue(), "-format", "png", "-to", x - left, y - top)
+        else:
+            self.photo.tk.call(self.photo.name, "put", ppm_data(region), "-format", "ppm", "-to", x - left, y - top)
+
+    # Approximate memory used by the layer image, its base and its PhotoImage in bytes
+    def nbytes(self):
+        size = self.photo.width() * self.photo.height() * 4 if self.photo else 0
+        if self.image is not None:
+            width, height = self.image.size
+            size += width * height * len(self.image.getbands()) * (2 if self.base is not None else 1)
+        return size
+
+class LayerImages(object):
+    """
+    Layers of the drawing on the canvas. Every layer has a transparent RasterBackground: the one of the active layer holds
+    its baked shapes under the live canvas items of the view, the other layers are cached as a whole, their live shapes
+    are drawn over their baked shapes (RasterBackground.cover()). So only the active layer has vector canvas items,
+    every other layer is one canvas image and hiding, showing or reordering a layer only changes the stacking or the state
+    of its image item.
+
+    Stacking of the canvas items: the layer images up to the active one, the live items of the active layer,
+    the images of the layers above it.
+
+    Attributes
+    ----------
+    canvas : Canvas
+        the Tk canvas the layers are displayed on
+    scene : Scene
+        the document model, its layers list gives the order of the layers
+    backgrounds : dict
+        RasterBackground of every layer (layer uid -> RasterBackground)
+    active : Layer
+        the layer edited by the tools
+    box : tuple
+        document area shown by the layer images, None before show()
+    zoom : float
+        canvas pixels per document pixel of the layer images
+    """
+
+    def __init__(self, canvas, scene):
+        self.canvas = canvas
+        self.scene = scene
+        self.backgrounds = {}
+        self.active = scene.layers[0]
+        self.box = None
+        self.zoom = 1.0
+        for layer in scene.layers:
+            self.add(layer)
+
+    def __getitem__(self, layer):
+        return self.backgrounds[layer.uid]
+
+    # Creates the image of a new layer of the scene
+    def add(self, layer):
+        background = self.backgrounds[layer.uid] = RasterBackground(self.canvas, self.scene.width, self.scene.height,
+                                                                    background=None, tag="layer%d" % layer.uid,
+                                                                    index=self.scene.index)
+        if self.box is not None:
+            background.show(self.box, self.zoom)
+        return background
+
+    # Makes the layer active: the live shapes of the previously active layer are drawn into its image, the live shapes
+    # of the new active layer are returned (the view draws them as canvas items again)
+    def activate(self, layer, live):
+        self[self.active].cover(live)
+        self.active = layer
+        shapes = self[layer].uncover()
+        self.flush()
+        self.restack()
+        return shapes
+
+    # Shows the document area box at the given zoom in all the layer images (see RasterBackground.show())
+    def show(self, box, zoom=1.0):
+        self.box = box
+        self.zoom = zoom
+        for background in self.backgrounds.values():
+            background.show(box, zoom)
+        self.restack()
+
+    # Copies the dirty rectangles of all the layers into their PhotoImages, new image items are stacked
+    def flush(self):
+        created = False
+        for background in self.backgrounds.values():
+            item = background.item
+            background.flush()
+            created = created or background.item != item
+        if created:
+            self.restack()
+
+    # Stacks the layer image items in the layer order around the live items and hides the images of hidden layers,
+    # it's a few canvas calls per layer regardless of the number of shapes
+    def restack(self):
+        c = self.canvas
+        layers = self.scene.layers
+        active = layers.index(self.active)
+        for layer in reversed(layers[:active + 1]):
+            if self[layer].item is not None:
+                c.tag_lower(self[layer].item)
+        for layer in layers[active + 1:]:
+            if self[layer].item is not None:
+                c.tag_raise(self[layer].item)
+        for layer in layers:
+            if self[layer].item is not None:
+                c.itemconfigure(self[layer].item, state="hidden" if layer.hidden else "normal")
+
+    # Image item of the lowest layer above the active one, the live items are kept under it (None if there is none)
+    def ceiling(self):
+        layers = self.scene.layers
+        for layer in layers[layers.index(self.active) + 1:]:
+            if self[layer].item is not None:
+                return self[layer].item
+        return None
+
+    # Image of the document of given size as it is shown: the images of the shown layers composed over the background
+    # color and the given live shapes drawn over the active layer (used by the bucket fill, nothing is rendered again)
+    def composite(self, shapes, size):
+        from PIL import Image, ImageDraw
+        import raster
+        image = Image.new("RGB", tuple(size), raster.color(self.scene.background) or (255, 255, 255))
+        for layer in self.scene.layers:
+            if layer.hidden:
+                continue
+            layer_image = self[layer].image
+            if layer_image is not None:
+                image.paste(layer_image, (0, 0), layer_image)
+            if layer is self.active:
+                draw = ImageDraw.Draw(image)
+                for shape in shapes:
+                    raster.draw_shape(draw, image, shape)
+        return image
+
+    # Deletes the image items of all the layers (e.g. the layers of a loaded drawing replace them)
+    def clear(self):
+        for background in self.backgrounds.values():
+            if background.item is not None:
+                self.canvas.delete(background.item)
+                background.photo = background.item = None
+
+    # Approximate memory used by the layer images and their PhotoImages in bytes
+    def nbytes(self):
+        return sum(background.nbytes() for background in self.backgrounds.values())
@@ -0,0 +1,137 @@
+"""
+Headless batch rendering of Paint drawings, no window and no display are needed.
+
+Usage:
+    python batch.py [--format png,ps,svg,svgz] [--output DIR] [--scale S] [--workers N] FILE...
+
+Inputs are native project files (.tkp) and event recordings (.jsonl, see replay.py). Every input is rendered
+into each requested format (DIR/<name>.<format>), the files are rendered in a process pool with one worker per core.
+The name is the path of the input relative to the common directory of the inputs, so inputs with the same file name
+in different directories don't overwrite each other (DIR/a/x.png, DIR/b/x.png), inputs that differ only in the extension
+keep it (DIR/x.tkp.png, DIR/x.jsonl.png).
+Progress is streamed to stdout as one JSON line per finished file, followed by a summary line.
+
+PNG is rendered by the offscreen rasterizer (raster.py), PostScript is written by postscript.py and SVG by svg.py
+(svgz is the gzip compressed SVG).
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+import sys
+import time
+
+FORMATS = ("png", "ps", "svg", "svgz")
+
+# Scene of a project file or an event recording
+def load_scene(path):
+    if path.endswith(".jsonl"):
+        import replay
+        header, events = replay.read_events(path)
+        return replay.events_scene(events, header.get("width", 600), header.get("height", 600))
+    from project import read_scene
+    return read_scene(path)[0]
+
+# Output names of the inputs (paths relative to the output directory without the format suffix), unique for every input
+def output_names(paths):
+    paths = [os.path.abspath(path) for path in paths]
+    try:
+        root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else ""
+    except ValueError:
+        # Inputs on different drives, the paths without the drive are used
+        root = None
+    relative = [os.path.relpath(path, root) if root is not None else os.path.splitdrive(path)[1].lstrip("\\/") for path in paths]
+    names = [os.path.splitext(path)[0] for path in relative]
+    counts = {}
+    for name in names:
+        counts[name] = counts.get(name, 0) + 1
+    return [path if counts[name] > 1 else name for name, path in zip(names, relative)]
+
+# Renders one input file into the formats (output files name.<format> in the output directory), runs in a worker process
+def render_file(path, formats, output, scale, name=None):
+    import raster
+    started = time.perf_counter()
+    scene = load_scene(path)
+    timings = {"load": time.perf_counter() - started}
+    outputs = []
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    if os.path.dirname(name):
+        os.makedirs(os.path.join(output, os.path.dirname(name)), exist_ok=True)
+    image = None
+    for file_format in formats:
+        start = time.perf_counter()
+        target = os.path.join(output, "%s.%s" % (name, file_format))
+        if file_format == "png":
+            if image is None:
+                # The pool already runs one file per core, so a large image isn't split into more processes
+                image = raster.render(scene, scale=scale, workers=1)
+            image.save(target, format="PNG")
+        elif file_format == "ps":
+            import postscript
+            postscript.write_postscript(scene, target)
+        elif file_format in ("svg", "svgz"):
+            import svg
+            svg.write_svg(scene, target)
+        timings[file_format] = time.perf_counter() - start
+        outputs.append(target)
+    return {"outputs": outputs, "shapes": len(scene), "seconds": timings, "total_seconds": time.perf_counter() - started}
+
+def render_files(paths, formats=("png",), output=".", scale=1.0, workers=None, stream=sys.stdout):
+    """
+    Renders the files in a process pool and writes a JSON line for every finished file into stream.
+
+    Parameters
+    ----------
+    paths : list
+        paths of the project files (.tkp) and event recordings (.jsonl), a file given more than once is rendered once
+    formats : tuple
+        output formats ("png", "ps", "svg", "svgz")
+    output : string
+        directory of the output files
+    scale : float
+        scale factor of the PNG output
+    workers : int
+        number of worker processes (os.cpu_count() by default)
+
+    Returns the summary dict (number of rendered and failed files and the wall time).
+    """
+    os.makedirs(output, exist_ok=True)
+    started = time.perf_counter()
+    failed = 0
+    unique = {}
+    for path in paths:
+        unique.setdefault(os.path.abspath(path), path)
+    paths = list(unique.values())
+    names = output_names(paths)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        jobs = {pool.submit(render_file, path, formats, output, scale, name): path for path, name in zip(paths, names)}
+        for done, job in enumerate(as_completed(jobs), 1):
+            result = {"input": jobs[job], "done": done, "total": len(paths)}
+            try:
+                result.update(job.result())
+            except Exception as error:
+                failed += 1
+                result["error"] = "%s: %s" % (type(error).__name__, error)
+            stream.write(json.dumps(result) + "\n")
+            stream.flush()
+    return {"rendered": len(paths) - failed, "failed": failed, "wall_seconds": time.perf_counter() - started}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless batch rendering of Paint drawings")
+    parser.add_argument("files", nargs="+", help="project files (.tkp) or event recordings (.jsonl)")
+    parser.add_argument("-f", "--format", default="png", help="comma separated output formats: png, ps, svg, svgz (png by default)")
+    parser.add_argument("-o", "--output", default=".", help="output directory (the current directory by default)")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help="scale factor of the PNG output (PostScript and SVG are vector)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes (one per core by default)")
+    args = parser.parse_args(argv)
+    formats = [file_format.strip().lower() for file_format in args.format.split(",") if file_format.strip()]
+    for file_format in formats:
+        if file_format not in FORMATS:
+            parser.error("unknown format: %s" % file_format)
+    summary = render_files(args.files, formats, args.output, args.scale, args.workers)
+    print(json.dumps({"summary": summary}))
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
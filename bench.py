@@ -0,0 +1,369 @@
+"""
+Benchmarks of the Paint application.
+
+Usage:
+    python bench.py export [--shapes N] [--scale S] [--repeat R]
+    python bench.py replay [--workload NAME ...] [--size F]
+    python bench.py viewport [--shapes N] [--steps S]
+    python bench.py svg [--shapes N] [--repeat R]
+    python bench.py pyramid [--size N] [--scale S]
+    python bench.py startup [--repeat R] [--budget SECONDS]
+
+The replay and viewport benchmarks, the screen grab part of the export benchmark, the canvas PostScript part of the svg
+benchmark and the first frame of the startup benchmark need a display (e.g. run them with xvfb-run on a headless machine).
+
+Every benchmark prints its results as JSON, so the results can be compared between commits. Two of them can be run
+as checks: with --budget the startup benchmark exits with status 1 if the median startup time is over the budget
+or the first frame couldn't be measured (there is no display, the status is "skipped"), the pyramid check exits
+with status 1 if the tiled PNG export of images with a tile pyramid fails or differs from the serial one.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from scene import Scene, PenShape, LineShape, CircleShape, RectangleShape, PolygonShape, PointShape
+
+# Creates a reproducible scene with count random shapes (mostly pen strokes, like a real drawing)
+def synthetic_scene(count, width=600, height=600, seed=0):
+    rnd = random.Random(seed)
+    scene = Scene(width, height)
+    colors = ["black", "red", "#1f77b4", "#2ca02c", "#ff7f0e"]
+    for _ in range(count):
+        kind = rnd.random()
+        x, y = rnd.uniform(0, width), rnd.uniform(0, height)
+        fill = rnd.choice(colors)
+        if kind < 0.6:
+            coords = [x, y]
+            for _ in range(rnd.randint(5, 60)):
+                x = min(max(x + rnd.uniform(-15, 15), 0), width)
+                y = min(max(y + rnd.uniform(-15, 15), 0), height)
+                coords += [x, y]
+            shape = PenShape(coords, fill=fill, width=rnd.randint(1, 10))
+        elif kind < 0.7:
+            shape = LineShape((x, y, rnd.uniform(0, width), rnd.uniform(0, height)), fill=fill, width=rnd.randint(1, 10))
+        elif kind < 0.8:
+            shape = CircleShape((x, y, x + rnd.uniform(5, 80), y + rnd.uniform(5, 80)), fill=fill, outline=fill)
+        elif kind < 0.9:
+            shape = RectangleShape((x, y, x + rnd.uniform(5, 80), y + rnd.uniform(5, 80)), fill=fill, outline=fill)
+        elif kind < 0.95:
+            coords = []
+            for _ in range(rnd.randint(3, 8)):
+                coords += [x + rnd.uniform(-50, 50), y + rnd.uniform(-50, 50)]
+            shape = PolygonShape(coords, fill=fill, outline=fill)
+        else:
+            size = rnd.randint(1, 10)
+            shape = PointShape((x, y, x + size, y + size), fill=fill, outline=fill)
+        scene.add(shape)
+    return scene
+
+# Peak resident set size of the current process in bytes
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _child(connection, function, args):
+    try:
+        baseline = peak_rss()
+        result = function(*args)
+        result["peak_rss"] = peak_rss()
+        result["peak_rss_increase"] = result["peak_rss"] - baseline
+    except Exception as error:
+        result = {"error": "%s: %s" % (type(error).__name__, error)}
+    connection.send(result)
+    connection.close()
+
+# Runs the benchmark function in a fresh process, so the peak memory of one benchmark doesn't affect another one
+def run_isolated(function, *args):
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_child, args=(child, function, args))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+def _timings(seconds):
+    seconds = sorted(seconds)
+    return {"min": seconds[0], "median": seconds[len(seconds) // 2], "max": seconds[-1]}
+
+# PNG export using the offscreen rasterizer (Paint.saving)
+def export_raster(shapes, scale, repeat):
+    import raster
+    scene = synthetic_scene(shapes)
+    path = os.path.join(tempfile.mkdtemp(), "bench.png")
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        raster.render(scene, scale=scale).save(path)
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": _timings(seconds), "size": os.path.getsize(path)}
+
+# The former PNG export: full screen grab cropped to the canvas area of a Paint window with the drawing (needs a display),
+# the screen is grabbed by Pillow's ImageGrab (pyscreenshot isn't a dependency anymore), the grab can't be scaled
+def export_grab(shapes, scale, repeat):
+    from PIL import ImageGrab
+    from paint import Paint
+    paint = Paint(autosave=False, mainloop=False, flatten=False)
+    try:
+        for shape in synthetic_scene(shapes):
+            paint.scene.add(shape)
+            paint.view.draw(shape)
+        paint.root.update()
+        path = os.path.join(tempfile.mkdtemp(), "bench.png")
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            # The crop offsets of the former export: the window padding is 2 px, winfo_width/height() include 4 px more
+            x1 = paint.root.winfo_rootx() + paint.c.winfo_x() + 2
+            y1 = paint.root.winfo_rooty() + paint.c.winfo_y() + 2
+            x2, y2 = x1 + paint.c.winfo_width() - 4, y1 + paint.c.winfo_height() - 4
+            ImageGrab.grab().crop((x1, y1, x2, y2)).save(path)
+            seconds.append(time.perf_counter() - start)
+        return {"seconds": _timings(seconds), "size": os.path.getsize(path), "scale": 1.0}
+    finally:
+        paint.root.destroy()
+
+def bench_export(shapes=2000, scale=1.0, repeat=5):
+    return {
+        "benchmark": "export",
+        "shapes": shapes,
+        "scale": scale,
+        "raster": run_isolated(export_raster, shapes, scale, repeat),
+        "grab": run_isolated(export_grab, shapes, scale, repeat),
+    }
+
+# Tiled PNG export (the process pool of raster.render_tiled) of a drawing with large image shapes that have a tile pyramid:
+# an imported very large image (pyramid only) and an image zoomed in by the canvas view (image and pyramid), the images
+# must be the same as in the export rendered in one piece
+def export_pyramid(size, scale):
+    from PIL import Image, ImageChops
+    import raster
+    from scene import ImageShape
+    from tiles import TilePyramid
+    image = Image.radial_gradient("L").resize((size, size)).convert("RGB")
+    scene = Scene(2 * size, size)
+    scene.add(ImageShape((size // 2, size // 2), pyramid=TilePyramid(image), size=image.size))
+    zoomed = ImageShape((size + size // 2, size // 2), image.rotate(90))
+    zoomed.pyramid = TilePyramid(zoomed.image)
+    scene.add(zoomed)
+    start = time.perf_counter()
+    tiled = raster.render(scene, scale=scale)
+    seconds = time.perf_counter() - start
+    whole = raster.render(scene, scale=scale, workers=1)
+    return {"seconds": seconds, "size": list(tiled.size), "ok": ImageChops.difference(tiled, whole).getbbox() is None}
+
+def bench_pyramid(size=2500, scale=2.0):
+    result = {"benchmark": "pyramid", "image_size": size, "scale": scale, "tiled": run_isolated(export_pyramid, size, scale)}
+    result["failed"] = not result["tiled"].get("ok")
+    return result
+
+# SVG export (svg.py), compressed if the path ends with .svgz
+def export_svg(shapes, suffix, repeat):
+    import svg
+    scene = synthetic_scene(shapes)
+    path = os.path.join(tempfile.mkdtemp(), "bench" + suffix)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        elements = svg.write_svg(scene, path)
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": _timings(seconds), "size": os.path.getsize(path), "elements": elements}
+
+# PostScript export (postscript.py)
+def export_ps(shapes, repeat):
+    import postscript
+    scene = synthetic_scene(shapes)
+    path = os.path.join(tempfile.mkdtemp(), "bench.ps")
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        elements = postscript.write_postscript(scene, path)
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": _timings(seconds), "size": os.path.getsize(path), "elements": elements}
+
+# The former PostScript export of the canvas, Tk builds the whole document in memory (needs a display)
+def export_postscript(shapes, repeat):
+    from paint import Paint
+    paint = Paint(autosave=False, mainloop=False, flatten=False)
+    try:
+        for shape in synthetic_scene(shapes):
+            paint.scene.add(shape)
+            paint.view.draw(shape)
+        paint.root.update()
+        path = os.path.join(tempfile.mkdtemp(), "bench.ps")
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            paint.c.postscript(file=path, colormode="color")
+            seconds.append(time.perf_counter() - start)
+        return {"seconds": _timings(seconds), "size": os.path.getsize(path)}
+    finally:
+        paint.root.destroy()
+
+def bench_svg(shapes=2000, repeat=5):
+    return {
+        "benchmark": "svg",
+        "shapes": shapes,
+        "svg": run_isolated(export_svg, shapes, ".svg", repeat),
+        "svgz": run_isolated(export_svg, shapes, ".svgz", repeat),
+        "ps": run_isolated(export_ps, shapes, repeat),
+        "ps_canvas": run_isolated(export_postscript, shapes, repeat),
+    }
+
+# Replays one synthetic workload (see replay.py), size scales the number of strokes, polygons and images
+def replay_workload(name, size):
+    import replay
+    function = replay.WORKLOADS[name]
+    defaults = function.__defaults__
+    count = max(1, int(round(defaults[0] * size)))
+    result = replay.replay_events(function(count))
+    result["count"] = count
+    return result
+
+def bench_replay(workloads=None, size=1.0):
+    import replay
+    return {
+        "benchmark": "replay",
+        "size": size,
+        "workloads": {name: run_isolated(replay_workload, name, size) for name in workloads or replay.WORKLOADS},
+    }
+
+# Pans and zooms over a synthetic drawing in a Paint window: latency of the scroll and zoom steps (including the redraw)
+# and the time until the canvas view materialized all the shapes that came into sight
+def viewport_pan_zoom(shapes, steps):
+    from paint import Paint
+    paint = Paint(autosave=False, mainloop=False, flatten=False)
+    try:
+        size = int(600 * (shapes / 2000.0) ** 0.5)
+        for shape in synthetic_scene(shapes, size, size):
+            paint.scene.add(shape)
+            paint.view.draw(shape)
+        paint.root.update()
+        def settle():
+            start = time.perf_counter()
+            while paint.view.pending:
+                paint.root.update()
+            return time.perf_counter() - start
+        results = {}
+        for zoom in (1.0, 0.25, 1 / 16.0):
+            start = time.perf_counter()
+            paint.view.set_zoom(zoom)
+            paint.root.update()
+            zoom_seconds = time.perf_counter() - start
+            settle_seconds = [settle()]
+            pan = []
+            for step in range(steps):
+                start = time.perf_counter()
+                paint.scroll_x("scroll", 1 if step % 20 < 10 else -1, "units")
+                paint.scroll_y("scroll", 1, "units")
+                paint.root.update()
+                pan.append(time.perf_counter() - start)
+                settle_seconds.append(settle())
+            results[str(zoom)] = {"zoom_seconds": zoom_seconds, "pan_seconds": _timings(pan),
+                                  "materialize_seconds": _timings(settle_seconds), "canvas_items": len(paint.c.find_all())}
+        return {"document": [paint.scene.width, paint.scene.height], "zoom": results}
+    finally:
+        paint.root.destroy()
+
+def bench_viewport(shapes=200000, steps=50):
+    return {"benchmark": "viewport", "shapes": shapes, "steps": steps, "result": run_isolated(viewport_pan_zoom, shapes, steps)}
+
+# Startup measured in a cold interpreter: time from the process spawn (argv[1] is the spawn time) to the import of paint,
+# to the constructed Paint and to the first frame drawn by Tk, heavy dependencies loaded by then are listed
+_STARTUP = """
+import json, sys, time
+spawned = float(sys.argv[1])
+result = {"interpreter": time.time() - spawned}
+start = time.perf_counter()
+from paint import Paint
+result["import"] = time.perf_counter() - start
+result["total"] = time.time() - spawned
+try:
+    start = time.perf_counter()
+    paint = Paint(autosave=False, mainloop=False)
+    result["construct"] = time.perf_counter() - start
+    start = time.perf_counter()
+    paint.root.update()
+    result["first_frame"] = time.perf_counter() - start
+    result["total"] = time.time() - spawned
+    paint.root.destroy()
+except Exception as error:
+    result["error"] = "%s: %s" % (type(error).__name__, error)
+result["loaded"] = [name for name in ("PIL", "numpy", "xml.sax", "raster", "svg", "tiles", "instrument") if name in sys.modules]
+print(json.dumps(result))
+"""
+
+def startup_process():
+    import subprocess
+    output = subprocess.run([sys.executable, "-c", _STARTUP, repr(time.time())], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return json.loads(output)
+
+# Startup time of the application from a cold process start to the first frame (without a display only up to the import,
+# the status is "skipped")
+def bench_startup(repeat=5, budget=None):
+    runs = [startup_process() for _ in range(repeat)]
+    result = {"benchmark": "startup", "repeat": repeat, "loaded": runs[-1]["loaded"]}
+    for stage in ("interpreter", "import", "construct", "first_frame", "total"):
+        if all(stage in run for run in runs):
+            result[stage] = _timings([run[stage] for run in runs])
+    if "error" in runs[-1]:
+        # The window couldn't be created (e.g. there is no display), the first frame wasn't measured
+        result["error"] = runs[-1]["error"]
+        result["status"] = "skipped"
+    else:
+        result["status"] = "ok"
+    if budget is not None:
+        result["budget"] = budget
+        result["over_budget"] = result["status"] == "ok" and result["total"]["median"] > budget
+        if result["over_budget"]:
+            result["status"] = "over_budget"
+        # A check that didn't measure the first frame doesn't pass
+        result["failed"] = result["status"] != "ok"
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Paint benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="PNG export latency and peak memory (rasterizer vs. screen grab)")
+    export.add_argument("--shapes", type=int, default=2000)
+    export.add_argument("--scale", type=float, default=1.0)
+    export.add_argument("--repeat", type=int, default=5)
+    replay = commands.add_parser("replay", help="event handler latency, canvas items, memory and save time of synthetic workloads")
+    replay.add_argument("--workload", action="append", choices=["scribble", "diagram", "undo", "import"],
+                        help="workload to replay (all workloads by default), can be repeated")
+    replay.add_argument("--size", type=float, default=1.0, help="scale factor of the workload sizes")
+    viewport = commands.add_parser("viewport", help="pan and zoom latency and viewport materialization on a large drawing")
+    viewport.add_argument("--shapes", type=int, default=200000)
+    viewport.add_argument("--steps", type=int, default=50, help="number of scroll steps at every zoom")
+    svg = commands.add_parser("svg", help="SVG, SVGZ and PostScript export latency, size and peak memory (vs. the canvas PostScript)")
+    svg.add_argument("--shapes", type=int, default=2000)
+    svg.add_argument("--repeat", type=int, default=5)
+    pyramid = commands.add_parser("pyramid", help="check of the tiled PNG export of images with a tile pyramid (exits with status 1 if it fails)")
+    pyramid.add_argument("--size", type=int, default=2500, help="width and height of the images")
+    pyramid.add_argument("--scale", type=float, default=2.0)
+    startup = commands.add_parser("startup", help="time from a cold process start to the first frame, dependencies loaded at the startup")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.add_argument("--budget", type=float, help="exit with status 1 if the median startup time is over the budget in seconds")
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        result = bench_export(args.shapes, args.scale, args.repeat)
+    elif args.command == "replay":
+        result = bench_replay(args.workload, args.size)
+    elif args.command == "viewport":
+        result = bench_viewport(args.shapes, args.steps)
+    elif args.command == "svg":
+        result = bench_svg(args.shapes, args.repeat)
+    elif args.command == "pyramid":
+        result = bench_pyramid(args.size, args.scale)
+    elif args.command == "startup":
+        result = bench_startup(args.repeat, args.budget)
+    print(json.dumps(result, indent=2))
+    return 1 if result.get("over_budget") or result.get("failed") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
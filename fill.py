@@ -0,0 +1,105 @@
+"""
+Bucket fill: flood fill of the rasterized drawing with NumPy.
+
+The pixels that match the seed color are found for the whole image at once (vectorized), every image row is split
+into runs of matching pixels and the flood fill walks the runs instead of the pixels: a run is connected to the runs
+in the neighbouring rows that overlap it (4-connectivity). The work in Python is proportional to the number of runs,
+which is about the height of the region for ordinary drawings.
+
+NumPy and Pillow are imported by the first fill, so importing the module (and starting the application) doesn't load them.
+"""
+from scene import ImageShape
+
+DEFAULT_TOLERANCE = 32
+
+def flood_mask(pixels, x, y, tolerance=DEFAULT_TOLERANCE):
+    """
+    Region connected to the seed pixel (x, y) whose colors differ from the seed color by at most tolerance
+    in every channel.
+
+    Parameters
+    ----------
+    pixels : ndarray
+        RGB image as a (height, width, 3) uint8 array
+    x, y : int
+        the seed pixel
+    tolerance : int
+        maximal color difference per channel (0 fills only the exact seed color)
+
+    Returns the boolean (height, width) mask of the region.
+    """
+    import numpy as np
+    height, width = pixels.shape[:2]
+    # |pixel - seed| <= tolerance is tested as lo <= pixel <= hi in uint8 per channel (no wider temporary arrays)
+    matching = np.ones((height, width), dtype=bool)
+    for channel, value in enumerate(pixels[y, x].tolist()):
+        plane = pixels[:, :, channel]
+        if value - tolerance > 0:
+            matching &= plane >= value - tolerance
+        if value + tolerance < 255:
+            matching &= plane <= value + tolerance
+    # Run boundaries of all rows at once: positions where the matching changes, in a row padded by False on both sides
+    padded = np.zeros((height, width + 2), dtype=bool)
+    padded[:, 1:-1] = matching
+    edge_rows, edge_cols = np.nonzero(padded[:, 1:] != padded[:, :-1])
+    offsets = edge_rows.searchsorted(np.arange(height + 1)).tolist()
+    runs = {}
+    # Runs of matching pixels in the row as arrays of starts and (exclusive) ends
+    def row_runs(row):
+        if row not in runs:
+            edges = edge_cols[offsets[row]:offsets[row + 1]]
+            runs[row] = (edges[0::2], edges[1::2], np.zeros(len(edges) // 2, dtype=bool))
+        return runs[row]
+    mask = np.zeros((height, width), dtype=bool)
+    starts, ends, visited = row_runs(y)
+    seed_run = int(np.searchsorted(ends, x, side="right"))
+    visited[seed_run] = True
+    stack = [(y, seed_run)]
+    while stack:
+        row, run = stack.pop()
+        starts, ends, visited = runs[row]
+        start, end = starts[run], ends[run]
+        mask[row, start:end] = True
+        for neighbour in (row - 1, row + 1):
+            if 0 <= neighbour < height:
+                # Runs of the neighbouring row that overlap [start, end)
+                starts, ends, visited = row_runs(neighbour)
+                first = ends.searchsorted(start, side="right")
+                last = starts.searchsorted(end, side="left")
+                for other in range(first, last):
+                    if not visited[other]:
+                        visited[other] = True
+                        stack.append((neighbour, other))
+    return mask
+
+def fill_shape(image, x, y, rgb, tolerance=DEFAULT_TOLERANCE):
+    """
+    Flood fills the image from (x, y) and returns the filled region as an ImageShape: an RGBA image of the region's
+    bounding box that has the fill color inside the region and is transparent elsewhere. Returns None if the seed
+    is outside of the image or every pixel of the region already has the fill color (with any tolerance). The seed
+    can be given in document coordinates (floats), the pixel that contains it is filled from.
+    """
+    if not (0 <= x < image.size[0] and 0 <= y < image.size[1]):
+        return None
+    x, y = int(x), int(y)
+    import numpy as np
+    from PIL import Image
+    pixels = np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+    # With the zero tolerance the region has the seed's color, the flood fill isn't needed to know it's filled already
+    if tuple(pixels[y, x]) == tuple(rgb[:3]) and tolerance == 0:
+        return None
+    mask = flood_mask(pixels, x, y, tolerance)
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    y1, y2, x1, x2 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    region = mask[y1:y2, x1:x2]
+    # With a tolerance the region can have other colors than the seed's one, it's filled already only if it has none
+    if (pixels[y1:y2, x1:x2][region] == rgb[:3]).all():
+        return None
+    rgba = np.empty(region.shape + (4,), dtype=np.uint8)
+    rgba[:, :, :3] = rgb[:3]
+    rgba[:, :, 3] = region
+    rgba[:, :, 3] *= 255
+    width, height = x2 - x1, y2 - y1
+    # Image shapes are placed by their center, the same way as Tk places images with the default anchor
+    return ImageShape((x1 + width // 2, y1 + height // 2), Image.fromarray(rgba, "RGBA"))
@@ -0,0 +1,111 @@
+from collections import deque
+
+class Command(object):
+    """
+    One undoable edit of the drawing: the objects it added and the objects it removed.
+    Undo hides the added objects and shows the removed ones again, redo does the opposite.
+
+    Attributes
+    ----------
+    added : list
+        objects (shapes) added by the edit
+    removed : list
+        objects (shapes) removed by the edit
+    nbytes : int
+        approximate memory held by the command's objects in bytes
+    """
+
+    __slots__ = ("added", "removed", "nbytes")
+
+    def __init__(self, added=(), removed=()):
+        self.added = list(added)
+        self.removed = list(removed)
+        self.nbytes = sum(object_nbytes(x) for x in self.added) + sum(object_nbytes(x) for x in self.removed)
+
+    def __repr__(self):
+        return "<Command added=%d removed=%d>" % (len(self.added), len(self.removed))
+
+# Objects without nbytes() (e.g. plain canvas item ids) are counted as a fixed size
+def object_nbytes(x):
+    return x.nbytes() if hasattr(x, "nbytes") else 64
+
+class History(object):
+    """
+    Bounded undo/redo history of Commands.
+
+    New work truncates the redo branch, the discarded commands are passed to the discard callback, so their objects
+    can be deleted for real. When the history is deeper than depth or holds more than budget bytes, the oldest commands
+    are collapsed into the flattened base: they can't be undone anymore and are passed to the flatten callback.
+
+    Attributes
+    ----------
+    depth : int
+        maximal number of undoable commands
+    budget : int
+        maximal memory (in bytes) held by the commands in the history
+    nbytes : int
+        memory currently held by the commands in the history
+    flattened : int
+        number of commands collapsed into the flattened base so far
+    """
+
+    DEFAULT_DEPTH = 100
+    DEFAULT_BUDGET = 64 * 1024 * 1024
+
+    def __init__(self, depth=DEFAULT_DEPTH, budget=DEFAULT_BUDGET, discard=None, flatten=None):
+        self.depth = depth
+        self.budget = budget
+        self.discard = discard
+        self.flatten = flatten
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+        self.flattened = 0
+
+    def __len__(self):
+        return len(self.undo_stack)
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    # Records a new command, the redo branch is discarded and the history is trimmed to its depth and budget
+    def push(self, command):
+        while self.redo_stack:
+            discarded = self.redo_stack.pop()
+            self.nbytes -= discarded.nbytes
+            if self.discard:
+                self.discard(discarded)
+        self.undo_stack.append(command)
+        self.nbytes += command.nbytes
+        self.trim()
+
+    # Collapses the oldest commands into the flattened base until the history fits into depth and budget,
+    # at least count commands are collapsed
+    def trim(self, count=0):
+        while self.undo_stack and (count > 0 or len(self.undo_stack) > self.depth or
+                                   (self.nbytes > self.budget and len(self.undo_stack) > 1)):
+            command = self.undo_stack.popleft()
+            self.nbytes -= command.nbytes
+            self.flattened += 1
+            count -= 1
+            if self.flatten:
+                self.flatten(command)
+
+    # Moves the last command to the redo stack and returns it (None if there is nothing to undo)
+    def undo(self):
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack.pop()
+        self.redo_stack.append(command)
+        return command
+
+    # Moves the last undone command back to the undo stack and returns it (None if there is nothing to redo)
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack.pop()
+        self.undo_stack.append(command)
+        return command
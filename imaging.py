@@ -0,0 +1,134 @@
+from collections import OrderedDict
+import os
+import queue
+import threading
+
+# Converts a PIL image into binary PPM data that Tk PhotoImage can read from memory (PhotoImage(data=..., format="PPM"))
+def ppm_data(image):
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return ("P6 %d %d 255 " % image.size).encode("ascii") + image.tobytes()
+
+# Images with more pixels (after resizing) are imported as a tile pyramid instead of one PhotoImage
+TILED_PIXELS = 4096 * 4096
+
+class LoadedImage(object):
+    """
+    Decoded and resized image ready to be placed on the canvas.
+
+    Attributes
+    ----------
+    image : Image
+        the resized PIL image in RGB mode (None for very large images)
+    ppm : bytes
+        PPM data of the image for PhotoImage (None for very large images)
+    pyramid : TilePyramid
+        tile pyramid of a very large image, the image isn't resized, it's displayed in the size given by size
+    size : tuple
+        (width, height) of the displayed image
+    """
+
+    __slots__ = ("image", "ppm", "pyramid", "size")
+
+    def __init__(self, image, ppm, pyramid=None, size=None):
+        self.image = image
+        self.ppm = ppm
+        self.pyramid = pyramid
+        self.size = size or image.size
+
+    def nbytes(self):
+        return len(self.ppm) * 2 if self.pyramid is None else self.pyramid.nbytes()
+
+# Opens and resizes the image, runs on the worker thread (Pillow is imported by the first import of an image)
+def decode(path, factor):
+    from PIL import Image as Img
+    image = Img.open(path)
+    width, height = image.size
+    size = (max(1, int(width * factor)), max(1, int(height * factor)))
+    # JPEG images can be decoded directly in a reduced size, which is much faster than decoding the full image
+    image.draft("RGB", size)
+    if size[0] * size[1] > TILED_PIXELS:
+        from tiles import TilePyramid
+        return LoadedImage(None, None, TilePyramid(image), size)
+    image = image.convert("RGB")
+    if image.size != size:
+        image = image.resize(size, Img.LANCZOS)
+    return LoadedImage(image, ppm_data(image))
+
+class ImageLoader(object):
+    """
+    Decodes and resizes images on a worker thread, so the Tk thread isn't blocked while large photos are resized.
+    Results are handed back to the Tk thread by polling the result queue with after(), callbacks always run on the Tk thread.
+    Decoded images are kept in an LRU cache keyed on the path, mtime and resize factor, so importing the same image again is instant.
+
+    Attributes
+    ----------
+    root : Tk
+        the Tk root used to schedule the result polling
+    cache_size : int
+        maximal number of cached images
+    cache_bytes : int
+        maximal memory used by the cached images in bytes
+    """
+
+    POLL_MS = 20
+    DEFAULT_CACHE_SIZE = 16
+    DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, root, cache_size=DEFAULT_CACHE_SIZE, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.root = root
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = 0
+        self.worker = None
+
+    # Loads the image and calls callback(LoadedImage) or errback(exception) on the Tk thread
+    def load(self, path, factor, callback, errback):
+        try:
+            key = (os.path.abspath(path), os.path.getmtime(path), factor)
+        except OSError as error:
+            errback(error)
+            return
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            callback(self.cache[key])
+            return
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.work, name="ImageLoader", daemon=True)
+            self.worker.start()
+        self.jobs.put((key, path, factor, callback, errback))
+        self.pending += 1
+        if self.pending == 1:
+            self.root.after(self.POLL_MS, self.poll)
+
+    # Worker thread loop, only PIL work is done here, Tk objects are created on the Tk thread
+    def work(self):
+        while True:
+            key, path, factor, callback, errback = self.jobs.get()
+            try:
+                self.results.put((key, callback, decode(path, factor)))
+            except Exception as error:
+                self.results.put((key, errback, error))
+
+    # Delivers finished results to their callbacks, polling continues while some loads are pending
+    def poll(self):
+        while True:
+            try:
+                key, function, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            if isinstance(result, LoadedImage):
+                self.remember(key, result)
+            function(result)
+        if self.pending:
+            self.root.after(self.POLL_MS, self.poll)
+
+    def remember(self, key, loaded):
+        self.cache[key] = loaded
+        total = sum(item.nbytes() for item in self.cache.values())
+        while len(self.cache) > 1 and (len(self.cache) > self.cache_size or total > self.cache_bytes):
+            total -= self.cache.popitem(last=False)[1].nbytes()
@@ -0,0 +1,238 @@
+"""
+Opt-in instrumentation of the Paint application (Paint(instrument=True) or PAINT_INSTRUMENT=1 in main.py).
+
+The event handlers (tool dispatch, undo/redo) are wrapped only when the instrumentation is enabled, a Paint without it
+runs the original handlers, so the disabled instrumentation costs nothing. Image imports are measured from the import
+request to the image on the canvas: the image is decoded on the ImageLoader worker thread, so the time of the import
+handler alone would be only the time of the dialogs and of queueing the job.
+"""
+import cProfile
+import json
+import time
+
+class Histogram(object):
+    """
+    Low-overhead latency histogram with power of two buckets in microseconds (bucket i counts durations
+    in [2^(i-1), 2^i) us), adding a sample is a few integer operations.
+
+    Attributes
+    ----------
+    buckets : list
+        sample counts of the buckets
+    count : int
+        number of samples
+    total : float
+        sum of the samples in seconds
+    max : float
+        the largest sample in seconds
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.buckets = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[min(int(seconds * 1000000).bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Upper bound of the bucket that contains the given fraction of the samples in milliseconds
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min((1 << index) / 1000.0, 1000 * self.max)
+        return 1000 * self.max
+
+    def summary(self):
+        return {"count": self.count, "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+                "p50_ms": self.percentile(0.5), "p90_ms": self.percentile(0.9), "p99_ms": self.percentile(0.99),
+                "max_ms": 1000 * self.max}
+
+class Instrumentation(object):
+    """
+    Latency histograms of the Paint handlers, counters of the drawing state, an optional on-canvas HUD with the frame
+    time and the event rate and an optional cProfile profiler.
+
+    Attributes
+    ----------
+    paint : Paint
+        the instrumented application
+    histograms : dict
+        latency Histogram of every wrapped handler (handler name -> Histogram)
+    frames : Histogram
+        time between two HUD frames (the Tk event loop delay), collected while the HUD is shown
+    image_loads : Histogram
+        image load latency from import_path() to the image_loaded() or image_failed() callback
+    events : int
+        number of handled events
+    hud : bool
+        True if the HUD is shown
+    profiler : Profile
+        the running cProfile profiler (None if profiling is off)
+    """
+
+    HANDLERS = ("start", "motion", "end", "mouse_right", "undo", "redo")
+    FRAME_MS = 16
+    HUD_MS = 500
+
+    def __init__(self, paint, hud=False, profile=False):
+        self.paint = paint
+        self.histograms = {}
+        self.frames = Histogram()
+        self.image_loads = Histogram()
+        self.events = 0
+        self.hud = False
+        self.hud_timer = None
+        self.profiler = None
+        for name in self.HANDLERS:
+            setattr(paint, name, self.wrap(name, getattr(paint, name)))
+        paint.import_path = self.wrap_import(paint.import_path)
+        # The canvas binds, key binds and menu commands still refer to the original handlers
+        paint.bind_canvas()
+        paint.bind_keys()
+        if hud:
+            self.toggle_hud()
+        if profile:
+            self.toggle_profile()
+
+    def wrap(self, name, handler):
+        histogram = self.histograms[name] = Histogram()
+        clock = time.perf_counter
+        def wrapper(*args):
+            self.events += 1
+            start = clock()
+            try:
+                return handler(*args)
+            finally:
+                histogram.add(clock() - start)
+        return wrapper
+
+    # The callbacks of every import are wrapped while import_path() runs (the ImageLoader takes them then, cached
+    # and missing images call them right away), the loaded image is measured on the canvas, the error dialog
+    # of a failed load isn't measured
+    def wrap_import(self, import_path):
+        paint = self.paint
+        image_loaded, image_failed = paint.image_loaded, paint.image_failed
+        clock = time.perf_counter
+        def wrapper(*args):
+            start = clock()
+            def loaded_wrapper(loaded):
+                try:
+                    return image_loaded(loaded)
+                finally:
+                    self.image_loads.add(clock() - start)
+            def failed_wrapper(error):
+                self.image_loads.add(clock() - start)
+                return image_failed(error)
+            paint.image_loaded, paint.image_failed = loaded_wrapper, failed_wrapper
+            try:
+                return import_path(*args)
+            finally:
+                paint.image_loaded, paint.image_failed = image_loaded, image_failed
+        return wrapper
+
+    # Drawing state counters: canvas items, hidden shapes, layers, pen points received and kept (after the decimation
+    # and simplification), undo/redo stack depth and memory of the PhotoImages
+    def counters(self):
+        paint = self.paint
+        view = paint.view
+        photo_bytes = sum(photo.width() * photo.height() * 4 for photo in view.photos.values())
+        photo_bytes += sum(tiled.nbytes for tiled in view.tiled.values())
+        backgrounds = paint.layer_images.backgrounds.values()
+        photo_bytes += sum(background.photo.width() * background.photo.height() * 4
+                           for background in backgrounds if background.photo is not None)
+        return {
+            "canvas_items": len(paint.c.find_all()) - len(paint.c.find_withtag("hud")),
+            "shapes": len(paint.scene),
+            "live_shapes": len(view),
+            "materialized_shapes": len(view.items),
+            "zoom": view.zoom,
+            "hidden_shapes": sum(1 for shape in paint.scene if shape.hidden),
+            "baked_shapes": sum(len(background.shapes) for background in backgrounds),
+            "layers": len(paint.scene.layers),
+            "pen_points_received": paint.pen_points_received,
+            "pen_points_kept": paint.pen_points_kept,
+            "undo_depth": len(paint.history.undo_stack),
+            "redo_depth": len(paint.history.redo_stack),
+            "history_bytes": paint.history.nbytes,
+            "photo_bytes": photo_bytes,
+        }
+
+    def snapshot(self):
+        return {
+            "time": time.time(),
+            "events": self.events,
+            "handlers": {name: histogram.summary() for name, histogram in self.histograms.items() if histogram.count},
+            "frames": self.frames.summary(),
+            "image_load": self.image_loads.summary(),
+            "counters": self.counters(),
+        }
+
+    # Writes the JSON snapshot into path, the profile (if profiling is on) is written next to it with the .prof suffix
+    def dump(self, path):
+        with open(path, "w") as file:
+            json.dump(self.snapshot(), file, indent=2)
+        if self.profiler is not None:
+            profile_path = (path[:-5] if path.endswith(".json") else path) + ".prof"
+            self.profiler.dump_stats(profile_path)
+            return [path, profile_path]
+        return [path]
+
+    def toggle_profile(self):
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler.disable()
+            self.profiler = None
+
+    def toggle_hud(self):
+        self.hud = not self.hud
+        if self.hud:
+            self.last_frame = self.last_hud = time.perf_counter()
+            self.hud_events = self.events
+            self.period = Histogram()
+            self.hud_timer = self.paint.root.after(self.FRAME_MS, self.frame)
+        else:
+            self.paint.root.after_cancel(self.hud_timer)
+            self.paint.c.delete("hud")
+
+    # Runs every FRAME_MS while the HUD is shown, a late frame means the event loop was blocked
+    def frame(self):
+        now = time.perf_counter()
+        self.frames.add(now - self.last_frame)
+        self.period.add(now - self.last_frame)
+        self.last_frame = now
+        if now - self.last_hud >= self.HUD_MS / 1000.0:
+            self.draw_hud(now)
+        self.hud_timer = self.paint.root.after(self.FRAME_MS, self.frame)
+
+    def draw_hud(self, now):
+        rate = (self.events - self.hud_events) / (now - self.last_hud)
+        self.last_hud, self.hud_events = now, self.events
+        counters = self.counters()
+        text = "frame p50 %.0f ms, max %.0f ms | %.0f events/s | items %d, hidden %d | pen points %d/%d | undo %d, redo %d | photos %.1f MB" % (
+            self.period.percentile(0.5), 1000 * self.period.max, rate, counters["canvas_items"], counters["hidden_shapes"],
+            counters["pen_points_kept"], counters["pen_points_received"], counters["undo_depth"], counters["redo_depth"],
+            counters["photo_bytes"] / 1048576)
+        # The HUD shows the frame statistics of the last period only
+        self.period = Histogram()
+        c = self.paint.c
+        # The HUD stays in the upper left corner of the window when the canvas is scrolled
+        if c.find_withtag("hud"):
+            c.itemconfigure("hud", text=text)
+            c.coords("hud", c.canvasx(4), c.canvasy(4))
+        else:
+            c.create_text(c.canvasx(4), c.canvasy(4), anchor="nw", text=text, fill="#c00000", font=("Courier", 8), tags="hud")
+        c.tag_raise("hud")
@@ -1,3 +1,4 @@
+import os
 import platform
 from paint import Paint
 if platform.system() == "Windows":
@@ -6,4 +7,6 @@ if platform.system() == "Windows":
 if __name__ == "__main__":
     if platform.system() == "Windows":
         win_dpi_fix()
-    Paint()
\ No newline at end of file
+    # PAINT_INSTRUMENT=1 enables the performance instrumentation (Debug menu)
+    paint = Paint(instrument=bool(os.environ.get("PAINT_INSTRUMENT")), mainloop=False)
+    paint.root.mainloop()
\ No newline at end of file
@@ -2,10 +2,23 @@ from tkinter import *
 from tkinter.colorchooser import askcolor
 from tkinter.filedialog import asksaveasfilename, askopenfilename
 from tkinter.simpledialog import askfloat
-from tkinter.messagebox import showinfo, showerror, askyesnocancel
+from tkinter.messagebox import showinfo, showerror, askyesno, askyesnocancel
+import os
 import pathlib
-from PIL import Image as Img
-import pyscreenshot as ImageGrab
+import textwrap
+from array import array
+from types import SimpleNamespace
+from stroke import Stroke
+from scene import Scene, PenShape, LineShape, CircleShape, RectangleShape, PolygonShape, PointShape, ImageShape, TextShape
+from view import CanvasView, font_metrics
+from history import History, Command
+from background import LayerImages
+from imaging import ImageLoader
+from project import ProjectFile, ProjectReader, ProjectError
+from autosave import Autosave, autosave_directory
+from preview import Preview
+from spatial import erase, eraser_discs
+from fill import fill_shape, DEFAULT_TOLERANCE
 
 class Paint(object):
     """
@@ -14,13 +27,34 @@ class Paint(object):
     Attributes
     ----------
     default_canvas_width : int
-        the width of the drawing area (600 by default)
+        the width of the canvas window and of a new document, the document grows when the drawing is extended
+        beyond it (600 by default)
     default_canvas_height : int
-        the width of the drawing area (600 by default)
+        the height of the canvas window and of a new document (600 by default)
     default_color : string
         the default color used at the start of the application ("black" by default)
     default_pen_size : int
         the default pen (tool outline) size used at the start of the application (5 by default)
+    pen_simplify : float
+        tolerance of the Ramer-Douglas-Peucker pass applied to finished pen strokes, None disables it (1.0 by default)
+    png_scale : float
+        scale factor of the PNG export (1.0 by default)
+    history_depth : int
+        maximal number of undo steps (100 by default)
+    history_budget : int
+        maximal memory held by the undo history in bytes (64 MB by default)
+    flatten : bool
+        if True, shapes that can't be undone anymore are baked into a raster background layer (True by default)
+    flatten_items : int
+        if there are more live canvas items, the oldest undo steps are flattened and baked (2000 by default)
+    autosave : bool
+        if True, the drawing is autosaved in the background and restoring it is offered at the startup (True by default)
+    instrument : bool
+        if True, the handlers are instrumented (see instrument.py) and the Debug menu with the performance HUD
+        and snapshots is shown (False by default)
+    mainloop : bool
+        if False, the constructor returns without running the Tk mainloop, the caller runs root.mainloop() or drives
+        the window itself (e.g. the event replay in replay.py) (True by default)
     """
 
     # Default values for Paint app that can be changed
@@ -28,23 +62,49 @@ class Paint(object):
     DEFAULT_COLOR = "black"
     DEFAULT_CANVAS_WIDTH = 600
     DEFAULT_CANVAS_HEIGHT = 600
+    DEFAULT_PEN_SIMPLIFY = 1.0
+    DEFAULT_PNG_SCALE = 1.0
+    DEFAULT_HISTORY_DEPTH = History.DEFAULT_DEPTH
+    DEFAULT_HISTORY_BUDGET = History.DEFAULT_BUDGET
+    DEFAULT_FLATTEN_ITEMS = 2000
+    # Number of project file records read and shapes drawn in one step of the project loading
+    LOAD_BATCH = 500
+    TEXT_FONT = ("Courier", 12)
+    # Eraser radius in multiples of the pen size
+    ERASER_SCALE = 2
+    # Zoom factor of one zoom in step
+    ZOOM_STEP = 1.25
     
     def __init__(self, default_canvas_width=DEFAULT_CANVAS_WIDTH, default_canvas_height=DEFAULT_CANVAS_HEIGHT, 
-                 default_color=DEFAULT_COLOR, default_pen_size=DEFAULT_PEN_SIZE):
+                 default_color=DEFAULT_COLOR, default_pen_size=DEFAULT_PEN_SIZE, pen_simplify=DEFAULT_PEN_SIMPLIFY,
+                 png_scale=DEFAULT_PNG_SCALE, history_depth=DEFAULT_HISTORY_DEPTH, history_budget=DEFAULT_HISTORY_BUDGET,
+                 flatten=True, flatten_items=DEFAULT_FLATTEN_ITEMS, autosave=True, instrument=False, mainloop=True):
         
         self.default_canvas_width = default_canvas_width
         self.default_canvas_height = default_canvas_height
         self.default_color = default_color
         self.default_pen_size = default_pen_size
+        self.pen_simplify = pen_simplify
+        self.png_scale = png_scale
+        self.history_depth = history_depth
+        self.history_budget = history_budget
+        self.flatten = flatten
+        self.flatten_items = flatten_items
+        self.autosave = autosave
         
         self.root = Tk()
+        # Images are decoded on a worker thread, the loader lives as long as the window, so its cache survives new files
+        self.image_loader = ImageLoader(self.root)
         
         # Top GUI menubar that consists of menu1, menu2 and menu3
         self.menubar = Menu(self.root)
         self.menu1 = Menu(self.menubar, tearoff=0)
         self.menu1.add_command(label="New file", command=self.new_file)
+        self.menu1.add_command(label="Open project... (Ctrl+O)", command=self.open_project)
         self.menu1.add_command(label="Save (Ctrl+S)", command=self.save)
         self.menu1.add_command(label="Save as... (Ctrl+A)", command=self.save_as)
+        self.menu1.add_command(label="Autosave statistics", command=self.show_autosave_stats)
+        self.menu1.add_command(label="PNG export scale...", command=self.choose_png_scale)
         self.menubar.add_cascade(label="File", menu=self.menu1)
         
         self.menu2 = Menu(self.menubar, tearoff=0)
@@ -56,6 +116,24 @@ class Paint(object):
         self.menu3.add_command(label="Import image", command=self.import_img)
         self.menubar.add_cascade(label="Import", menu=self.menu3)
         
+        self.menu4 = Menu(self.menubar, tearoff=0)
+        self.menu4.add_command(label="Zoom in (Ctrl++)", command=self.zoom_in)
+        self.menu4.add_command(label="Zoom out (Ctrl+-)", command=self.zoom_out)
+        self.menu4.add_command(label="Actual size (Ctrl+0)", command=self.zoom_reset)
+        self.menubar.add_cascade(label="View", menu=self.menu4)
+        
+        # Layers menu is filled by update_layers_menu(): the layer commands and the list of layers (the checked one is active)
+        self.menu5 = Menu(self.menubar, tearoff=0)
+        self.menubar.add_cascade(label="Layers", menu=self.menu5)
+        self.layer_variable = IntVar(self.root)
+        
+        if instrument:
+            self.menu6 = Menu(self.menubar, tearoff=0)
+            self.menu6.add_command(label="Performance HUD", command=lambda: self.instrumentation.toggle_hud())
+            self.menu6.add_command(label="Profile (cProfile)", command=lambda: self.instrumentation.toggle_profile())
+            self.menu6.add_command(label="Dump performance snapshot...", command=self.dump_instrumentation)
+            self.menubar.add_cascade(label="Debug", menu=self.menu6)
+        
         self.root.config(menu=self.menubar)
 
         # 1. row in Tk grid layout
@@ -71,6 +149,9 @@ class Paint(object):
         self.choose_size_button = Scale(self.root, from_=1, to=10, orient=HORIZONTAL, label="Size")
         self.choose_size_button.grid(row=0, column=3)
         
+        self.choose_tolerance_button = Scale(self.root, from_=0, to=255, orient=HORIZONTAL, label="Tolerance")
+        self.choose_tolerance_button.grid(row=0, column=4)
+        
         # 2. row in Tk grid layout
         self.pen_button = Button(self.root, text="Pen", command=self.use_pen)
         self.pen_button.grid(row=1, column=0)
@@ -92,111 +173,194 @@ class Paint(object):
         
         self.text_button = Button(self.root, text="Text", command=self.use_text)
         self.text_button.grid(row=1,column=6)
+        
+        self.fill_button = Button(self.root, text="Fill", command=self.use_fill)
+        self.fill_button.grid(row=1,column=7)
 
-        # Canvas implementation with default dimensions
+        # Canvas implementation with default dimensions, the document is scrolled by the scrollbars, the mouse wheel
+        # (Shift+wheel horizontally) and by dragging with the middle button, Ctrl+wheel zooms
         self.c = Canvas(self.root, bg="white", width=self.default_canvas_width, height=self.default_canvas_height)
-        self.c.grid(row=2, columnspan=7)
+        self.c.grid(row=2, columnspan=8)
+        self.vertical_scrollbar = Scrollbar(self.root, orient=VERTICAL, command=self.scroll_y)
+        self.vertical_scrollbar.grid(row=2, column=8, sticky=NS)
+        self.horizontal_scrollbar = Scrollbar(self.root, orient=HORIZONTAL, command=self.scroll_x)
+        self.horizontal_scrollbar.grid(row=3, column=0, columnspan=8, sticky=EW)
+        self.c.config(xscrollcommand=self.horizontal_scrollbar.set, yscrollcommand=self.vertical_scrollbar.set)
 
+        # Background autosave service is created by the first setup(), which also offers to restore the last autosave
+        self.autosave_service = None
+        # Text widget of the text box that is being typed in (None if there is none)
+        self.text_widget = None
+        # Canvas view of the drawing, created by setup()
+        self.view = None
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        
         # Tk GUI setup and mainloop to run the Tcl window in a loop
         self.setup()
-        self.root.mainloop()
+        # Opt-in instrumentation wraps the handlers, without it the handlers run unwrapped (and it isn't imported)
+        self.instrumentation = None
+        if instrument:
+            from instrument import Instrumentation
+            self.instrumentation = Instrumentation(self)
+        if mainloop:
+            self.root.mainloop()
 
     # Variable definitions used in the program and default settings 
     def setup(self):
         # Window setup and project_path definition using pathlib library
         self.root.title("New file - Tkinter Paint")
         self.project_path = pathlib.Path(__file__).parent.absolute()
+        # A text box that wasn't committed belongs to the previous drawing
+        if self.text_widget is not None:
+            self.text_widget.destroy()
+            self.text_widget = None
         
         # Main variables, counters and default settings
-        self.old_x = None
-        self.old_y = None
+        self.stroke = None
+        self.stroke_shape = None
+        # Pen stroke counters: points received from motion events versus points kept in the canvas polylines
+        self.pen_points_received = 0
+        self.pen_points_kept = 0
         self.size = self.default_pen_size
         self.choose_size_button.set(self.default_pen_size)
-        self.paint_color = self.default_color
+        self.choose_tolerance_button.set(DEFAULT_TOLERANCE)
+        self.paint_color = self.outline_color = self.default_color
         self.current_color.config(bg=self.paint_color)
-        self.eraser_on = False
         self.active_button = self.pen_button
         self.use_pen()
         self.text_created = False
-        self.index = 0
-        self.img_counter = 0
         self.file_dir = ""
+        # Native project file (.tkp) the drawing is saved to incrementally, loading is True while a project file is loaded
+        self.project = None
+        self.loading = False
+        
+        # Document model of the drawing, the raster images of its layers (the active layer's one has the baked (flattened)
+        # shapes under the live canvas items, the other layers are cached as a whole) and the canvas view that displays
+        # the live shapes of the active layer (the materialization scheduled by the previous view is cancelled)
+        if self.view is not None:
+            self.view.clear()
+        self.scene = Scene(self.default_canvas_width, self.default_canvas_height)
+        self.layer_images = LayerImages(self.c, self.scene)
+        self.background = self.layer_images[self.layer_images.active]
+        self.view = CanvasView(self.c, self.scene, self.layer_images)
+        self.c.xview_moveto(0)
+        self.c.yview_moveto(0)
+        self.view.refresh()
+        self.update_layers_menu()
+        
+        # Undo/redo history of commands, discarded and flattened commands delete their objects for real
+        self.history = History(self.history_depth, self.history_budget, 
+                               discard=self.discard_command, flatten=self.flatten_command)
+        
+        # Rubber-band previews of the tools (one reused canvas item per tool, updated at most once per frame)
+        self.preview = Preview(self.c, self.view)
         
         # Stacks/lists used in tool functions
-        self.Pen_objects = []
-        self.Line_objects = []
-        self.Circle_objects = []
-        self.Rectangle_objects = []
-        self.Polygon_objects = []
-        self.Point_objects = []
-        self.Image_objects = []
         self.polygon_points = []
-        self.polygon_temp = []
-        self.stack = []
         
         # Basic key/mouse binds
+        self.bind_canvas()
+        self.c.bind("<Configure>", self.view.refresh)
+        self.bind_navigation()
+        self.bind_keys()
+        
+        # Autosave service and crash recovery: if a session didn't end normally, its autosave file is left without
+        # a running owner, this session takes it over (the recovered drawing is autosaved into it)
+        if self.autosave and self.autosave_service is None:
+            self.autosave_service = Autosave(self.root, autosave_directory(), self.autosave_snapshot)
+            if self.autosave_service.recover():
+                if askyesno("Restore drawing?", "The last session didn't end normally. Do you want to restore the autosaved drawing?"):
+                    self.load_project(self.autosave_service.path, recovered=True)
+                else:
+                    self.autosave_service.discard()
+    
+    # Mouse binds of the drawing tools (unbound while a project is being loaded)
+    def bind_canvas(self):
         self.c.bind('<Button-1>', self.start)
         self.c.bind('<B1-Motion>', self.motion)
         self.c.bind('<ButtonRelease-1>', self.end)
         self.c.bind("<Button-3>", self.mouse_right)
+    def unbind_canvas(self):
+        for sequence in ('<Button-1>', '<B1-Motion>', '<ButtonRelease-1>', "<Button-3>"):
+            self.c.unbind(sequence)
+    
+    # Mouse binds of the scrolling and zooming (the mouse wheel is <MouseWheel> on Windows and macOS, buttons 4 and 5 on X11)
+    def bind_navigation(self):
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.c.bind(sequence, self.wheel)
+        self.c.bind("<Button-2>", self.pan_start)
+        self.c.bind("<B2-Motion>", self.pan)
+    
+    # Key binds and the Edit and Import menu commands (bound again when the handlers are wrapped, e.g. by the event recorder)
+    def bind_keys(self):
         self.root.bind("<Control-z>", self.undo)
         self.root.bind("<Control-y>", self.redo)
         self.root.bind("<Control-s>", self.save)
         self.root.bind("<Control-a>", self.save_as)
+        self.root.bind("<Control-o>", self.open_project)
+        self.root.bind("<Control-plus>", self.zoom_in)
+        self.root.bind("<Control-equal>", self.zoom_in)
+        self.root.bind("<Control-minus>", self.zoom_out)
+        self.root.bind("<Control-Key-0>", self.zoom_reset)
+        self.menu2.entryconfigure(0, command=self.undo)
+        self.menu2.entryconfigure(1, command=self.redo)
+        self.menu3.entryconfigure(0, command=self.import_img)
 
     # Function that sets tool settings triggered by button click
-    def activate_button(self, some_button, eraser_mode=False):
+    # Switching the tool commits the text box that is being typed in
+    def activate_button(self, some_button):
+        self.text_commit()
         self.active_button.config(relief=RAISED)
         some_button.config(relief=SUNKEN)
         self.active_button = some_button
-        self.eraser_on = eraser_mode
-        self.paint_color = self.outline_color = "white" if self.eraser_on else self.paint_color
 
-    # Sets fill color option to white
+    # Eraser removes the shapes under it (pen strokes are cut at the erased span)
     def use_eraser(self):
-        self.activate_button(self.eraser_button, eraser_mode=True)
-        self.current_color.config(bg="white")
+        self.select_tool("eraser")
     
     # Chooses fill color option to be used by tools
     def choose_color(self):
-        self.eraser_on = False
         self.paint_color = self.outline_color = askcolor(color=self.paint_color)[1]
         self.current_color.config(bg=self.paint_color)
     
+    # Selects the tool by its name ("pen", "line", ...) without the tutorial dialogs (also used by the event replay)
+    def select_tool(self, tool):
+        self.tool = tool
+        self.text_created = False
+        self.activate_button(getattr(self, tool + "_button"))
+    
 # Functions triggered by their respective buttons
     def use_pen(self):
-        self.tool = "pen"
-        self.activate_button(self.pen_button)
+        self.select_tool("pen")
     def use_line(self):
-        self.tool = "line"
-        self.activate_button(self.line_button)
+        self.select_tool("line")
     def use_circle(self):
-        self.tool = "circle"
-        self.activate_button(self.circle_button)   
+        self.select_tool("circle")
     def use_rectangle(self):
-        self.tool = "rectangle"
-        self.activate_button(self.rectangle_button)
+        self.select_tool("rectangle")
     # Function uses showinfo function to inform user how to use the tool
     def use_polygon(self):
         showinfo(title="Polygon tutorial", message="Left-click to create polygon points and then right-click to create polygon.")
-        self.tool = "polygon"
-        self.activate_button(self.polygon_button)
+        self.select_tool("polygon")
     def use_point(self):
-        self.tool = "point"
-        self.activate_button(self.point_button)
+        self.select_tool("point")
     def use_text(self):
         showinfo(title="Text tutorial", 
-                 message="""Left-click and drag to create text window and then right-click on canvas to lose focus.
-To create another text window, click the button again. 
-Warning: Text window is always on top of canvas!""")
-        self.tool = "text"
-        self.text_created = False
-        self.activate_button(self.text_button)
+                 message="""Left-click and drag to create text box, type the text and then right-click on canvas to finish it.
+To create another text box, click the button again.""")
+        self.select_tool("text")
+    def use_fill(self):
+        self.select_tool("fill")
             
     # Start function triggered by mouse left button click that checks the current tool setting and triggers their respective functions
+    # The mouse events are converted to the document coordinates first (the canvas can be scrolled and zoomed)
     def start(self, event):
+        event = self.document_event(event)
+        if not self.layer_editable():
+            showinfo(title="Layers", message="The active layer is locked or hidden.")
+            return
         if self.tool == "pen":
-            self.size = self.choose_size_button.get()
+            self.pen_start(event)
         elif self.tool == 'line':
             self.line_start(event)
         elif self.tool == 'circle':
@@ -207,14 +371,20 @@ Warning: Text window is always on top of canvas!""")
             self.polygon_point(event)
         elif self.tool == 'point':
             self.point(event)
-            self.index = len(self.stack) - 1
         elif self.tool == "text":
             if self.text_created == False:
                 self.text_start(event)
+        elif self.tool == "eraser":
+            self.erase_start(event)
+        elif self.tool == "fill":
+            self.fill_at(event)
     
     # Motion function triggered by holding mouse left button that checks the current tool setting and triggers their respective functions
     # Only available to certain tools that use the motion effect
     def motion(self,event):
+        event = self.document_event(event)
+        if not self.layer_editable():
+            return
         if self.tool == "pen":
             self.pen_draw(event)
         elif self.tool == 'line':
@@ -226,53 +396,139 @@ Warning: Text window is always on top of canvas!""")
         elif self.tool == 'text':
             if self.text_created == False:
                 self.text_motion(event)
+        elif self.tool == 'eraser':
+            self.erase_motion(event)
     
     # End function triggered by releasing mouse left button that checks the current tool setting and triggers their respective functions
     def end(self,event):
+        event = self.document_event(event)
+        if not self.layer_editable():
+            return
         if self.tool == 'pen':
-            self.old_x, self.old_y = None, None
-            self.stack.append(self.Pen_objects)
-            self.Pen_objects = []
-            self.index = len(self.stack) - 1
+            self.pen_end(event)
         elif self.tool == 'line':
             self.line_end(event)
-            self.index = len(self.stack) - 1
         elif self.tool == 'circle':
             self.circle_end(event)
-            self.index = len(self.stack) - 1
         elif self.tool == 'rectangle':
             self.rectangle_end(event)
-            self.index = len(self.stack) - 1
         elif self.tool == 'text':
-            # Button-1 release text event first checks if the text was already created, if not then sets the text_created to True,
-            # so another Button-1 click event wouldn't trigger the current Text window redraw
-            # To create another window object, the user is required to click the Text button again to set text_created to False
-            if self.text_created == False:
-                self.text_end(event)
+            # Button-1 release text event first checks if the text was already created, if not (and the text box was created)
+            # then sets the text_created to True, so another Button-1 click event wouldn't create another text box
+            # To create another text box, the user is required to click the Text button again to set text_created to False
+            if self.text_created == False and self.text_end(event):
                 self.text_created = True
                 self.text_button.config(relief=RAISED)
-                self.index = len(self.stack) - 1
+        elif self.tool == 'eraser':
+            self.erase_end(event)
 
     def mouse_right(self, event):
+        event = self.document_event(event)
         # Available to Polygon function to trigger the creation of polygon
         if self.tool == "polygon":
             self.polygon_finish(event)
-            self.index = len(self.stack) - 1
-        # If the Text widget/window has the active focus (text pointer), then any mouse_right event will disable it
+        # If the Text widget has the active focus (text pointer), then any mouse_right event commits the text and disables it
+        self.text_commit()
         self.root.focus_set()
                 
-    # Motion function for pen tool
+    # Mouse event in the document coordinates
+    def document_event(self, event):
+        x, y = self.view.to_document(event.x, event.y)
+        return SimpleNamespace(x=x, y=y)
+    
+    # Adds a finished shape to the active layer of the document model, draws it on the canvas (unless it was drawn already,
+    # e.g. a pen stroke) and records it in the undo history
+    def add_shape(self, shape, photo=None):
+        shape.layer = self.layer_images.active.uid
+        self.scene.add(shape)
+        self.view.draw(shape, photo)
+        self.history.push(Command([shape]))
+        self.check_flatten()
+        self.edited()
+        return shape
+    
+    # Every edit of the drawing is counted by the autosave service
+    def edited(self):
+        if self.autosave_service:
+            self.autosave_service.edit()
+    
+    # Immutable snapshot of the drawing taken by the autosave service on the Tk thread
+    def autosave_snapshot(self):
+        return tuple(self.scene.visible()), self.settings()
+    
+    # Hides or shows a shape from the history, erased baked shapes are not in the view, so they're drawn again
+    # The history goes through all the layers, a shape of another layer is shown or hidden in its layer image
+    def set_hidden(self, shape, hidden):
+        if shape.layer != self.layer_images.active.uid:
+            shape.hidden = hidden
+            self.layer_images.backgrounds[shape.layer].update(shape)
+        elif not hidden and shape not in self.view:
+            shape.hidden = False
+            self.view.draw(shape)
+        else:
+            self.view.set_hidden(shape, hidden)
+    
+    # Deletes a shape for real: its canvas item, PhotoImage and its record in the document model
+    def delete_object(self, shape):
+        self.view.delete(shape)
+        self.layer_images.backgrounds[shape.layer].discard(shape)
+        self.scene.remove(shape)
+    
+    # Commands from the truncated redo branch: the objects they added were never redone, so they are deleted
+    def discard_command(self, command):
+        for x in command.added:
+            self.delete_object(x)
+    
+    # Commands collapsed into the flattened base can't be undone anymore, so the objects they removed are deleted
+    # and (in flatten mode) the shapes they added are baked into the raster background and their canvas items are deleted
+    # (shapes erased by a later command are hidden, they stay canvas items until the erasing is flattened or undone)
+    def flatten_command(self, command):
+        for x in command.removed:
+            self.delete_object(x)
+        if self.flatten:
+            shapes = [x for x in command.added if x in self.view and not x.hidden]
+            self.background.bake(shapes)
+            for shape in shapes:
+                self.view.delete(shape)
+            # Live shapes of the other layers are drawn in their layer images already, they only become baked shapes
+            for shape in command.added:
+                if not shape.hidden and shape.layer != self.layer_images.active.uid:
+                    self.layer_images.backgrounds[shape.layer].bake([shape])
+    
+    # If there are too many live shapes, the oldest undo steps are flattened until only 3/4 of flatten_items are left,
+    # so the baking doesn't run after every new shape, then the dirty rectangles are copied to the layer PhotoImages
+    def check_flatten(self):
+        if self.flatten and len(self.view) > self.flatten_items:
+            while self.history.can_undo() and len(self.view) > self.flatten_items * 3 // 4:
+                self.history.trim(1)
+        self.layer_images.flush()
+    
+    # Pen tool start, motion and end effect
+    # The whole stroke is one canvas line item that grows with coords(), redundant points are dropped by the Stroke object
+    def pen_start(self, event):
+        self.size = self.choose_size_button.get()
+        self.stroke = Stroke(event.x, event.y)
+        self.stroke_shape = None
     def pen_draw(self, event):
-        if self.old_x and self.old_y:
-            self.Pen_objects.append(
-                self.c.create_line(
-                    self.old_x, self.old_y, event.x, event.y,
-                    width=self.size, fill=self.paint_color,
-                    capstyle=ROUND, smooth=TRUE, splinesteps=36
-                    )
-                )
-        self.old_x = event.x
-        self.old_y = event.y
+        if self.stroke is None:
+            return
+        if self.stroke.add(event.x, event.y):
+            if self.stroke_shape is None:
+                self.stroke_shape = PenShape(self.stroke.coords(), fill=self.paint_color, width=self.size)
+                self.view.draw(self.stroke_shape)
+            else:
+                self.stroke_shape.coords = array("f", self.stroke.coords())
+                self.view.update(self.stroke_shape)
+    def pen_end(self, event):
+        # A click without any motion doesn't create a stroke
+        if self.stroke is not None and self.stroke_shape is not None:
+            self.stroke_shape.coords = array("f", self.stroke.finish(self.pen_simplify))
+            self.view.update(self.stroke_shape)
+            self.pen_points_received += self.stroke.received
+            self.pen_points_kept += self.stroke.kept
+            self.add_shape(self.stroke_shape)
+        self.stroke = None
+        self.stroke_shape = None
 
     # Line tool start, motion and end effect
     def line_start(self,event):
@@ -280,15 +536,12 @@ Warning: Text window is always on top of canvas!""")
         self.line_start_x=event.x
         self.line_start_y=event.y
     def line_motion(self,event):
-        self.c.delete("temp_line_objects")
-        self.c.create_line(self.line_start_x, self.line_start_y, event.x, event.y, 
-                           width=self.size, fill=self.paint_color, smooth=1, tags="temp_line_objects")
+        self.preview.show("line", "line", (self.line_start_x, self.line_start_y, event.x, event.y), 
+                          width=self.size, fill=self.paint_color, smooth=1)
     def line_end(self, event):
-        self.c.delete("temp_line_objects")
-        x = self.c.create_line(self.line_start_x, self.line_start_y, event.x, event.y, 
-                               width=self.size, fill=self.paint_color, smooth=1)
-        self.Line_objects.append(x)
-        self.stack.append(x)
+        self.preview.hide("line")
+        self.add_shape(LineShape((self.line_start_x, self.line_start_y, event.x, event.y), 
+                                 fill=self.paint_color, width=self.size))
         return event.x, event.y
 
     # Circle tool start, motion and end effect
@@ -296,58 +549,50 @@ Warning: Text window is always on top of canvas!""")
         self.circle_start_x = event.x
         self.circle_start_y = event.y
     def circle_motion(self,event):
-        self.c.delete("temp_circle_objects")
-        self.c.create_oval(self.circle_start_x, self.circle_start_y, event.x, event.y, 
-                           fill=self.paint_color, outline=self.outline_color, tags="temp_circle_objects")
+        self.preview.show("circle", "oval", (self.circle_start_x, self.circle_start_y, event.x, event.y), 
+                          fill=self.paint_color, outline=self.outline_color)
     def circle_end(self, event):
-        self.c.delete("temp_circle_objects")
-        x = self.c.create_oval(self.circle_start_x, self.circle_start_y, event.x, event.y, 
-                               fill=self.paint_color, outline=self.outline_color)
-        self.Circle_objects.append(x)
-        self.stack.append(x)
+        self.preview.hide("circle")
+        self.add_shape(CircleShape((self.circle_start_x, self.circle_start_y, event.x, event.y), 
+                                   fill=self.paint_color, outline=self.outline_color))
     
     # Rectangle tool start, motion and end effect
     def rectangle_start(self,event):
         self.rectangle_start_x = event.x
         self.rectangle_start_y = event.y
     def rectangle_motion(self,event):
-        self.c.delete("temp_rectangle_objects")
-        self.c.create_rectangle(self.rectangle_start_x, self.rectangle_start_y, event.x, event.y, 
-                           fill=self.paint_color, outline=self.outline_color, tags="temp_rectangle_objects")
+        self.preview.show("rectangle", "rectangle", (self.rectangle_start_x, self.rectangle_start_y, event.x, event.y), 
+                          fill=self.paint_color, outline=self.outline_color)
     def rectangle_end(self, event):
-        self.c.delete("temp_rectangle_objects")
-        x = self.c.create_rectangle(self.rectangle_start_x, self.rectangle_start_y, event.x, event.y, 
-                               fill=self.paint_color, outline=self.outline_color)
-        self.Rectangle_objects.append(x)
-        self.stack.append(x)
+        self.preview.hide("rectangle")
+        self.add_shape(RectangleShape((self.rectangle_start_x, self.rectangle_start_y, event.x, event.y), 
+                                      fill=self.paint_color, outline=self.outline_color))
     
     # Polygon points used to define the polygon corners
+    # The points are previewed by one reused line item with round caps and joins: the corners are shown as dots of pen size
+    # connected by the polygon edges (a single point is a zero length line, which is drawn as a dot)
     def polygon_point(self, event):
         self.polygon_points.append(event.x)
         self.polygon_points.append(event.y)
         self.size = self.choose_size_button.get()
-        self.polygon_temp.append(
-            self.c.create_oval(event.x, event.y, event.x + self.size, event.y + self.size, 
-                               fill=self.paint_color, outline=self.outline_color)
-            )
+        coords = self.polygon_points if len(self.polygon_points) > 2 else self.polygon_points * 2
+        self.preview.show("polygon", "line", coords, width=self.size, fill=self.paint_color, 
+                          capstyle=ROUND, joinstyle=ROUND)
     # Polygon draw function to create polygon from Polygon points
     def polygon_finish(self, event):
-        for point in self.polygon_temp:
-            self.c.delete(point)
+        self.preview.hide("polygon")
         if self.polygon_points:
-            x = self.c.create_polygon(*self.polygon_points, fill=self.paint_color, outline=self.outline_color)
+            self.add_shape(PolygonShape(self.polygon_points, fill=self.paint_color, outline=self.outline_color))
             self.polygon_points = []
-            self.Polygon_objects.append(x)
-            self.stack.append(x)
     
     # Point tool to draw small circles that represent points
     def point(self, event):
         self.size = self.choose_size_button.get()
-        x = self.c.create_oval(event.x, event.y, event.x + self.size, event.y + self.size, 
-                               fill=self.paint_color, outline=self.outline_color)
-        self.Point_objects.append(x)
-        self.stack.append(x)
+        self.add_shape(PointShape((event.x, event.y, event.x + self.size, event.y + self.size), 
+                                  fill=self.paint_color, outline=self.outline_color))
         
+    # Text tool: dragging shows only an outline of the text box, the Text widget is created once on the release
+    # and when the text is committed, it becomes a native canvas text shape (exported like any other shape)
     def text_start(self, event):
         self.text_start_x = event.x
         self.text_start_y = event.y
@@ -357,26 +602,211 @@ Warning: Text window is always on top of canvas!""")
         # Defines the relative (x, y) positions based on the starting cursor position (text_start_x, text_start_y)
         self.text_rel_x = event.x - self.text_start_x
         self.text_rel_y = event.y - self.text_start_y
-        # These constants represent font metrics of Courier monospace font family of size 12: Character width and height
-        char_width = 7.2006
-        char_height = 22
-        # Checks if the relative (x, y) is within left lower quadrant (the user can only draw text widget within this quadrant)
+        # Checks if the relative (x, y) is within left lower quadrant (the user can only draw text box within this quadrant)
         if self.text_rel_x > 0 and self.text_rel_y > 0:
-            # Calculates the amount of characters based on char_width that can fit in the current cursor defined space
-            char_count_row = int(self.text_rel_x // char_width)
-            # Calculates the amount of lines based on char_height that can fit in the current cursor defined space
-            count_lines = int(self.text_rel_y // char_height)
-            self.c.delete("temp_text_objects")
-            self.text_widget = Text(self.c, width=char_count_row, height=count_lines, bd=1, 
-                                    fg=self.paint_color, font="Courier", highlightthickness=0,
-                                    wrap=WORD)
-            # Creates canvas window that can hold the Text widget using the starting positions -> The window envelops the whole Text
-            # widget inheriting its dimensions
-            self.c.create_window(self.text_start_x, self.text_start_y, anchor=NW, window=self.text_widget, tags="temp_text_objects")
+            self.preview.show("text", "rectangle", (self.text_start_x, self.text_start_y, event.x, event.y),
+                              outline=self.paint_color, dash=(4, 2))
+        else:
+            self.preview.hide("text")
+    # Creates the Text widget in the dragged box, returns False if no box was dragged
     def text_end(self, event):
-        self.c.delete("temp_text_objects")
-        self.text_window = self.c.create_window(self.text_start_x, self.text_start_y, anchor=NW, window=self.text_widget)
-        self.stack.append(self.text_window)
+        self.preview.hide("text")
+        if self.text_rel_x <= 0 or self.text_rel_y <= 0:
+            return False
+        char_width, line_height = font_metrics(self.TEXT_FONT)
+        # Amount of characters and lines that fit in the dragged box
+        self.text_columns = max(1, int(self.text_rel_x // char_width))
+        count_lines = max(1, int(self.text_rel_y // line_height))
+        self.text_color = self.paint_color
+        self.text_widget = Text(self.c, width=self.text_columns, height=count_lines, bd=1, padx=1, pady=1,
+                                fg=self.text_color, font=self.TEXT_FONT, highlightthickness=0, wrap=WORD)
+        self.text_window = self.c.create_window(*self.view.to_canvas((self.text_start_x, self.text_start_y)), anchor=NW,
+                                                window=self.text_widget)
+        self.text_widget.focus_set()
+        return True
+    # Replaces the Text widget with a text shape, the lines are wrapped the same way the Text widget wrapped them
+    def text_commit(self):
+        if self.text_widget is None:
+            return
+        text = self.text_widget.get("1.0", "end-1c").rstrip()
+        self.text_widget.destroy()
+        self.text_widget = None
+        self.c.delete(self.text_window)
+        if not text:
+            return
+        lines = []
+        for paragraph in text.split("\n"):
+            lines += textwrap.wrap(paragraph, self.text_columns) or [""]
+        char_width, line_height = font_metrics(self.TEXT_FONT)
+        # The text inside the widget is moved by its border and padding (bd + padx/pady)
+        self.add_shape(TextShape((self.text_start_x + 2, self.text_start_y + 2), "\n".join(lines), fill=self.text_color,
+                                 font=self.TEXT_FONT, size=(max(len(line) for line in lines) * char_width, len(lines) * line_height)))
+
+    # Eraser tool: the shapes under the eraser path are found in the spatial index of the scene (no canvas queries),
+    # erased shapes are hidden and replaced by the remaining pieces of cut pen strokes, one drag is one undoable command
+    # (undo shows the erased shapes again), so erased shapes are not exported and are deleted for real when flattened
+    # Only the shapes of the active layer are erased
+    def erase_start(self, event):
+        self.size = self.choose_size_button.get()
+        self.erase_added = []
+        self.erase_removed = []
+        self.erase_last = (event.x, event.y)
+        self.erase_motion(event)
+    def erase_motion(self, event):
+        radius = self.size * self.ERASER_SCALE
+        self.preview.show("eraser", "oval", (event.x - radius, event.y - radius, event.x + radius, event.y + radius),
+                          outline="gray")
+        discs = eraser_discs(self.erase_last[0], self.erase_last[1], event.x, event.y, radius)
+        self.erase_last = (event.x, event.y)
+        for shape, pieces in erase(self.scene.index, discs, self.layer_images.active.uid):
+            if shape in self.erase_added:
+                # A piece cut by this drag is erased again, it was never part of the history
+                self.erase_added.remove(shape)
+                self.delete_object(shape)
+            else:
+                if shape not in self.view:
+                    # Baked shape: its area of the raster background is rendered again without it
+                    self.background.unbake([shape])
+                self.set_hidden(shape, True)
+                self.erase_removed.append(shape)
+            for piece in pieces:
+                piece = PenShape(piece, fill=shape.fill, width=shape.width)
+                piece.layer = shape.layer
+                self.scene.add(piece)
+                self.view.draw(piece)
+                self.erase_added.append(piece)
+        self.layer_images.flush()
+    def erase_end(self, event):
+        self.preview.hide("eraser")
+        if self.erase_added or self.erase_removed:
+            self.history.push(Command(self.erase_added, self.erase_removed))
+            self.check_flatten()
+            self.edited()
+        self.erase_added = []
+        self.erase_removed = []
+
+    # Bucket fill tool: the drawing as it is shown (the layer images with the live shapes drawn over the active layer, so
+    # baked shapes aren't rendered again) is flood filled offscreen, the filled region is added to the active layer
+    # as one transparent image shape, so it's one canvas item and one undo step
+    # The seed stays in the document coordinates (floats), so a click left of or above the drawing isn't truncated into it
+    def fill_at(self, event):
+        import raster
+        shapes = [shape for shape in self.scene if shape in self.view and not shape.hidden]
+        image = self.layer_images.composite(shapes, (self.scene.width, self.scene.height))
+        shape = fill_shape(image, event.x, event.y, raster.color(self.paint_color), self.choose_tolerance_button.get())
+        if shape is not None:
+            self.add_shape(shape)
+
+    # Scrolling and zooming of the canvas view, the view materializes the shapes that come into sight
+    def scroll_x(self, *args):
+        self.c.xview(*args)
+        self.view.refresh()
+    def scroll_y(self, *args):
+        self.c.yview(*args)
+        self.view.refresh()
+    def wheel(self, event):
+        steps = -1 if event.num == 4 or event.delta > 0 else 1
+        if event.state & 0x0004:
+            # Ctrl+wheel zooms around the mouse pointer
+            self.zoom_by(self.ZOOM_STEP ** -steps, event.x, event.y)
+        elif event.state & 0x0001:
+            self.c.xview_scroll(steps, "units")
+            self.view.refresh()
+        else:
+            self.c.yview_scroll(steps, "units")
+            self.view.refresh()
+    def pan_start(self, event):
+        self.c.scan_mark(event.x, event.y)
+    def pan(self, event):
+        self.c.scan_dragto(event.x, event.y, gain=1)
+        self.view.refresh()
+    # The text box that is being typed in is committed first, it's not zoomed with the canvas
+    def zoom_by(self, factor, x=None, y=None):
+        self.text_commit()
+        self.view.set_zoom(self.view.zoom * factor, x, y)
+    def zoom_in(self, event=None):
+        self.zoom_by(self.ZOOM_STEP)
+    def zoom_out(self, event=None):
+        self.zoom_by(1 / self.ZOOM_STEP)
+    def zoom_reset(self, event=None):
+        self.zoom_by(1 / self.view.zoom)
+
+    # Layers: the tools draw into the active layer, locked and hidden layers can't be edited
+    def layer_editable(self):
+        layer = self.layer_images.active
+        return not (layer.locked or layer.hidden)
+    # Rebuilds the Layers menu: the commands for the active layer and the layers from the top one
+    def update_layers_menu(self):
+        active = self.layer_images.active
+        self.menu5.delete(0, END)
+        self.menu5.add_command(label="New layer", command=self.new_layer)
+        self.menu5.add_command(label="Move layer up", command=self.raise_layer)
+        self.menu5.add_command(label="Move layer down", command=self.lower_layer)
+        self.menu5.add_command(label="Show layer" if active.hidden else "Hide layer", command=self.toggle_layer_hidden)
+        self.menu5.add_command(label="Unlock layer" if active.locked else "Lock layer", command=self.toggle_layer_locked)
+        self.menu5.add_separator()
+        for layer in reversed(self.scene.layers):
+            flags = [flag for flag, on in (("hidden", layer.hidden), ("locked", layer.locked)) if on]
+            self.menu5.add_radiobutton(label=layer.name + (" (%s)" % ", ".join(flags) if flags else ""),
+                                       variable=self.layer_variable, value=layer.uid,
+                                       command=lambda layer=layer: self.select_layer(layer))
+        self.layer_variable.set(active.uid)
+    # Makes the layer active: the live shapes of the previous active layer are drawn into its layer image
+    # and the live shapes of the selected layer become canvas items (the text box is committed to the previous layer)
+    def select_layer(self, layer):
+        if layer is not self.layer_images.active:
+            self.text_commit()
+            shapes = self.layer_images.activate(layer, sorted(self.view.shapes, key=lambda shape: shape.uid))
+            self.background = self.layer_images[layer]
+            self.view.set_visible(not layer.hidden)
+            self.view.replace(shapes)
+        self.update_layers_menu()
+    def new_layer(self):
+        layers = self.scene.layers
+        layer = self.scene.add_layer(position=layers.index(self.layer_images.active) + 1)
+        self.layer_images.add(layer)
+        self.select_layer(layer)
+        self.edited()
+    # Reordering and hiding only restack or hide the layer images (nothing is drawn again)
+    def move_layer(self, step):
+        layer = self.layer_images.active
+        self.scene.move_layer(layer, self.scene.layers.index(layer) + step)
+        self.layer_images.restack()
+        self.update_layers_menu()
+        self.edited()
+    def raise_layer(self):
+        self.move_layer(1)
+    def lower_layer(self):
+        self.move_layer(-1)
+    def toggle_layer_hidden(self):
+        self.text_commit()
+        layer = self.layer_images.active
+        layer.hidden = not layer.hidden
+        self.layer_images.restack()
+        self.view.set_visible(not layer.hidden)
+        self.update_layers_menu()
+        self.edited()
+    def toggle_layer_locked(self):
+        self.text_commit()
+        layer = self.layer_images.active
+        layer.locked = not layer.locked
+        self.update_layers_menu()
+        self.edited()
+    # Replaces the layers of the new drawing with the layers saved in the project settings
+    def restore_layers(self, settings):
+        if not settings.get("layers"):
+            return
+        self.layer_images.clear()
+        self.scene.restore_layers(settings["layers"])
+        self.layer_images = LayerImages(self.c, self.scene)
+        uids = [layer.uid for layer in self.scene.layers]
+        self.layer_images.active = self.scene.layers[uids.index(settings["active_layer"]) if settings.get("active_layer") in uids else 0]
+        self.background = self.layer_images[self.layer_images.active]
+        self.view.background = self.layer_images
+        self.view.set_visible(not self.layer_images.active.hidden)
+        if self.view.region is not None:
+            self.layer_images.show(self.view.region, self.view.zoom)
+        self.update_layers_menu()
 
     # Image import function
     def import_img(self):
@@ -395,84 +825,205 @@ Warning: Text window is always on top of canvas!""")
                 resize_factor = askfloat(title="Resize factor", 
                     prompt="Type the image resize factor:\n0 > factor < 1.0 (shrink)\nfactor = 1 (origin)\nfactor > 1.0 (enlarge)")
                 
-                # The program tries to open the file selected by the user
-                # If the file is not a file that can be opened as an image or cannot be converted using PIL library,
-                # the program raises an exception and shows error dialog window
-                try:
-                    img_temp = Img.open(img_dir)
-                    width, height = img_temp.size
-                    # The original image is resized using the resize factor
-                    img_temp = img_temp.resize((int(width * resize_factor), int(height * resize_factor)), Img.ANTIALIAS)
-                    # The image in any supported format (png, jpg, gif, ...) is converted into .ppm format that is supported by Tkinter
-                    img_temp.convert("RGB").save("img_temp.ppm", format="ppm")
-                    
-                    # Image_objects list is used to store PhotoImage objects, that represent images in memory, that are used later in
-                    # undo, redo functions
-                    self.Image_objects.append(PhotoImage(file="img_temp.ppm"))
-                    # The image is drawn on the canvas in the middle
-                    x = self.c.create_image(self.default_canvas_width // 2, self.default_canvas_height // 2, 
-                                            image=self.Image_objects[self.img_counter])
-                    self.img_counter += 1
-                    self.stack.append(x)
-                    self.index = len(self.stack) - 1
-                except:
-                    showerror(title="Import error", message="Wrong image format!")
+                if resize_factor and resize_factor > 0:
+                    self.import_path(img_dir, resize_factor)
+    
+    # Imports the image file without any dialogs, the image is opened and resized by the ImageLoader on a worker thread
+    # and placed on the canvas when it's ready (the window doesn't freeze while large photos are resized)
+    def import_path(self, img_dir, resize_factor=1.0):
+        self.image_loader.load(img_dir, resize_factor, self.image_loaded, self.image_failed)
+    
+    # ImageLoader callback: the image in any supported format (png, jpg, gif, ...) was converted into in-memory PPM data
+    # that is supported by Tkinter, the image shape keeps the PIL image for headless rendering and the canvas view keeps
+    # the PhotoImage alive. The image is drawn on the canvas in the middle
+    # Very large images come as a tile pyramid, only their visible tiles are materialized by the canvas view
+    def image_loaded(self, loaded):
+        center = (self.default_canvas_width // 2, self.default_canvas_height // 2)
+        if loaded.pyramid is not None:
+            self.add_shape(ImageShape(center, pyramid=loaded.pyramid, size=loaded.size))
+            return
+        width, height = loaded.size
+        photo = PhotoImage(width=width, height=height, data=loaded.ppm, format="PPM")
+        self.add_shape(ImageShape(center, loaded.image), photo=photo)
+    
+    # ImageLoader errback: if the file is not a file that can be opened as an image or cannot be converted using PIL library,
+    # the error dialog window is shown
+    def image_failed(self, error):
+        showerror(title="Import error", message="Wrong image format!")
     
     # Undo function triggered by key bind and menu button click
     def undo(self, event=None):
-        # The function checks if the current index is greater or equal to 0 (index of ids defined in self.stack)
-        if self.index >= 0 and self.stack:
-            x = self.stack[self.index]
-            # If the current item in self.stack is a list (pen objects), then it hides all it's items, if not, then it hides the item
-            # specified by id in self.stack
-            if type(x) is list:
-                for item in x:
-                    self.c.itemconfigure(item, state="hidden")
-            else:
-                self.c.itemconfigure(x, state="hidden")
-            # the self.index is lowered by 1 to indicate the current working item id in self.stack
-            self.index -= 1
+        # The last command is moved to the redo stack: the objects it added are hidden and the objects it removed are shown
+        command = self.history.undo()
+        if command:
+            for x in command.added:
+                self.set_hidden(x, True)
+            for x in command.removed:
+                self.set_hidden(x, False)
+            self.layer_images.flush()
+            self.edited()
     
     # Redo function triggered by key bind and menu button click similar to Undo function
     def redo(self, event=None):
-        # The function checks if the current index is lower than the last index in self.stack
-        if self.index < (len(self.stack) - 1) and self.stack:
-            self.index += 1
-            x = self.stack[self.index]
-            if type(x) is list:
-                for item in x:
-                    self.c.itemconfigure(item, state="normal")
-            else:
-                self.c.itemconfigure(x, state="normal")
+        command = self.history.redo()
+        if command:
+            for x in command.removed:
+                self.set_hidden(x, True)
+            for x in command.added:
+                self.set_hidden(x, False)
+            self.layer_images.flush()
+            self.edited()
                     
     # Function starts a new file, sets currently active button to RAISED, resets canvas and resets all settings
     def new_file(self):
         self.answer = askyesnocancel("Save file?", "Do you want to save the file before proceeding?")
         if self.answer == True:
             self.save()
-            self.active_button.config(relief=RAISED)
-            self.c.delete("all")
-            self.setup()
-        elif self.answer == False:
-            self.active_button.config(relief=RAISED)
-            self.c.delete("all")
-            self.setup()
+        if self.answer is not None:
+            self.new_drawing()
+        # The previous drawing was saved or discarded on purpose, so its autosave is not needed anymore
+        if self.answer is not None and self.autosave_service:
+            self.autosave_service.discard()
+    
+    # Starts a new drawing without asking (used by new_file() and the replay of the recorded events)
+    def new_drawing(self):
+        self.active_button.config(relief=RAISED)
+        self.c.delete("all")
+        self.setup()
+    
+    # Closing the window ends the session normally, so the autosave file is removed
+    def close(self):
+        if self.autosave_service:
+            self.autosave_service.stop()
+        self.root.destroy()
+    
+    def show_autosave_stats(self):
+        if not self.autosave_service:
+            showinfo(title="Autosave statistics", message="Autosave is disabled.")
+            return
+        stats = self.autosave_service.stats()
+        showinfo(title="Autosave statistics", message=(
+            "Autosaves: %d (mean %.1f ms, max %.1f ms)\nUI thread stalls: mean %.2f ms, max %.2f ms\nSkipped (busy): %d, errors: %d" % 
+            (stats["save"]["count"], stats["save"]["mean_ms"], stats["save"]["max_ms"],
+             stats["stall"]["mean_ms"], stats["stall"]["max_ms"], stats["skipped"], stats["errors"])))
+    
+    # Writes the instrumentation snapshot (JSON) and the cProfile statistics if profiling is on
+    def dump_instrumentation(self):
+        path = str(asksaveasfilename(
+            initialdir = self.project_path,
+            defaultextension = ".json",
+            filetypes=(("JSON file", "*.json"), ("All files", "*.*"))
+        ))
+        if path:
+            showinfo(title="Performance snapshot", message="Saved:\n" + "\n".join(self.instrumentation.dump(path)))
     
     # Supporting saving function used in save() and save_as()
     def saving(self):
-        # If the chosen export file format is Postscript (.ps), than it uses Tkinter built-in function
+        self.text_commit()
+        # PostScript (.ps) is written from the document model like SVG, so the whole drawing is exported as vectors
+        # (the canvas would give only the visible region and the baked shapes as a bitmap)
         if self.file_dir.endswith(".ps"):
-                self.c.postscript(file = self.file_dir, colormode = 'color')
-        # If the chosen export file format is PNG, than it creates a screenshot of the screen and crops the image using
-        # coordinates of the canvas upper left and down right corners
+            import postscript
+            postscript.write_postscript(self.scene, self.file_dir)
+        # If the chosen export file format is PNG, than the document model is rasterized offscreen using Pillow,
+        # so the export doesn't depend on what is visible on the screen and can use any scale factor
         elif self.file_dir.endswith(".png"):
-            # winfo_rootx() and winfo_rooty() is root's upper left corner coords + winfo_x() and winfo_y() is 
-            # canvase's upper left corner coords relative to root (0)
-            x2 = self.root.winfo_rootx() + self.c.winfo_x() + 2 # +2 is needed to compensate for root's window padding
-            y2 = self.root.winfo_rooty() + self.c.winfo_y() + 2
-            x1 = x2 + self.c.winfo_width() - 4 # -4 is needed to compensate for winfo_width/height() return value being incremented by 4
-            y1 = y2 + self.c.winfo_height() - 4
-            ImageGrab.grab().crop((x2,y2,x1,y1)).save(self.file_dir)
+            import raster
+            raster.render(self.scene, scale=self.png_scale).save(self.file_dir)
+        # SVG is streamed from the document model in chunks (pen strokes of one style merged into paths), .svgz is gzipped
+        elif self.file_dir.endswith((".svg", ".svgz")):
+            import svg
+            svg.write_svg(self.scene, self.file_dir)
+        # Native project file is saved incrementally, only the changes since the last save are appended to it
+        elif self.file_dir.endswith(".tkp"):
+            if self.project is None or self.project.path != self.file_dir:
+                self.project = ProjectFile(self.file_dir)
+            self.project.save(self.scene, self.settings())
+    
+    # Document and tool attributes saved in the project file
+    def settings(self):
+        return {"width": self.scene.width, "height": self.scene.height, "background": self.scene.background,
+                "color": self.paint_color, "pen_size": self.choose_size_button.get(),
+                "layers": self.scene.layer_records(), "active_layer": self.layer_images.active.uid}
+    
+    # Opens a native project file, a new file is started first (the user can save the current drawing)
+    def open_project(self, event=None):
+        self.new_file()
+        if self.answer == True or self.answer == False:
+            file_dir = str(askopenfilename(
+                initialdir = self.project_path,
+                filetypes=(("Paint project", "*.tkp"), ("All files", "*.*"))
+            ))
+            if file_dir:
+                self.load_project(file_dir)
+    
+    # Loads the project file in batches scheduled by after(), so the window doesn't freeze while a large file is loaded:
+    # first the journal is streamed and replayed, then the live shapes are drawn (the oldest ones are baked into the
+    # raster background if there are more than flatten_items of them, the loaded shapes can't be undone anyway)
+    # The layers are restored before the shapes are drawn, the shapes of the inactive layers are baked into their images
+    # A recovered autosave is loaded as a new unsaved drawing
+    def load_project(self, file_dir, recovered=False):
+        try:
+            reader = ProjectReader(file_dir)
+        except OSError:
+            showerror(title="Open error", message="The project file can't be opened!")
+            return
+        self.root.title("Loading... - Tkinter Paint")
+        self.loading = True
+        self.unbind_canvas()
+        self.root.after(1, self.load_step, file_dir, reader, None, 0, recovered)
+    def load_step(self, file_dir, reader, shapes, index, recovered=False):
+        try:
+            if shapes is None:
+                if reader.read(self.LOAD_BATCH):
+                    shapes = reader.ordered_shapes()
+                    self.scene.next_uid = max(self.scene.next_uid, max(reader.shapes, default=0) + 1)
+                    self.restore_layers(reader.settings)
+                self.root.after(1, self.load_step, file_dir, reader, shapes, 0, recovered)
+                return
+        except (ProjectError, ValueError, OSError):
+            self.loading = False
+            self.bind_canvas()
+            self.root.title("New file - Tkinter Paint")
+            showerror(title="Open error", message="Wrong project file format!")
+            return
+        bake_count = len(shapes) - self.flatten_items * 3 // 4 if self.flatten and len(shapes) > self.flatten_items else 0
+        active = self.layer_images.active.uid
+        for shape in shapes[index:index + self.LOAD_BATCH]:
+            if shape.layer not in self.layer_images.backgrounds:
+                shape.layer = self.scene.layers[0].uid
+            self.scene.add(shape, uid=shape.uid)
+            if index < bake_count or shape.layer != active:
+                self.layer_images.backgrounds[shape.layer].bake([shape])
+            else:
+                self.view.draw(shape)
+            index += 1
+        self.layer_images.flush()
+        if index < len(shapes):
+            self.root.after(1, self.load_step, file_dir, reader, shapes, index, recovered)
+            return
+        # The loading is finished: settings are applied and the next save appends to the loaded file
+        settings = reader.settings
+        if "color" in settings:
+            self.paint_color = self.outline_color = settings["color"]
+            self.current_color.config(bg=self.paint_color)
+        if "pen_size" in settings:
+            self.choose_size_button.set(settings["pen_size"])
+        self.loading = False
+        self.bind_canvas()
+        if recovered:
+            self.root.title("Recovered file - Tkinter Paint")
+            return
+        self.file_dir = file_dir
+        self.project = ProjectFile.from_reader(file_dir, reader)
+        self.root.title(os.path.basename(file_dir) + " - Tkinter Paint")
+    
+    # Asks for the PNG export scale factor (e.g. 2.0 exports the drawing in double resolution)
+    def choose_png_scale(self):
+        scale = askfloat(title="PNG export scale", prompt="Type the PNG export scale factor:", 
+                         initialvalue=self.png_scale, minvalue=0.01)
+        if scale:
+            self.png_scale = scale
     
     # Save function that triggers saving() if the export file_dir is already chosen, if not, triggers save_as()
     def save(self, event=None):
@@ -488,7 +1039,10 @@ Warning: Text window is always on top of canvas!""")
             initialdir = self.project_path,
             defaultextension = ".ps", 
             filetypes=(("PostScript File", "*.ps"), 
-                        ("PNG File", "*.png"))
+                        ("PNG File", "*.png"),
+                        ("SVG File", "*.svg"),
+                        ("Compressed SVG File", "*.svgz"),
+                        ("Paint project", "*.tkp"))
         ))
         
         start_index = self.file_dir.rfind("/") + 1
@@ -0,0 +1,183 @@
+"""
+PostScript export of the document model.
+
+The whole document is written from the scene, so the export doesn't depend on the canvas: the shapes outside
+the visible region, the shapes baked into the raster layers and the hidden canvas items are all written as vectors
+(images are embedded as images). One document pixel is POINTS_PER_PIXEL points, the same printed size as the export
+of the Tk canvas on a 96 DPI screen. Like the SVG export, the elements are streamed into the file in chunks of CHUNK
+elements and the coordinates are rounded to PRECISION decimal places.
+
+Images with transparency use PostScript LanguageLevel 3 (a bucket fill, one color with a mask, only needs level 1).
+"""
+import base64
+import raster
+
+# One document pixel in points
+POINTS_PER_PIXEL = 0.75
+# Decimal places of the coordinates
+PRECISION = 1
+# Number of elements written at once
+CHUNK = 512
+# Color key of the transparent pixels of the images (an opaque pixel of this color is changed in the last bit)
+MASK_COLOR = (255, 0, 254)
+
+# Procedures used by the elements, the coordinate system is the document (y grows downwards)
+PROLOG = """/m {moveto} bind def
+/l {lineto} bind def
+/c {setrgbcolor} bind def
+/w {setlinewidth} bind def
+/s {stroke} bind def
+/ellipse {matrix currentmatrix 5 1 roll 4 2 roll translate scale 0 0 1 0 360 arc closepath setmatrix} bind def
+/latin1 {findfont dup length dict begin {1 index /FID ne {def} {pop pop} ifelse} forall
+/Encoding ISOLatin1Encoding def currentdict end definefont pop} bind def
+1 setlinecap 1 setlinejoin
+"""
+
+# Tk font families as the standard PostScript fonts
+FONTS = {"courier": "Courier", "times": "Times-Roman", "helvetica": "Helvetica", "arial": "Helvetica"}
+
+def _number(value, precision=PRECISION):
+    text = "%.*f" % (precision, value)
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+def _color(value):
+    rgb = raster.color(value)
+    return None if rgb is None else " ".join(_number(channel / 255.0, 3) for channel in rgb[:3])
+
+# PostScript string of the text, characters outside Latin-1 are replaced by "?"
+def _string(text):
+    data = text.encode("latin-1", "replace")
+    return "(%s)" % "".join(chr(byte) if 32 <= byte < 127 and byte not in b"()\\" else "\\%03o" % byte for byte in data)
+
+def _font(family):
+    family = family.lower()
+    for name, font in FONTS.items():
+        if name in family:
+            return font
+    return "Courier" if "mono" in family else "Helvetica"
+
+def _ascii85(data):
+    return base64.a85encode(data, wrapcol=76, adobe=True)[2:].decode("ascii")
+
+# Fills and strokes the current path with the fill and outline colors of the shape
+def _paint(shape, path):
+    fill, outline = _color(shape.fill), _color(shape.outline)
+    parts = ["newpath", path]
+    if fill is not None:
+        parts.append("gsave %s c fill grestore" % fill if outline is not None else "%s c fill" % fill)
+    if outline is not None:
+        parts.append("%s c 1 w s" % outline)
+    return " ".join(parts)
+
+def _polyline(coords):
+    points = ["%s %s" % (_number(coords[i]), _number(coords[i + 1])) for i in range(0, len(coords) - 1, 2)]
+    return "%s m %s" % (points[0], " ".join(point + " l" for point in points[1:]) or points[0] + " l")
+
+def _image(shape):
+    x1, y1, x2, y2 = shape.bbox()
+    picture = shape.picture()
+    width, height = picture.size
+    place = "gsave %s %s translate %s %s scale\n" % (_number(x1), _number(y1), _number(x2 - x1), _number(y2 - y1))
+    matrix = "[%d 0 0 %d 0 0]" % (width, height)
+    if picture.mode not in ("RGBA", "LA", "PA") and "transparency" not in picture.info:
+        data = _ascii85(picture.convert("RGB").tobytes())
+        return (place + "/DeviceRGB setcolorspace << /ImageType 1 /Width %d /Height %d /BitsPerComponent 8 "
+                "/Decode [0 1 0 1 0 1] /ImageMatrix %s /DataSource currentfile /ASCII85Decode filter >> image\n%s\ngrestore" % (
+                    width, height, matrix, data))
+    from PIL import ImageStat
+    picture = picture.convert("RGBA")
+    mask = picture.getchannel("A").point(lambda alpha: 255 if alpha >= 128 else 0)
+    rgb = picture.convert("RGB")
+    extrema = ImageStat.Stat(rgb, mask.convert("L")).extrema if mask.getbbox() else [(0, 0)] * 3
+    if all(low == high for low, high in extrema):
+        # One color (e.g. a bucket fill): the mask is painted with it
+        return place + "%s c %d %d true %s currentfile /ASCII85Decode filter imagemask\n%s\ngrestore" % (
+            _color("#%02x%02x%02x" % tuple(int(low) for low, high in extrema)), width, height, matrix,
+            _ascii85(mask.convert("1").tobytes()))
+    import numpy as np
+    pixels = np.array(rgb)
+    opaque = np.asarray(mask) != 0
+    keyed = (pixels == MASK_COLOR).all(axis=2) & opaque
+    pixels[keyed, 2] ^= 1
+    pixels[~opaque] = MASK_COLOR
+    return (place + "/DeviceRGB setcolorspace << /ImageType 4 /Width %d /Height %d /BitsPerComponent 8 "
+            "/Decode [0 1 0 1 0 1] /MaskColor [%d %d %d] /ImageMatrix %s /DataSource currentfile /ASCII85Decode filter >> image\n"
+            "%s\ngrestore" % ((width, height) + MASK_COLOR + (matrix, _ascii85(pixels.tobytes()))))
+
+def _text(shape, fonts):
+    lines = shape.lines()
+    line_height = shape.size[1] / len(lines)
+    font = _font(shape.font[0])
+    parts = []
+    if font not in fonts:
+        fonts.add(font)
+        parts.append("/%s-Latin1 /%s latin1" % (font, font))
+    # The em height is about 1/1.2 of the line height (as in raster.py), the baseline is 0.7 line height under its top
+    parts.append("/%s-Latin1 findfont %s scalefont setfont %s c" % (font, _number(line_height / 1.2), _color(shape.fill)))
+    x, y = shape.coords[0], shape.coords[1]
+    for index, line in enumerate(lines):
+        if line:
+            parts.append("gsave %s %s translate 1 -1 scale 0 0 m %s show grestore" % (
+                _number(x), _number(y + (index + 0.7) * line_height), _string(line)))
+    return "\n".join(parts)
+
+# PostScript element of one shape (fonts is the set of the fonts defined so far)
+def shape_element(shape, fonts):
+    kind = shape.kind
+    coords = shape.coords
+    if kind == "pen":
+        return "%s c %s w newpath %s s" % (_color(shape.fill) or "0 0 0", _number(shape.width), _polyline(coords))
+    if kind == "line":
+        # Lines have butt caps like the Tk lines (the round caps of the prolog are for the pen strokes)
+        return "%s c %s w 0 setlinecap newpath %s s 1 setlinecap" % (
+            _color(shape.fill) or "0 0 0", _number(shape.width), _polyline(coords))
+    if kind in ("circle", "point", "rectangle"):
+        x1, x2 = sorted((coords[0], coords[2]))
+        y1, y2 = sorted((coords[1], coords[3]))
+        if kind == "rectangle":
+            return _paint(shape, "%s %s m %s %s l %s %s l %s %s l closepath" % (
+                _number(x1), _number(y1), _number(x2), _number(y1), _number(x2), _number(y2), _number(x1), _number(y2)))
+        return _paint(shape, "%s %s %s %s ellipse" % (
+            _number((x1 + x2) / 2), _number((y1 + y2) / 2), _number(max((x2 - x1) / 2, 0.1)), _number(max((y2 - y1) / 2, 0.1))))
+    if kind == "polygon":
+        if len(coords) > 4:
+            return _paint(shape, _polyline(coords) + " closepath")
+        return "%s c 1 w newpath %s s" % (_color(shape.outline) or _color(shape.fill) or "0 0 0", _polyline(coords))
+    if kind == "image":
+        return _image(shape)
+    if kind == "text":
+        return _text(shape, fonts)
+    raise ValueError("Unknown shape kind: %r" % kind)
+
+# Writes the drawn shapes of the scene (hidden layers are left out) as a PostScript file, the elements are written
+# in chunks, returns the number of elements
+def write_postscript(scene, path):
+    width, height = scene.width * POINTS_PER_PIXEL, scene.height * POINTS_PER_PIXEL
+    fonts = set()
+    count = 0
+    with open(path, "w", encoding="latin-1") as file:
+        file.write("%%!PS-Adobe-3.0 EPSF-3.0\n%%%%Creator: Tkinter Paint\n%%%%BoundingBox: 0 0 %d %d\n" % (
+            -(-width // 1), -(-height // 1)))
+        file.write("%%%%HiResBoundingBox: 0 0 %s %s\n%%%%LanguageLevel: 3\n%%%%Pages: 1\n%%%%EndComments\n" % (
+            _number(width, 2), _number(height, 2)))
+        file.write(PROLOG)
+        file.write("%%Page: 1 1\n")
+        file.write("0 %s translate %s %s scale\n" % (_number(height, 2), POINTS_PER_PIXEL, -POINTS_PER_PIXEL))
+        background = _color(scene.background)
+        if background is not None:
+            file.write("%s c 0 0 m %d 0 l %d %d l 0 %d l closepath fill\n" % (
+                background, scene.width, scene.width, scene.height, scene.height))
+        chunk = []
+        for shape in scene.drawn():
+            chunk.append(shape_element(shape, fonts))
+            if len(chunk) >= CHUNK:
+                file.write("\n".join(chunk) + "\n")
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            file.write("\n".join(chunk) + "\n")
+            count += len(chunk)
+        file.write("showpage\n%%EOF\n")
+    return count
@@ -0,0 +1,83 @@
+import time
+
+class Preview(object):
+    """
+    Rubber-band previews of the drawing tools. Every preview is one temporary canvas item that is reused and updated
+    with coords()/itemconfigure() instead of being deleted and created again. Mouse motion events are coalesced:
+    show() only stores the latest geometry and the canvas is updated at most once per frame (after_idle/after).
+    The geometry is given in document coordinates, the canvas view converts it to the canvas coordinates.
+
+    Attributes
+    ----------
+    canvas : Canvas
+        the Tk canvas the previews are drawn on
+    view : CanvasView
+        the canvas view whose zoom and scrolling apply to the previews (None if the coordinates are not converted)
+    frame_ms : int
+        minimal time between two updates of the canvas in milliseconds
+    updates : int
+        number of canvas updates done (compared to the number of show() calls, it shows how many events were coalesced)
+    requests : int
+        number of show() calls
+    """
+
+    FRAME_MS = 16
+
+    def __init__(self, canvas, view=None, frame_ms=FRAME_MS):
+        self.canvas = canvas
+        self.view = view
+        self.frame_ms = frame_ms
+        # name -> (kind, item id, options)
+        self.items = {}
+        # name -> (kind, coords, options) waiting for the next frame
+        self.pending = {}
+        self.scheduled = None
+        self.last_flush = 0.0
+        self.updates = 0
+        self.requests = 0
+
+    # Requests the preview called name as a canvas item of given kind ("line", "oval", "rectangle", ...)
+    def show(self, name, kind, coords, **options):
+        self.requests += 1
+        self.pending[name] = (kind, coords, options)
+        if self.scheduled is None:
+            wait = self.frame_ms - (time.perf_counter() - self.last_flush) * 1000
+            if wait <= 0:
+                self.scheduled = self.canvas.after_idle(self.flush)
+            else:
+                self.scheduled = self.canvas.after(int(wait) + 1, self.flush)
+
+    # Applies the latest requested geometry of every pending preview to the canvas
+    def flush(self):
+        self.scheduled = None
+        self.last_flush = time.perf_counter()
+        pending, self.pending = self.pending, {}
+        for name, (kind, coords, options) in pending.items():
+            self.updates += 1
+            if self.view is not None and self.view.zoom != 1.0:
+                coords = self.view.to_canvas(coords)
+                if "width" in options:
+                    options = dict(options, width=options["width"] * self.view.zoom)
+            current = self.items.get(name)
+            if current is None or current[0] != kind:
+                if current is not None:
+                    self.canvas.delete(current[1])
+                item = getattr(self.canvas, "create_" + kind)(*coords, **options)
+                self.items[name] = (kind, item, options)
+                continue
+            item = current[1]
+            self.canvas.coords(item, *coords)
+            if options != current[2]:
+                self.canvas.itemconfigure(item, **options)
+                self.items[name] = (kind, item, options)
+
+    # Deletes the preview item, a pending update of the preview is dropped
+    def hide(self, name):
+        self.pending.pop(name, None)
+        current = self.items.pop(name, None)
+        if current is not None:
+            self.canvas.delete(current[1])
+
+    def clear(self):
+        for name in list(self.items) + list(self.pending):
+            self.hide(name)
@@ -0,0 +1,290 @@
+"""
+Native project file (.tkp) of the Paint application.
+
+The file is a journal: a header followed by records, every save appends only the records that changed since the last save
+(new shapes, deleted shapes, changed settings). Loading replays the journal, compaction rewrites the file with only
+the live shapes when the journal grows too much.
+
+Layout (little-endian):
+    header  MAGIC
+    record  type (uint8), payload length (uint32), payload
+    SETTINGS payload  UTF-8 JSON object with the document and tool attributes
+    ADD payload       uid (uint32), kind (uint8), fill, outline (uint8 length + UTF-8), width (float32),
+                      coordinate count (uint32), coordinates (float32 array), kind specific data, layer uid (uint32)
+    DELETE payload    uid (uint32)
+Image shapes store their displayed size (2x uint32) and the PNG encoded image (uint32 length + data).
+Text shapes store the block size (2x float32), the font family (uint8 length + UTF-8), the font size (int16)
+and the text (uint32 length + UTF-8).
+The layers are saved in the settings ("layers" list), files saved before the layers have no layer uid in the ADD
+payloads, their shapes belong to the first layer.
+"""
+from array import array
+import io
+import json
+import os
+import struct
+import sys
+from scene import SHAPE_TYPES, ImageShape, Scene, TextShape
+
+MAGIC = b"TKPAINT\x01"
+SETTINGS, ADD, DELETE = 1, 2, 3
+KINDS = ["pen", "line", "circle", "rectangle", "polygon", "point", "image", "text"]
+RECORD = struct.Struct("<BI")
+
+class ProjectError(Exception):
+    pass
+
+def _pack_string(value):
+    data = (value or "").encode("utf-8")
+    return struct.pack("<B", len(data)) + data
+
+def _unpack_string(data, offset):
+    length = data[offset]
+    return data[offset + 1:offset + 1 + length].decode("utf-8"), offset + 1 + length
+
+# Serializes one shape into the ADD record payload
+def pack_shape(shape):
+    coords = array("f", shape.coords)
+    if sys.byteorder == "big":
+        coords.byteswap()
+    parts = [struct.pack("<IB", shape.uid, KINDS.index(shape.kind)), _pack_string(shape.fill), _pack_string(shape.outline),
+             struct.pack("<fI", shape.width, len(coords)), coords.tobytes()]
+    if shape.kind == "image":
+        buffer = io.BytesIO()
+        shape.picture(shape.image.size if shape.image is not None else shape.pyramid.size).save(buffer, format="PNG")
+        parts.append(struct.pack("<III", shape.size[0], shape.size[1], buffer.tell()))
+        parts.append(buffer.getvalue())
+    elif shape.kind == "text":
+        text = shape.text.encode("utf-8")
+        parts.append(struct.pack("<ff", *shape.size) + _pack_string(shape.font[0]))
+        parts.append(struct.pack("<hI", shape.font[1], len(text)) + text)
+    parts.append(struct.pack("<I", shape.layer))
+    return b"".join(parts)
+
+# Rebuilds the shape from the ADD record payload
+def unpack_shape(data):
+    uid, kind = struct.unpack_from("<IB", data)
+    kind = KINDS[kind]
+    fill, offset = _unpack_string(data, 5)
+    outline, offset = _unpack_string(data, offset)
+    width, count = struct.unpack_from("<fI", data, offset)
+    offset += 8
+    coords = array("f")
+    coords.frombytes(data[offset:offset + 4 * count])
+    if sys.byteorder == "big":
+        coords.byteswap()
+    offset += 4 * count
+    if kind == "image":
+        from PIL import Image as Img
+        import imaging
+        size_x, size_y, length = struct.unpack_from("<III", data, offset)
+        offset += 12
+        image = Img.open(io.BytesIO(data[offset:offset + length]))
+        offset += length
+        # Bucket fills are RGBA images, the transparency is kept
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "PA") else "RGB")
+        if size_x * size_y > imaging.TILED_PIXELS:
+            from tiles import TilePyramid
+            shape = ImageShape(coords, pyramid=TilePyramid(image), size=(size_x, size_y))
+        else:
+            shape = ImageShape(coords, image.resize((size_x, size_y)) if image.size != (size_x, size_y) else image)
+    elif kind == "text":
+        size = struct.unpack_from("<ff", data, offset)
+        family, offset = _unpack_string(data, offset + 8)
+        font_size, length = struct.unpack_from("<hI", data, offset)
+        offset += 6
+        shape = TextShape(coords, data[offset:offset + length].decode("utf-8"), fill=fill, font=(family, font_size), size=size)
+        offset += length
+    else:
+        shape = SHAPE_TYPES[kind](coords, fill=fill, outline=outline, width=width)
+    shape.uid = uid
+    if offset + 4 <= len(data):
+        shape.layer = struct.unpack_from("<I", data, offset)[0]
+    return shape
+
+def _write_record(file, record_type, payload):
+    file.write(RECORD.pack(record_type, len(payload)))
+    file.write(payload)
+
+# Writes a complete project file with the given shapes and settings, the file is replaced atomically
+# (pack gives the ADD payload of a shape)
+def write_project(path, shapes, settings, pack=pack_shape):
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(MAGIC)
+        _write_record(file, SETTINGS, json.dumps(settings).encode("utf-8"))
+        for shape in shapes:
+            _write_record(file, ADD, pack(shape))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return 1 + len(shapes)
+
+# Streams the records of the project file as (type, value) pairs, value is the settings dict, a Shape or a deleted uid
+def read_records(path):
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ProjectError("Not a Paint project file: %s" % path)
+        while True:
+            header = file.read(RECORD.size)
+            if not header:
+                break
+            if len(header) < RECORD.size:
+                # The file ends with a partially written record (e.g. a crash during saving), it's ignored
+                break
+            record_type, length = RECORD.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                break
+            if record_type == SETTINGS:
+                yield SETTINGS, json.loads(payload.decode("utf-8"))
+            elif record_type == ADD:
+                yield ADD, unpack_shape(payload)
+            elif record_type == DELETE:
+                yield DELETE, struct.unpack("<I", payload)[0]
+
+class ProjectReader(object):
+    """
+    Incremental reader of a project file, read(count) replays at most count records, so a large file can be loaded
+    in small batches between Tk events.
+
+    Attributes
+    ----------
+    shapes : dict
+        live shapes by uid
+    settings : dict
+        the last saved settings
+    records : int
+        number of records read so far
+    done : bool
+        True when the whole file was read
+    """
+
+    def __init__(self, path):
+        self.records_iter = read_records(path)
+        self.shapes = {}
+        self.settings = {}
+        self.records = 0
+        self.done = False
+
+    def read(self, count):
+        for _ in range(count):
+            try:
+                record_type, value = next(self.records_iter)
+            except StopIteration:
+                self.done = True
+                break
+            self.records += 1
+            if record_type == SETTINGS:
+                self.settings = value
+            elif record_type == ADD:
+                self.shapes[value.uid] = value
+            elif record_type == DELETE:
+                self.shapes.pop(value, None)
+        return self.done
+
+    # Live shapes in the drawing order (uids grow with the drawing order)
+    def ordered_shapes(self):
+        return [self.shapes[uid] for uid in sorted(self.shapes)]
+
+# Reads the whole project file into a new scene of the saved size and background, or into the given new scene
+# (shapes of unknown layers are moved to the first layer), returns the scene and the saved settings
+def read_scene(path, scene=None):
+    reader = ProjectReader(path)
+    while not reader.read(10000):
+        pass
+    settings = reader.settings
+    if scene is None:
+        scene = Scene(settings.get("width", 600), settings.get("height", 600), settings.get("background", "white"))
+    scene.restore_layers(settings.get("layers"))
+    uids = {layer.uid for layer in scene.layers}
+    for shape in reader.ordered_shapes():
+        if shape.layer not in uids:
+            shape.layer = scene.layers[0].uid
+        scene.add(shape, shape.uid)
+    return scene, settings
+
+class ProjectFile(object):
+    """
+    Project file that is saved incrementally: every save appends only the delta since the last save (added and deleted
+    shapes, changed settings) like a journal. When the journal has more than COMPACT_RATIO times more records than
+    there are live shapes, the file is compacted (rewritten with the live shapes only).
+
+    Attributes
+    ----------
+    path : string
+        path of the project file
+    saved : dict
+        shapes saved in the file by uid
+    settings : dict
+        settings saved in the file
+    records : int
+        number of records in the file
+    images : dict
+        saved image shapes with their ADD payloads by uid (uid -> (shape, payload)), so the compaction doesn't
+        encode the images again
+    """
+
+    COMPACT_RATIO = 2.0
+    COMPACT_MIN_RECORDS = 64
+
+    def __init__(self, path, saved=None, settings=None, records=0):
+        self.path = path
+        self.saved = dict(saved or {})
+        self.settings = settings
+        self.records = records
+        self.images = {}
+
+    # ProjectFile of a fully read project, so the next save appends to it
+    @classmethod
+    def from_reader(cls, path, reader):
+        return cls(path, reader.shapes, reader.settings, reader.records)
+
+    # Saves the visible shapes of the scene, returns the number of written records
+    def save(self, scene, settings):
+        return self.save_shapes(scene.visible(), settings)
+
+    # Saves the shapes (in the drawing order), e.g. a snapshot of the scene taken by the autosave
+    def save_shapes(self, shapes, settings):
+        if not os.path.exists(self.path) or not self.records:
+            return self.compact(shapes, settings)
+        current = {shape.uid: shape for shape in shapes}
+        deleted = [uid for uid, shape in self.saved.items() if current.get(uid) is not shape]
+        added = [shape for shape in shapes if self.saved.get(shape.uid) is not shape]
+        records = len(deleted) + len(added) + (settings != self.settings)
+        if self.records + records > max(self.COMPACT_MIN_RECORDS, self.COMPACT_RATIO * (len(shapes) + 1)):
+            return self.compact(shapes, settings)
+        if not records:
+            return 0
+        with open(self.path, "ab") as file:
+            if settings != self.settings:
+                _write_record(file, SETTINGS, json.dumps(settings).encode("utf-8"))
+            for uid in deleted:
+                _write_record(file, DELETE, struct.pack("<I", uid))
+            for shape in added:
+                _write_record(file, ADD, self.pack(shape))
+            file.flush()
+            os.fsync(file.fileno())
+        self.saved = current
+        self.settings = settings
+        self.records += records
+        for uid in deleted:
+            self.images.pop(uid, None)
+        return records
+
+    # ADD payload of the shape, the payloads of image shapes are cached (PNG encoding of a large image takes seconds)
+    def pack(self, shape):
+        if shape.kind != "image":
+            return pack_shape(shape)
+        cached = self.images.get(shape.uid)
+        if cached is None or cached[0] is not shape:
+            cached = self.images[shape.uid] = (shape, pack_shape(shape))
+        return cached[1]
+
+    # Rewrites the whole file with the live shapes only
+    def compact(self, shapes, settings):
+        self.records = write_project(self.path, shapes, settings, self.pack)
+        self.saved = {shape.uid: shape for shape in shapes}
+        self.images = {uid: self.images[uid] for uid in self.saved if uid in self.images}
+        self.settings = settings
+        return self.records
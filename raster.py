@@ -0,0 +1,187 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import os
+from PIL import Image, ImageDraw, ImageColor, ImageFont
+from spatial import intersects
+
+# Outputs with more pixels than PARALLEL_PIXELS are rendered in TILE_SIZE x TILE_SIZE tiles in a process pool
+# Tiles are rendered with TILE_MARGIN pixels around them, Pillow rasterizes wide lines and polygons slightly differently
+# near the image border, so the margin is cropped to keep the tile seams invisible
+TILE_SIZE = 1024
+TILE_MARGIN = 32
+PARALLEL_PIXELS = 4096 * 4096
+
+def render(scene, scale=1.0, box=None, workers=None):
+    """
+    Rasterizes the drawn shapes of the scene (hidden layers are left out) into a PIL RGB image without any Tk window.
+
+    Parameters
+    ----------
+    scene : Scene
+        the document model to render
+    scale : float
+        scale factor of the output (1.0 renders one pixel per canvas pixel)
+    box : tuple
+        rendered document area (x1, y1, x2, y2), the whole document by default
+    workers : int
+        number of processes used for large outputs, 1 disables the process pool (os.cpu_count() by default)
+    """
+    if box is None:
+        box = (0, 0, scene.width, scene.height)
+    size = (max(1, int(round((box[2] - box[0]) * scale))), max(1, int(round((box[3] - box[1]) * scale))))
+    offset = (int(round(box[0] * scale)), int(round(box[1] * scale)))
+    shapes = scene.drawn()
+    if size[0] * size[1] > PARALLEL_PIXELS and workers != 1:
+        return render_tiled(shapes, scene.background, offset, scale, size, workers)
+    return render_box(shapes, scene.background, offset, scale, size)
+
+# Renders the shapes into a new image of given size, offset is the position of the image's upper left corner in the scaled
+# document (in whole pixels, so that tiles of one output are rasterized exactly the same way as the whole output)
+# Without a background (None) the image is transparent RGBA, e.g. an area of one layer of the drawing
+def render_box(shapes, background, offset, scale, size):
+    if background is None:
+        image = Image.new("RGBA", size, (0, 0, 0, 0))
+    else:
+        image = Image.new("RGB", size, color(background) or (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for shape in shapes:
+        draw_shape(draw, image, shape, scale, offset)
+    return image
+
+# Splits the output into tiles and renders them in parallel, every worker gets only the shapes that intersect its tile
+def render_tiled(shapes, background, offset, scale, size, workers=None):
+    image = Image.new("RGB", size)
+    bboxes = [shape.bbox() for shape in shapes]
+    # Pictures of the image shapes in the output scale, rendered once (shape -> Image)
+    pictures = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        jobs = []
+        for ty in range(0, size[1], TILE_SIZE):
+            for tx in range(0, size[0], TILE_SIZE):
+                tile_size = (min(TILE_SIZE, size[0] - tx) + 2 * TILE_MARGIN, min(TILE_SIZE, size[1] - ty) + 2 * TILE_MARGIN)
+                tile_offset = (offset[0] + tx - TILE_MARGIN, offset[1] + ty - TILE_MARGIN)
+                x1, y1 = tile_offset[0] / scale, tile_offset[1] / scale
+                x2, y2 = x1 + tile_size[0] / scale, y1 + tile_size[1] / scale
+                tile_shapes = [shape for shape, bbox in zip(shapes, bboxes) if intersects(bbox, (x1, y1, x2, y2))]
+                # Image shapes are sent as the part of their picture in the tile (a TilePyramid can't be pickled)
+                tile_shapes = [_tile_picture(shape, pictures, scale, tile_offset, tile_size) if shape.kind == "image" else shape
+                               for shape in tile_shapes]
+                tile_shapes = [shape for shape in tile_shapes if shape is not None]
+                jobs.append(((tx, ty), pool.submit(render_box, tile_shapes, background, tile_offset, scale, tile_size)))
+        for position, job in jobs:
+            tile = job.result()
+            image.paste(tile.crop((TILE_MARGIN, TILE_MARGIN, tile.size[0] - TILE_MARGIN, tile.size[1] - TILE_MARGIN)), position)
+    return image
+
+class TilePicture(object):
+    """
+    Part of an image shape rendered in the output scale, drawn by draw_shape() the same way as the image shape.
+    The workers of render_tiled() get it instead of the image shape, so they don't need its (possibly tiled) image.
+
+    Attributes
+    ----------
+    image : Image
+        the part of the picture of the image shape
+    box : tuple
+        document area (x1, y1, x2, y2) of the part
+    coords : tuple
+        upper left corner of the part (draw_shape() places the image by its bbox())
+    """
+
+    kind = "image"
+
+    def __init__(self, image, box):
+        self.image = image
+        self.box = box
+        self.coords = box[:2]
+
+    def bbox(self):
+        return self.box
+
+    def picture(self, size):
+        return self.image if self.image.size == tuple(size) else self.image.resize(tuple(size), Image.BILINEAR)
+
+# The part of the image shape in the output tile at offset with the given size, cropped from its picture in the output scale
+# (None if the shape only touches the tile)
+def _tile_picture(shape, pictures, scale, offset, size):
+    x1, y1, x2, y2 = shape.bbox()
+    if shape not in pictures:
+        pictures[shape] = shape.picture((max(1, int(round((x2 - x1) * scale))), max(1, int(round((y2 - y1) * scale)))))
+    picture = pictures[shape]
+    left, top = int(round(x1 * scale)), int(round(y1 * scale))
+    crop = (max(0, offset[0] - left), max(0, offset[1] - top),
+            min(picture.size[0], offset[0] + size[0] - left), min(picture.size[1], offset[1] + size[1] - top))
+    if crop[0] >= crop[2] or crop[1] >= crop[3]:
+        return None
+    return TilePicture(picture.crop(crop), ((left + crop[0]) / scale, (top + crop[1]) / scale,
+                                           (left + crop[2]) / scale, (top + crop[3]) / scale))
+
+# Converts Tk color ("#rrggbb" or a color name) to RGB tuple, empty color means no fill/outline
+@lru_cache(maxsize=256)
+def color(value):
+    if not value:
+        return None
+    try:
+        return ImageColor.getrgb(value)
+    except ValueError:
+        return (0, 0, 0)
+
+# Monospace TrueType fonts tried for Tk fonts (Courier is not available everywhere), Pillow's default font is the fallback
+MONOSPACE_FONTS = ("cour.ttf", "DejaVuSansMono.ttf", "LiberationMono-Regular.ttf", "FreeMono.ttf", "Courier New.ttf")
+
+# Font for the text shapes with given pixel size (em height)
+@lru_cache(maxsize=32)
+def text_font(pixels):
+    for name in MONOSPACE_FONTS:
+        try:
+            return ImageFont.truetype(name, pixels)
+        except OSError:
+            pass
+    return ImageFont.load_default(pixels)
+
+# Draws one shape with ImageDraw, coordinates are transformed to the image space using scale and pixel offset
+def draw_shape(draw, image, shape, scale=1.0, offset=(0, 0)):
+    ox, oy = offset
+    coords = shape.coords
+    xy = [(coords[i] * scale - ox, coords[i + 1] * scale - oy) for i in range(0, len(coords) - 1, 2)]
+    kind = shape.kind
+    if kind == "pen":
+        width = max(1, int(round(shape.width * scale)))
+        fill = color(shape.fill)
+        if len(xy) > 1:
+            draw.line(xy, fill=fill, width=width)
+        # Round joins and caps (Tk joinstyle=ROUND, capstyle=ROUND) are drawn as discs at the stroke points,
+        # ImageDraw's joint="curve" does the same in pure Python and is several times slower
+        if width > 2 or len(xy) == 1:
+            radius = width / 2
+            for x, y in xy:
+                draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=fill)
+    elif kind == "line":
+        draw.line(xy, fill=color(shape.fill), width=max(1, int(round(shape.width * scale))))
+    elif kind in ("circle", "point", "rectangle"):
+        (x1, y1), (x2, y2) = xy[0], xy[1]
+        rect = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        outline_width = max(1, int(round(scale)))
+        if kind == "rectangle":
+            draw.rectangle(rect, fill=color(shape.fill), outline=color(shape.outline), width=outline_width)
+        else:
+            draw.ellipse(rect, fill=color(shape.fill), outline=color(shape.outline), width=outline_width)
+    elif kind == "polygon":
+        if len(xy) > 2:
+            draw.polygon(xy, fill=color(shape.fill), outline=color(shape.outline))
+        else:
+            draw.line(xy * 2 if len(xy) == 1 else xy, fill=color(shape.outline) or color(shape.fill))
+    elif kind == "image":
+        x1, y1, x2, y2 = shape.bbox()
+        picture = shape.picture((max(1, int(round((x2 - x1) * scale))), max(1, int(round((y2 - y1) * scale)))))
+        position = (int(round(x1 * scale)) - ox, int(round(y1 * scale)) - oy)
+        image.paste(picture, position, picture if picture.mode == "RGBA" else None)
+    elif kind == "text":
+        lines = shape.lines()
+        # Lines are placed with the Tk line height measured when the text was committed, the em height is about 1/1.2 of it
+        line_height = shape.size[1] / len(lines) * scale
+        font = text_font(max(1, int(round(line_height / 1.2))))
+        x, y = xy[0]
+        for index, line in enumerate(lines):
+            if line:
+                draw.text((x, y + index * line_height), line, fill=color(shape.fill), font=font)
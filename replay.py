@@ -0,0 +1,489 @@
+"""
+Recording and replaying of the Paint input events.
+
+Usage:
+    python replay.py record FILE         opens Paint and records the events into FILE until the window is closed
+    python replay.py run FILE [--realtime]
+                                         replays the recorded events and prints the results as JSON
+
+A recording is a JSON lines file: a header line ({"version": 1, "width": ..., "height": ...}) followed by one line
+per event: {"t": seconds since the start, "type": ..., ...}. Mouse positions are recorded in the document coordinates
+(the canvas can be scrolled and zoomed), they are replayed with the view at zoom 1 and scrolled to the origin,
+where the document and the window coordinates are the same. Event types are
+    press, motion, release   left mouse button (x, y and the tool settings: tool, color, outline, size and tolerance
+                             of the bucket fill)
+    right                    right mouse button (x, y)
+    undo, redo               undo and redo (keys or menu)
+    import                   image import (path, factor)
+    save                     saving of the drawing (path, only its extension is used by the replay)
+    new                      new drawing (File > New file and the new file before an image import or opening a project)
+    open                     opening of a project file (path)
+    layer                    layer command (action: add, raise, lower, hide, lock or select, the selected layer
+                             is given by its index in the layer order, 0 is the bottom layer)
+The text typed into text boxes is not recorded. Commands called by another recorded command (e.g. the selection
+of a new layer) are not recorded separately.
+
+The replay needs a display (e.g. run it with xvfb-run on a headless machine). Synthetic workloads are generated by
+the workload functions and benchmarked by "python bench.py replay". events_scene() builds the drawing of a recording
+without Tk (used by the batch rendering in batch.py).
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+VERSION = 1
+# Eraser radius in multiples of the pen size (the same as Paint.ERASER_SCALE, the headless replay doesn't import Tk)
+ERASER_SCALE = 2
+
+class Recorder(object):
+    """
+    Records the input events of a running Paint application. The event handlers of the Paint instance are wrapped,
+    the wrappers append the event and then call the original handler.
+
+    Attributes
+    ----------
+    paint : Paint
+        the recorded application
+    events : list
+        recorded events (dicts, see the module documentation)
+    depth : int
+        number of the recorded handlers running, the events are only recorded when it's 0
+    """
+
+    # Paint handler -> recorded event type
+    HANDLERS = {"start": "press", "motion": "motion", "end": "release", "mouse_right": "right",
+                "undo": "undo", "redo": "redo"}
+    # Paint layer command -> recorded action of the layer event
+    LAYER_COMMANDS = {"new_layer": "add", "raise_layer": "raise", "lower_layer": "lower",
+                      "toggle_layer_hidden": "hide", "toggle_layer_locked": "lock"}
+
+    def __init__(self, paint):
+        self.paint = paint
+        self.events = []
+        self.depth = 0
+        self.started = time.perf_counter()
+        for name, event_type in self.HANDLERS.items():
+            setattr(paint, name, self.wrap(getattr(paint, name), event_type))
+        for name, action in self.LAYER_COMMANDS.items():
+            setattr(paint, name, self.wrap_call(getattr(paint, name), "layer", lambda action=action: {"action": action}))
+        paint.select_layer = self.wrap_call(paint.select_layer, "layer", lambda layer: {
+            "action": "select", "index": paint.scene.layers.index(layer)})
+        paint.import_path = self.wrap_call(paint.import_path, "import", lambda img_dir, resize_factor=1.0: {
+            "path": os.path.abspath(img_dir), "factor": resize_factor})
+        paint.saving = self.wrap_call(paint.saving, "save", lambda: {"path": paint.file_dir})
+        paint.new_drawing = self.wrap_call(paint.new_drawing, "new", lambda: {})
+        paint.load_project = self.wrap_call(paint.load_project, "open", lambda file_dir, recovered=False: {
+            "path": os.path.abspath(file_dir)})
+        # The canvas and key binds and the Layers menu still refer to the original handlers
+        paint.bind_canvas()
+        paint.bind_keys()
+        paint.update_layers_menu()
+
+    def wrap(self, handler, event_type):
+        def wrapper(event=None):
+            if event_type in ("press", "motion", "release", "right"):
+                x, y = self.paint.view.to_document(event.x, event.y)
+                values = {"x": x, "y": y}
+                if event_type == "press":
+                    values.update(tool=self.paint.tool, color=self.paint.paint_color, outline=self.paint.outline_color,
+                                  size=self.paint.choose_size_button.get())
+                    if self.paint.tool == "fill":
+                        values["tolerance"] = self.paint.choose_tolerance_button.get()
+                return self.call(handler, event_type, values, event)
+            return self.call(handler, event_type, {}, event)
+        return wrapper
+
+    # Wraps a method, values(*args) gives the values of the event recorded before the method is called
+    def wrap_call(self, method, event_type, values):
+        def wrapper(*args):
+            return self.call(method, event_type, values(*args), *args)
+        return wrapper
+
+    def call(self, handler, event_type, values, *args):
+        if self.depth == 0:
+            self.record(event_type, **values)
+        self.depth += 1
+        try:
+            return handler(*args)
+        finally:
+            self.depth -= 1
+
+    def record(self, event_type, **values):
+        event = {"t": round(time.perf_counter() - self.started, 4), "type": event_type}
+        event.update(values)
+        self.events.append(event)
+
+    def save(self, path):
+        header = {"version": VERSION, "width": self.paint.default_canvas_width, "height": self.paint.default_canvas_height}
+        write_events(path, self.events, header)
+
+def write_events(path, events, header=None):
+    with open(path, "w") as file:
+        file.write(json.dumps(header or {"version": VERSION}) + "\n")
+        for event in events:
+            file.write(json.dumps(event) + "\n")
+
+# Reads the recording, returns (header, events)
+def read_events(path):
+    with open(path) as file:
+        lines = [json.loads(line) for line in file if line.strip()]
+    if not lines or lines[0].get("version") != VERSION:
+        raise ValueError("Not a Paint event recording: %s" % path)
+    return lines[0], lines[1:]
+
+# Synthetic workloads, every function returns a list of events
+
+# count pen strokes with random walks of points motion events each
+def scribble(count=10000, points=16, width=600, height=600, seed=0):
+    rnd = random.Random(seed)
+    events = []
+    t = 0.0
+    for index in range(count):
+        x, y = rnd.uniform(0, width), rnd.uniform(0, height)
+        events.append({"t": t, "type": "press", "x": x, "y": y, "tool": "pen", "color": "black", "outline": "black",
+                       "size": 1 + index % 10})
+        for _ in range(points):
+            t += 0.008
+            x = min(max(x + rnd.uniform(-12, 12), 0), width)
+            y = min(max(y + rnd.uniform(-12, 12), 0), height)
+            events.append({"t": t, "type": "motion", "x": x, "y": y})
+        events.append({"t": t, "type": "release", "x": x, "y": y})
+        t += 0.1
+    return events
+
+# Diagram made of count polygons with connecting lines and rectangle frames
+def diagram(count=2000, width=600, height=600, seed=0):
+    rnd = random.Random(seed)
+    colors = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd"]
+    events = []
+    t = 0.0
+    for index in range(count):
+        cx, cy = rnd.uniform(40, width - 40), rnd.uniform(40, height - 40)
+        color = colors[index % len(colors)]
+        for corner in range(rnd.randint(3, 8)):
+            events.append({"t": t, "type": "press", "x": cx + rnd.uniform(-30, 30), "y": cy + rnd.uniform(-30, 30),
+                           "tool": "polygon", "color": color, "outline": "black", "size": 1})
+            events.append({"t": t + 0.05, "type": "release", "x": cx, "y": cy})
+            t += 0.2
+        events.append({"t": t, "type": "right", "x": cx, "y": cy})
+        tool = "line" if index % 2 else "rectangle"
+        x, y = cx + rnd.uniform(-60, 60), cy + rnd.uniform(-60, 60)
+        events.append({"t": t, "type": "press", "x": cx, "y": cy, "tool": tool, "color": color, "outline": color, "size": 2})
+        for step in range(1, 9):
+            t += 0.016
+            events.append({"t": t, "type": "motion", "x": cx + (x - cx) * step / 8, "y": cy + (y - cy) * step / 8})
+        events.append({"t": t, "type": "release", "x": x, "y": y})
+        t += 0.2
+    return events
+
+# count strokes followed by repeated storms of undoing and redoing all of them
+def undo_storm(count=200, storms=20, seed=0):
+    events = scribble(count, seed=seed)
+    t = events[-1]["t"]
+    for _ in range(storms):
+        for event_type in ("undo", "redo"):
+            for _ in range(count):
+                t += 0.01
+                events.append({"t": t, "type": event_type})
+    return events
+
+# Imports count generated photos of the given size (written into directory)
+def image_import(count=4, size=(6000, 4000), directory=None):
+    from PIL import Image
+    directory = directory or tempfile.mkdtemp(prefix="paint-replay-")
+    events = []
+    for index in range(count):
+        path = os.path.join(directory, "photo%d.jpg" % index)
+        if not os.path.exists(path):
+            gradient = Image.linear_gradient("L").resize(size)
+            Image.merge("RGB", (gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT), Image.effect_noise(size, 40))).save(path, quality=90)
+        events.append({"t": index * 1.0, "type": "import", "path": path, "factor": (0.25, 0.5, 1.0)[index % 3]})
+    return events
+
+WORKLOADS = {"scribble": scribble, "diagram": diagram, "undo": undo_storm, "import": image_import}
+
+def _percentiles(seconds):
+    seconds = sorted(seconds)
+    def rank(fraction):
+        return 1000 * seconds[min(len(seconds) - 1, int(fraction * len(seconds)))]
+    return {"count": len(seconds), "p50_ms": rank(0.5), "p90_ms": rank(0.9), "p99_ms": rank(0.99), "max_ms": 1000 * seconds[-1]}
+
+def events_scene(events, width=600, height=600, pen_simplify=1.0):
+    """
+    Builds the drawing of the recorded events without Tk: the tools, undo and redo, new drawings, opened projects
+    and the layers work like in Paint, but the shapes are only added to a Scene (no canvas, no previews, no flattening
+    into the raster background).
+    """
+    from history import History, Command
+    from scene import Scene, PenShape, LineShape, CircleShape, RectangleShape, PolygonShape, PointShape, ImageShape
+    from stroke import Stroke
+    from spatial import erase, eraser_discs
+    import imaging
+    import raster
+    from fill import fill_shape, DEFAULT_TOLERANCE
+    from project import ProjectError, read_scene
+    scene = Scene(width, height)
+    layer = scene.layers[0]
+    # Commands from the truncated redo branch were never redone, their shapes are removed
+    def discard(command):
+        for shape in command.added:
+            scene.remove(shape)
+    # Shapes removed by commands that can't be undone anymore (erased shapes) are removed
+    def flatten(command):
+        for shape in command.removed:
+            scene.remove(shape)
+    history = History(discard=discard, flatten=flatten)
+    def add(shape):
+        shape.layer = layer.uid
+        scene.add(shape)
+        history.push(Command([shape]))
+    def set_hidden(shapes, hidden):
+        for shape in shapes:
+            shape.hidden = hidden
+    def erase_to(x, y):
+        for shape, pieces in erase(scene.index, eraser_discs(last[0], last[1], x, y, size * ERASER_SCALE), layer.uid):
+            if shape in erased_added:
+                erased_added.remove(shape)
+                scene.remove(shape)
+            else:
+                shape.hidden = True
+                erased_removed.append(shape)
+            for piece in pieces:
+                piece = PenShape(piece, fill=shape.fill, width=shape.width)
+                piece.layer = shape.layer
+                erased_added.append(scene.add(piece))
+        last[:] = [x, y]
+    tool, color, outline, size = "pen", "black", "black", 5
+    start = stroke = None
+    moved = False
+    polygon = []
+    last, erased_added, erased_removed = [0, 0], [], []
+    for event in events:
+        event_type = event["type"]
+        # The tools don't change locked and hidden layers
+        if event_type in ("press", "motion", "release") and (layer.locked or layer.hidden):
+            continue
+        if event_type == "press":
+            tool, color, outline, size = event["tool"], event["color"], event["outline"], event["size"]
+            start = (event["x"], event["y"])
+            if tool == "pen":
+                stroke, moved = Stroke(*start), False
+            elif tool == "polygon":
+                polygon += start
+            elif tool == "point":
+                add(PointShape((start[0], start[1], start[0] + size, start[1] + size), fill=color, outline=outline))
+            elif tool == "eraser":
+                last, erased_added, erased_removed = list(start), [], []
+                erase_to(*start)
+            elif tool == "fill":
+                # There is no raster background, the whole drawing is rendered for every fill
+                shape = fill_shape(raster.render(scene, workers=1), start[0], start[1], raster.color(color),
+                                   event.get("tolerance", DEFAULT_TOLERANCE))
+                if shape is not None:
+                    add(shape)
+        elif event_type == "motion":
+            if tool == "pen" and stroke is not None:
+                moved = stroke.add(event["x"], event["y"]) or moved
+            elif tool == "eraser" and start is not None:
+                erase_to(event["x"], event["y"])
+        elif event_type == "release" and start is not None:
+            coords = start + (event["x"], event["y"])
+            if tool == "pen" and stroke is not None and moved:
+                add(PenShape(stroke.finish(pen_simplify), fill=color, width=size))
+            elif tool == "line":
+                add(LineShape(coords, fill=color, width=size))
+            elif tool == "circle":
+                add(CircleShape(coords, fill=color, outline=outline))
+            elif tool == "rectangle":
+                add(RectangleShape(coords, fill=color, outline=outline))
+            elif tool == "eraser" and (erased_added or erased_removed):
+                history.push(Command(erased_added, erased_removed))
+            start = stroke = None
+        elif event_type == "right" and tool == "polygon" and polygon:
+            add(PolygonShape(polygon, fill=color, outline=outline))
+            polygon = []
+        elif event_type == "undo":
+            command = history.undo()
+            if command:
+                set_hidden(command.added, True)
+                set_hidden(command.removed, False)
+        elif event_type == "redo":
+            command = history.redo()
+            if command:
+                set_hidden(command.removed, True)
+                set_hidden(command.added, False)
+        elif event_type == "import":
+            loaded = imaging.decode(event["path"], event["factor"])
+            center = (width // 2, height // 2)
+            if loaded.pyramid is not None:
+                add(ImageShape(center, pyramid=loaded.pyramid, size=loaded.size))
+            else:
+                add(ImageShape(center, loaded.image))
+        elif event_type in ("new", "open"):
+            # Paint starts a new drawing of its canvas size, a project is loaded into it (with its layers)
+            # (a project that can't be read leaves the new drawing empty)
+            scene, settings = Scene(width, height), {}
+            if event_type == "open":
+                try:
+                    settings = read_scene(event["path"], scene)[1]
+                except (ProjectError, ValueError, OSError):
+                    scene.clear()
+            uids = [item.uid for item in scene.layers]
+            layer = scene.layers[uids.index(settings["active_layer"]) if settings.get("active_layer") in uids else 0]
+            history = History(discard=discard, flatten=flatten)
+            start = stroke = None
+            polygon = []
+        elif event_type == "layer":
+            action = event["action"]
+            if action == "add":
+                layer = scene.add_layer(position=scene.layers.index(layer) + 1)
+            elif action in ("raise", "lower"):
+                scene.move_layer(layer, scene.layers.index(layer) + (1 if action == "raise" else -1))
+            elif action == "hide":
+                layer.hidden = not layer.hidden
+            elif action == "lock":
+                layer.locked = not layer.locked
+            elif action == "select":
+                layer = scene.layers[event["index"]]
+    return scene
+
+# Feeds one event into the application, image imports and opened projects wait until they are on the canvas
+def dispatch(paint, event, save_dir):
+    event_type = event["type"]
+    # Paint only shows a message when a locked or hidden layer is clicked, the replay doesn't wait for it
+    if event_type in ("press", "motion", "release") and not paint.layer_editable():
+        return
+    if event_type == "press":
+        if event["tool"] != paint.tool:
+            paint.select_tool(event["tool"])
+        paint.paint_color, paint.outline_color = event["color"], event["outline"]
+        paint.choose_size_button.set(event["size"])
+        if "tolerance" in event:
+            paint.choose_tolerance_button.set(event["tolerance"])
+        paint.start(SimpleNamespace(x=event["x"], y=event["y"]))
+    elif event_type == "motion":
+        paint.motion(SimpleNamespace(x=event["x"], y=event["y"]))
+    elif event_type == "release":
+        paint.end(SimpleNamespace(x=event["x"], y=event["y"]))
+    elif event_type == "right":
+        paint.mouse_right(SimpleNamespace(x=event["x"], y=event["y"]))
+    elif event_type == "undo":
+        paint.undo()
+    elif event_type == "redo":
+        paint.redo()
+    elif event_type == "import":
+        paint.import_path(event["path"], event["factor"])
+        while paint.image_loader.pending:
+            paint.root.update()
+            time.sleep(0.001)
+    elif event_type == "save":
+        # The drawing is saved into a temporary directory in the same format, recorded files are never overwritten
+        paint.file_dir = os.path.join(save_dir, "replay" + os.path.splitext(event["path"])[1])
+        paint.saving()
+    elif event_type == "new":
+        paint.new_drawing()
+    elif event_type == "open":
+        paint.load_project(event["path"])
+        while paint.loading:
+            paint.root.update()
+            time.sleep(0.001)
+    elif event_type == "layer":
+        action = event["action"]
+        if action == "select":
+            paint.select_layer(paint.scene.layers[event["index"]])
+        else:
+            {"add": paint.new_layer, "raise": paint.raise_layer, "lower": paint.lower_layer,
+             "hide": paint.toggle_layer_hidden, "lock": paint.toggle_layer_locked}[action]()
+
+def replay(paint, events, realtime=False):
+    """
+    Replays the events in the Paint application and measures them.
+
+    Parameters
+    ----------
+    paint : Paint
+        the application, created with mainloop=False
+    events : list
+        the events to replay (see the module documentation)
+    realtime : bool
+        if True, the recorded timing of the events is kept, otherwise the events are replayed as fast as possible
+
+    Every event is measured including the processing of the Tk events and redraws it caused (root.update()).
+    Returns the results as a dict: latency percentiles by the event type, canvas item and shape counts, memory
+    and the time of saving the final drawing in every export format.
+    """
+    from bench import peak_rss
+    save_dir = tempfile.mkdtemp(prefix="paint-replay-")
+    latencies = {}
+    paint.view.set_zoom(1.0)
+    paint.c.xview_moveto(0)
+    paint.c.yview_moveto(0)
+    paint.view.refresh()
+    started = time.perf_counter()
+    for event in events:
+        if realtime:
+            delay = started + event["t"] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        start = time.perf_counter()
+        dispatch(paint, event, save_dir)
+        paint.root.update()
+        latencies.setdefault(event["type"], []).append(time.perf_counter() - start)
+    wall = time.perf_counter() - started
+    save_seconds = {}
+    for extension in (".tkp", ".png", ".ps"):
+        paint.file_dir = os.path.join(save_dir, "final" + extension)
+        start = time.perf_counter()
+        paint.saving()
+        save_seconds[extension[1:]] = time.perf_counter() - start
+    return {
+        "events": len(events),
+        "wall_seconds": wall,
+        "latency": {event_type: _percentiles(seconds) for event_type, seconds in latencies.items()},
+        "canvas_items": len(paint.c.find_all()),
+        "shapes": len(paint.scene),
+        "hidden_shapes": sum(1 for shape in paint.scene if shape.hidden),
+        "history": len(paint.history),
+        "peak_rss": peak_rss(),
+        "save_seconds": save_seconds,
+    }
+
+# Replays the events in a new Paint window (without autosave), the window is destroyed afterwards
+def replay_events(events, realtime=False, width=None, height=None):
+    from paint import Paint
+    options = {"autosave": False, "mainloop": False}
+    if width and height:
+        options.update(default_canvas_width=width, default_canvas_height=height)
+    paint = Paint(**options)
+    try:
+        return replay(paint, events, realtime)
+    finally:
+        paint.root.destroy()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Paint event recording and replay")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="record the events of a Paint window into a file")
+    record.add_argument("file")
+    run = commands.add_parser("run", help="replay a recording and print the results as JSON")
+    run.add_argument("file")
+    run.add_argument("--realtime", action="store_true", help="keep the recorded timing of the events")
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        from paint import Paint
+        paint = Paint(autosave=False, mainloop=False)
+        recorder = Recorder(paint)
+        paint.root.mainloop()
+        recorder.save(args.file)
+    elif args.command == "run":
+        header, events = read_events(args.file)
+        result = replay_events(events, args.realtime, header.get("width"), header.get("height"))
+        result["recording"] = args.file
+        print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+from array import array
+import math
+from spatial import SpatialIndex
+
+class Shape(object):
+    """
+    Base record of one drawn shape in the document model. Shapes don't depend on Tkinter, the canvas is only one view
+    of them (see view.py), so they can be rendered, exported, hit tested and measured without a display.
+
+    Attributes
+    ----------
+    uid : int
+        unique id of the shape within its scene (0 until the shape is added to a scene)
+    coords : array
+        flat array('f') of coordinates [x0, y0, x1, y1, ...]
+    fill : string
+        fill color of the shape (line color for pen strokes and lines)
+    outline : string
+        outline color of the shape
+    width : float
+        line width (pen size) of the shape
+    hidden : bool
+        True if the shape is hidden (undone)
+    layer : int
+        uid of the layer the shape belongs to (0 is the first layer of every scene)
+    """
+
+    __slots__ = ("uid", "coords", "fill", "outline", "width", "hidden", "layer")
+    kind = None
+
+    def __init__(self, coords, fill="black", outline="", width=1.0):
+        self.uid = 0
+        self.coords = array("f", coords)
+        self.fill = fill
+        self.outline = outline
+        self.width = float(width)
+        self.hidden = False
+        self.layer = 0
+
+    def __repr__(self):
+        return "<%s uid=%d points=%d>" % (type(self).__name__, self.uid, len(self.coords) // 2)
+
+    # Bounding box (x1, y1, x2, y2) of the shape including half of its line width
+    def bbox(self):
+        xs = self.coords[0::2]
+        ys = self.coords[1::2]
+        pad = self.width / 2
+        return (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+
+    # Approximate memory used by the shape record and its coordinates in bytes
+    def nbytes(self):
+        return 72 + 64 + self.coords.itemsize * len(self.coords)
+
+class PenShape(Shape):
+    __slots__ = ()
+    kind = "pen"
+
+class LineShape(Shape):
+    __slots__ = ()
+    kind = "line"
+
+class CircleShape(Shape):
+    __slots__ = ()
+    kind = "circle"
+
+class RectangleShape(Shape):
+    __slots__ = ()
+    kind = "rectangle"
+
+class PolygonShape(Shape):
+    __slots__ = ()
+    kind = "polygon"
+
+class PointShape(Shape):
+    __slots__ = ()
+    kind = "point"
+
+class ImageShape(Shape):
+    """
+    Imported image placed with its center at coords (cx, cy). The image attribute holds the PIL image, very large images
+    hold a TilePyramid (see tiles.py) instead. The Tk PhotoImages are owned by the canvas view.
+
+    Attributes
+    ----------
+    image : Image
+        the PIL image (None if the pyramid is used)
+    pyramid : TilePyramid
+        tile pyramid of a very large image (None if the image is used), the canvas view also builds it for an image
+        that is zoomed in too much for one PhotoImage (the image is kept)
+    size : tuple
+        displayed (width, height) of the image
+    """
+
+    __slots__ = ("image", "pyramid", "size")
+    kind = "image"
+
+    def __init__(self, coords, image=None, pyramid=None, size=None):
+        Shape.__init__(self, coords, fill="", outline="", width=0)
+        self.image = image
+        self.pyramid = pyramid
+        self.size = tuple(size) if size else image.size
+
+    def bbox(self):
+        width, height = self.size
+        cx, cy = self.coords[0], self.coords[1]
+        return (cx - width // 2, cy - height // 2, cx - width // 2 + width, cy - height // 2 + height)
+
+    def nbytes(self):
+        if self.image is None:
+            return Shape.nbytes(self) + self.pyramid.nbytes()
+        width, height = self.image.size
+        return Shape.nbytes(self) + width * height * len(self.image.getbands())
+
+    # PIL image of the shape in the given size (the displayed size by default)
+    def picture(self, size=None):
+        size = tuple(size or self.size)
+        if self.image is None:
+            return self.pyramid.render(size)
+        if self.image.size == size:
+            return self.image
+        from PIL import Image
+        return self.image.resize(size, Image.BILINEAR)
+
+class TextShape(Shape):
+    """
+    Native canvas text placed with its upper left corner at coords (x, y). The text is already wrapped into lines
+    (with the font metrics of the text box it was typed in), so every renderer draws exactly the same lines.
+
+    Attributes
+    ----------
+    text : string
+        the text, lines are separated by newlines
+    font : tuple
+        (family, size) of the Tk font
+    size : tuple
+        (width, height) of the text block in pixels
+    """
+
+    __slots__ = ("text", "font", "size")
+    kind = "text"
+
+    def __init__(self, coords, text, fill="black", font=("Courier", 12), size=(0, 0)):
+        Shape.__init__(self, coords, fill=fill, outline="", width=0)
+        self.text = text
+        self.font = tuple(font)
+        self.size = tuple(size)
+
+    def bbox(self):
+        x, y = self.coords[0], self.coords[1]
+        return (x, y, x + self.size[0], y + self.size[1])
+
+    def nbytes(self):
+        return Shape.nbytes(self) + 49 + len(self.text)
+
+    def lines(self):
+        return self.text.split("\n")
+
+# Shape classes by their kind, used when the shapes are rebuilt from saved data
+SHAPE_TYPES = {shape_type.kind: shape_type for shape_type in
+               (PenShape, LineShape, CircleShape, RectangleShape, PolygonShape, PointShape, ImageShape, TextShape)}
+
+class Layer(object):
+    """
+    Layer of the document, every shape belongs to one layer and the layers are drawn in their order in the scene
+    (the shapes of one layer in their drawing order).
+
+    Attributes
+    ----------
+    uid : int
+        unique id of the layer within its scene (Shape.layer refers to it)
+    name : string
+        the name of the layer shown in the Layers menu
+    hidden : bool
+        True if the layer is hidden, its shapes are neither shown nor exported
+    locked : bool
+        True if the layer is locked, the tools don't change it
+    """
+
+    __slots__ = ("uid", "name", "hidden", "locked")
+
+    def __init__(self, uid, name, hidden=False, locked=False):
+        self.uid = uid
+        self.name = name
+        self.hidden = hidden
+        self.locked = locked
+
+    def __repr__(self):
+        return "<Layer uid=%d %r>" % (self.uid, self.name)
+
+class Scene(object):
+    """
+    Headless document model: an ordered collection of shapes (the order is the drawing order).
+
+    Attributes
+    ----------
+    width : int
+        the width of the document, the document grows to the right and down to cover all its shapes
+    height : int
+        the height of the document
+    background : string
+        the background color of the document
+    index : SpatialIndex
+        spatial index of the shapes for hit testing and erasing, it's updated by add() and remove()
+    layers : list
+        layers of the document from the bottom one to the top one, a new scene has one layer with uid 0
+    """
+
+    def __init__(self, width, height, background="white"):
+        self.width = width
+        self.height = height
+        self.background = background
+        # Dict keeps the insertion (drawing) order and allows O(1) removal
+        self.shapes = {}
+        self.next_uid = 1
+        self.index = SpatialIndex()
+        self.layers = [Layer(0, "Layer 1")]
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __iter__(self):
+        return iter(list(self.shapes.values()))
+
+    def __contains__(self, shape):
+        return self.shapes.get(shape.uid) is shape
+
+    # Adds the shape at the top of the drawing order and assigns its uid (a given uid is kept, e.g. when loading a file)
+    def add(self, shape, uid=None):
+        if uid is None:
+            uid = self.next_uid
+        shape.uid = uid
+        self.next_uid = max(self.next_uid, uid + 1)
+        self.shapes[uid] = shape
+        x1, y1, x2, y2 = self.index.insert(shape)
+        # The line width doesn't count, a stroke along the edge of the document doesn't make it larger
+        pad = shape.width / 2
+        self.width = max(self.width, int(math.ceil(x2 - pad)))
+        self.height = max(self.height, int(math.ceil(y2 - pad)))
+        return shape
+
+    def remove(self, shape):
+        if self.shapes.get(shape.uid) is shape:
+            del self.shapes[shape.uid]
+            self.index.remove(shape)
+
+    def clear(self):
+        self.shapes.clear()
+        self.index.clear()
+
+    # Shapes that are currently drawn (not hidden by undo) in the drawing order: layer by layer from the bottom one,
+    # shapes of hidden layers are included (e.g. they're saved in the project file)
+    def visible(self):
+        shapes = [shape for shape in self.shapes.values() if not shape.hidden]
+        if len(self.layers) > 1:
+            position = {layer.uid: index for index, layer in enumerate(self.layers)}
+            # The sort is stable, the shapes of one layer stay in their drawing order
+            shapes.sort(key=lambda shape: position.get(shape.layer, 0))
+        return shapes
+
+    # Visible shapes without the shapes of the hidden layers, i.e. the shapes that are shown and exported
+    def drawn(self):
+        hidden = {layer.uid for layer in self.layers if layer.hidden}
+        shapes = self.visible()
+        return [shape for shape in shapes if shape.layer not in hidden] if hidden else shapes
+
+    def layer(self, uid):
+        for layer in self.layers:
+            if layer.uid == uid:
+                return layer
+        raise KeyError(uid)
+
+    # Adds a new layer at the given position in the layer order (at the top by default)
+    def add_layer(self, name=None, position=None):
+        uid = max(layer.uid for layer in self.layers) + 1
+        layer = Layer(uid, name or "Layer %d" % (uid + 1))
+        self.layers.insert(len(self.layers) if position is None else position, layer)
+        return layer
+
+    # Moves the layer to the position in the layer order (0 is the bottom)
+    def move_layer(self, layer, position):
+        self.layers.remove(layer)
+        self.layers.insert(max(0, min(position, len(self.layers))), layer)
+
+    # Layers as a list of dicts (saved in the project file settings) and back
+    def layer_records(self):
+        return [{"uid": layer.uid, "name": layer.name, "hidden": layer.hidden, "locked": layer.locked}
+                for layer in self.layers]
+    def restore_layers(self, records):
+        if records:
+            self.layers = [Layer(record["uid"], record["name"], record.get("hidden", False), record.get("locked", False))
+                           for record in records]
+
+    # Approximate memory used by all the shapes in bytes
+    def nbytes(self):
+        return sum(shape.nbytes() for shape in self.shapes.values())
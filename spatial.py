@@ -0,0 +1,297 @@
+"""
+Spatial index of the scene shapes and the geometry used for hit testing and erasing.
+"""
+import math
+
+# True if the boxes (x1, y1, x2, y2) overlap or touch
+def intersects(box, other):
+    return box[0] <= other[2] and box[2] >= other[0] and box[1] <= other[3] and box[3] >= other[1]
+
+class SpatialIndex(object):
+    """
+    Uniform grid index of shapes by their bounding boxes. Every shape is registered in the grid cells its bounding box
+    overlaps, so finding the shapes near a point or a rectangle only looks at a few cells instead of all the shapes
+    (and doesn't need the canvas, unlike find_overlapping). Shapes that would span more than MAX_CELLS cells
+    (e.g. very large images) are kept in a separate list that is always checked.
+
+    Attributes
+    ----------
+    cell : int
+        width and height of the grid cells
+    cells : dict
+        shapes in every non-empty cell ((col, row) -> set of shapes)
+    large : set
+        shapes that are too large for the grid
+    """
+
+    CELL = 64
+    MAX_CELLS = 256
+
+    def __init__(self, cell=CELL):
+        self.cell = cell
+        self.cells = {}
+        self.large = set()
+        # shape -> (col1, row1, col2, row2) of the cells it is registered in, None for large shapes
+        self.ranges = {}
+        # shape -> bounding box when it was registered (computing bbox() of long strokes is not cheap)
+        self.boxes = {}
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __contains__(self, shape):
+        return shape in self.ranges
+
+    def cell_range(self, box):
+        x1, y1, x2, y2 = box
+        return (int(x1 // self.cell), int(y1 // self.cell), int(x2 // self.cell), int(y2 // self.cell))
+
+    # Registers the shape and returns its bounding box
+    def insert(self, shape):
+        if shape in self.ranges:
+            self.remove(shape)
+        box = self.boxes[shape] = shape.bbox()
+        col1, row1, col2, row2 = cells = self.cell_range(box)
+        if (col2 - col1 + 1) * (row2 - row1 + 1) > self.MAX_CELLS:
+            self.large.add(shape)
+            self.ranges[shape] = None
+            return box
+        for row in range(row1, row2 + 1):
+            for col in range(col1, col2 + 1):
+                self.cells.setdefault((col, row), set()).add(shape)
+        self.ranges[shape] = cells
+        return box
+
+    # Bounding box of a registered shape (it's computed if the shape is not registered)
+    def box(self, shape):
+        box = self.boxes.get(shape)
+        return shape.bbox() if box is None else box
+
+    def remove(self, shape):
+        cells = self.ranges.pop(shape, 0)
+        self.boxes.pop(shape, None)
+        if cells is None:
+            self.large.discard(shape)
+        elif cells:
+            col1, row1, col2, row2 = cells
+            for row in range(row1, row2 + 1):
+                for col in range(col1, col2 + 1):
+                    bucket = self.cells[(col, row)]
+                    bucket.discard(shape)
+                    if not bucket:
+                        del self.cells[(col, row)]
+
+    # Registers the shape again after its coords changed
+    def update(self, shape):
+        return self.insert(shape)
+
+    def clear(self):
+        self.cells.clear()
+        self.large.clear()
+        self.ranges.clear()
+        self.boxes.clear()
+
+    # Visible shapes whose bounding boxes intersect the box (x1, y1, x2, y2), in the drawing order
+    def query(self, box):
+        x1, y1, x2, y2 = box
+        col1, row1, col2, row2 = self.cell_range(box)
+        found = set(self.large)
+        if (col2 - col1 + 1) * (row2 - row1 + 1) > len(self.cells):
+            # The box is larger than the occupied part of the grid, the occupied cells are scanned instead
+            for (col, row), bucket in self.cells.items():
+                if col1 <= col <= col2 and row1 <= row <= row2:
+                    found.update(bucket)
+        else:
+            for row in range(row1, row2 + 1):
+                for col in range(col1, col2 + 1):
+                    bucket = self.cells.get((col, row))
+                    if bucket:
+                        found.update(bucket)
+        shapes = []
+        boxes = self.boxes
+        for shape in found:
+            if shape.hidden:
+                continue
+            sx1, sy1, sx2, sy2 = boxes[shape]
+            if sx1 <= x2 and sx2 >= x1 and sy1 <= y2 and sy2 >= y1:
+                shapes.append(shape)
+        shapes.sort(key=lambda shape: shape.uid)
+        return shapes
+
+    # Visible shapes that are hit by a disc at (x, y) with the given radius, the topmost shape is the last one
+    def hits(self, x, y, radius=0.0):
+        return [shape for shape in self.query((x - radius, y - radius, x + radius, y + radius)) if hit(shape, x, y, radius)]
+
+    # The topmost visible shape at (x, y) (click hit testing), None if there is none
+    def hit(self, x, y, radius=2.0):
+        shapes = self.hits(x, y, radius)
+        return shapes[-1] if shapes else None
+
+# Squared distance of the point (x, y) from the segment (x1, y1)-(x2, y2)
+def segment_distance2(x, y, x1, y1, x2, y2):
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    t = 0.0 if length2 == 0 else max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length2))
+    px, py = x1 + t * dx - x, y1 + t * dy - y
+    return px * px + py * py
+
+# True if the point (x, y) is at most reach far from the polyline, segments that are clearly too far are skipped
+# without computing their distance and the search stops at the first near segment
+def near_polyline(coords, x, y, reach, closed=False):
+    count = len(coords) // 2
+    reach2 = reach * reach
+    if count == 1:
+        return (coords[0] - x) ** 2 + (coords[1] - y) ** 2 <= reach2
+    for i in range(count if closed else count - 1):
+        j = (i + 1) % count
+        x1, y1, x2, y2 = coords[2 * i], coords[2 * i + 1], coords[2 * j], coords[2 * j + 1]
+        if (x < x1 - reach and x < x2 - reach) or (x > x1 + reach and x > x2 + reach) or \
+                (y < y1 - reach and y < y2 - reach) or (y > y1 + reach and y > y2 + reach):
+            continue
+        if segment_distance2(x, y, x1, y1, x2, y2) <= reach2:
+            return True
+    return False
+
+def point_in_polygon(coords, x, y):
+    inside = False
+    count = len(coords) // 2
+    j = count - 1
+    for i in range(count):
+        xi, yi, xj, yj = coords[2 * i], coords[2 * i + 1], coords[2 * j], coords[2 * j + 1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+# True if a disc at (x, y) with the given radius touches the shape as it is drawn (filled areas, outlines, strokes)
+def hit(shape, x, y, radius=0.0):
+    kind = shape.kind
+    coords = shape.coords
+    if kind in ("pen", "line"):
+        return near_polyline(coords, x, y, radius + shape.width / 2)
+    if kind in ("circle", "point", "rectangle"):
+        x1, x2 = sorted((coords[0], coords[2]))
+        y1, y2 = sorted((coords[1], coords[3]))
+        reach = radius + 1
+        if kind == "rectangle":
+            if not (x1 - reach <= x <= x2 + reach and y1 - reach <= y <= y2 + reach):
+                return False
+            # Without a fill only the outline is hit
+            return bool(shape.fill) or min(abs(x - x1), abs(x - x2), abs(y - y1), abs(y - y2)) <= reach
+        cx, cy, rx, ry = (x1 + x2) / 2, (y1 + y2) / 2, (x2 - x1) / 2, (y2 - y1) / 2
+        outer = ((x - cx) / (rx + reach)) ** 2 + ((y - cy) / (ry + reach)) ** 2
+        if outer > 1:
+            return False
+        if shape.fill or rx <= reach or ry <= reach:
+            return True
+        return ((x - cx) / (rx - reach)) ** 2 + ((y - cy) / (ry - reach)) ** 2 >= 1
+    if kind == "polygon":
+        if len(coords) >= 6 and shape.fill and point_in_polygon(coords, x, y):
+            return True
+        return near_polyline(coords, x, y, radius + 1, closed=True)
+    # Images and texts are hit anywhere in their bounding box
+    x1, y1, x2, y2 = shape.bbox()
+    if not (x1 - radius <= x <= x2 + radius and y1 - radius <= y <= y2 + radius):
+        return False
+    if kind == "image" and shape.image is not None and shape.image.mode == "RGBA":
+        # Only the opaque pixels of transparent images (bucket fills) under the disc's bounding box are hit
+        image = shape.image
+        scale_x, scale_y = image.size[0] / (x2 - x1), image.size[1] / (y2 - y1)
+        box = (max(0, int((x - radius - x1) * scale_x)), max(0, int((y - radius - y1) * scale_y)),
+               min(image.size[0], int((x + radius - x1) * scale_x) + 1), min(image.size[1], int((y + radius - y1) * scale_y) + 1))
+        return box[0] < box[2] and box[1] < box[3] and image.crop(box).getchannel("A").getbbox() is not None
+    return True
+
+# Parameter interval (t1, t2) of the segment inside the disc, None if the segment misses it
+def _segment_disc(x1, y1, x2, y2, cx, cy, radius):
+    dx, dy = x2 - x1, y2 - y1
+    fx, fy = x1 - cx, y1 - cy
+    a = dx * dx + dy * dy
+    c = fx * fx + fy * fy - radius * radius
+    if a == 0:
+        return (0.0, 1.0) if c <= 0 else None
+    b = 2 * (fx * dx + fy * dy)
+    discriminant = b * b - 4 * a * c
+    if discriminant < 0:
+        return None
+    root = math.sqrt(discriminant)
+    t1, t2 = (-b - root) / (2 * a), (-b + root) / (2 * a)
+    if t2 < 0 or t1 > 1:
+        return None
+    return (max(0.0, t1), min(1.0, t2))
+
+def split_polyline(coords, discs):
+    """
+    Cuts the parts of the polyline covered by the discs [(x, y, radius), ...] out of it.
+
+    Returns the list of the remaining pieces (flat coordinate lists), the polyline is returned unchanged (one piece
+    that is the same list) if no disc touches it and an empty list if it was erased completely.
+    """
+    count = len(coords) // 2
+    if count == 1:
+        x, y = coords[0], coords[1]
+        return [] if any((x - cx) ** 2 + (y - cy) ** 2 <= r * r for cx, cy, r in discs) else [coords]
+    pieces = []
+    current = []
+    touched = False
+    for i in range(count - 1):
+        x1, y1, x2, y2 = coords[2 * i], coords[2 * i + 1], coords[2 * i + 2], coords[2 * i + 3]
+        intervals = sorted(interval for interval in (_segment_disc(x1, y1, x2, y2, *disc) for disc in discs) if interval)
+        # Kept parts of the segment are the gaps between the merged erased intervals
+        kept = []
+        position = 0.0
+        for t1, t2 in intervals:
+            if t1 > position:
+                kept.append((position, t1))
+            position = max(position, t2)
+        if position < 1.0:
+            kept.append((position, 1.0))
+        if kept != [(0.0, 1.0)]:
+            touched = True
+        for t1, t2 in kept:
+            start = (x1 + t1 * (x2 - x1), y1 + t1 * (y2 - y1))
+            if t1 > 0.0 or not current:
+                if len(current) >= 4:
+                    pieces.append(current)
+                current = [start[0], start[1]]
+            current += [x1 + t2 * (x2 - x1), y1 + t2 * (y2 - y1)]
+        if not kept or kept[-1][1] < 1.0:
+            if len(current) >= 4:
+                pieces.append(current)
+            current = []
+    if len(current) >= 4:
+        pieces.append(current)
+    return pieces if touched else [coords]
+
+# Discs that cover the eraser path from (x1, y1) to (x2, y2), spaced by half of the radius
+def eraser_discs(x1, y1, x2, y2, radius):
+    steps = max(1, int(math.hypot(x2 - x1, y2 - y1) / (radius / 2.0)))
+    return [(x1 + (x2 - x1) * i / steps, y1 + (y2 - y1) * i / steps, radius) for i in range(steps + 1)]
+
+def erase(index, discs, layer=None):
+    """
+    Finds the visible shapes touched by the eraser discs [(x, y, radius), ...] using the spatial index, only the shapes
+    of the given layer uid if it's not None.
+
+    Returns a list of (shape, pieces) pairs in the drawing order: pen strokes are cut at the erased span and pieces
+    are the coordinate lists of their remaining parts, other shapes are erased whole (pieces is empty).
+    The index and the shapes are not modified.
+    """
+    if not discs:
+        return []
+    box = (min(x - r for x, y, r in discs), min(y - r for x, y, r in discs),
+           max(x + r for x, y, r in discs), max(y + r for x, y, r in discs))
+    erased = []
+    for shape in index.query(box):
+        if layer is not None and shape.layer != layer:
+            continue
+        if shape.kind == "pen":
+            coords = shape.coords.tolist()
+            # The stroke is erased where the eraser touches its line width, not only its center line
+            pieces = split_polyline(coords, [(x, y, r + shape.width / 2) for x, y, r in discs])
+            if pieces and pieces[0] is coords:
+                continue
+            erased.append((shape, pieces))
+        elif any(hit(shape, x, y, r) for x, y, r in discs):
+            erased.append((shape, []))
+    return erased
@@ -0,0 +1,137 @@
+import math
+
+class Stroke(object):
+    """
+    Freehand pen stroke that is built from mouse motion events and kept as one flat list of polyline coordinates.
+    Redundant points are dropped while drawing (distance and angle threshold) and optionally once more
+    by the Ramer-Douglas-Peucker simplification when the stroke is finished.
+
+    Attributes
+    ----------
+    points : list
+        flat list of kept coordinates [x0, y0, x1, y1, ...]
+    received : int
+        the number of points received from motion events (including the starting point)
+    min_distance : float
+        points closer than min_distance to the last kept point only move the stroke tail
+    min_angle : float
+        direction changes (in radians) smaller than min_angle extend the last segment instead of adding a new point
+    """
+
+    MIN_DISTANCE = 2.0
+    MIN_ANGLE = 0.08
+
+    def __init__(self, x, y, min_distance=MIN_DISTANCE, min_angle=MIN_ANGLE):
+        self.points = [x, y]
+        self.received = 1
+        self.min_distance = min_distance
+        self.min_angle = min_angle
+        # The tail is the latest cursor position that has not been kept yet, it is drawn so the stroke follows the cursor
+        self.tail = None
+
+    @property
+    def kept(self):
+        return len(self.points) // 2
+
+    # Adds a new point to the stroke, returns True if the drawn polyline changed
+    def add(self, x, y):
+        self.received += 1
+        points = self.points
+        last_x, last_y = points[-2], points[-1]
+        dx, dy = x - last_x, y - last_y
+        if dx * dx + dy * dy < self.min_distance * self.min_distance:
+            # The point is too close to the last kept point, it only moves the tail
+            changed = self.tail != (x, y)
+            self.tail = (x, y)
+            return changed
+        self.tail = None
+        if len(points) >= 4:
+            # If the direction of the new segment is almost the same as the direction of the last segment,
+            # the last kept point is moved to the new position instead of adding a new one
+            prev_x, prev_y = points[-4], points[-3]
+            turn = math.atan2(dy, dx) - math.atan2(last_y - prev_y, last_x - prev_x)
+            turn = abs((turn + math.pi) % (2 * math.pi) - math.pi)
+            if turn < self.min_angle:
+                points[-2], points[-1] = x, y
+                return True
+        points.append(x)
+        points.append(y)
+        return True
+
+    # Returns the coordinates that should be drawn on the canvas (kept points and the tail)
+    # Tk line needs at least two points, so a single point stroke is drawn as a zero length segment
+    def coords(self):
+        coords = self.points + list(self.tail) if self.tail else list(self.points)
+        if len(coords) == 2:
+            coords += coords
+        return coords
+
+    # Finishes the stroke, the tail becomes a kept point and the optional RDP pass with tolerance epsilon is applied
+    def finish(self, epsilon=None):
+        if self.tail:
+            self.points.extend(self.tail)
+            self.tail = None
+        if epsilon:
+            self.points = simplify(self.points, epsilon)
+        return self.coords()
+
+def simplify(points, epsilon):
+    """
+    Ramer-Douglas-Peucker polyline simplification of a flat coordinate list [x0, y0, x1, y1, ...].
+    The first and the last point are always kept. Implemented iteratively, so very long strokes can't hit the recursion limit.
+    """
+    count = len(points) // 2
+    if count < 3:
+        return list(points)
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    ranges = [(0, count - 1)]
+    eps2 = epsilon * epsilon
+    while ranges:
+        first, last = ranges.pop()
+        ax, ay = points[2 * first], points[2 * first + 1]
+        bx, by = points[2 * last], points[2 * last + 1]
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        max_dist2, index = 0.0, 0
+        for i in range(first + 1, last):
+            px, py = points[2 * i], points[2 * i + 1]
+            if length2 == 0:
+                dist2 = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                # Squared perpendicular distance of the point from the line defined by the range end points
+                cross = dx * (py - ay) - dy * (px - ax)
+                dist2 = cross * cross / length2
+            if dist2 > max_dist2:
+                max_dist2, index = dist2, i
+        if max_dist2 > eps2:
+            keep[index] = True
+            ranges.append((first, index))
+            ranges.append((index, last))
+    result = []
+    for i in range(count):
+        if keep[i]:
+            result.append(points[2 * i])
+            result.append(points[2 * i + 1])
+    return result
+
+def decimate(points, distance):
+    """
+    Radial distance reduction of a flat coordinate list: points closer than distance to the last kept point are dropped,
+    the last point is always kept. Much cheaper than simplify() (one pass), used for the level of detail at low zoom.
+    """
+    count = len(points) // 2
+    if count < 3:
+        return list(points)
+    distance2 = distance * distance
+    last_x, last_y = points[0], points[1]
+    result = [last_x, last_y]
+    for i in range(2, 2 * count - 2, 2):
+        x, y = points[i], points[i + 1]
+        if (x - last_x) * (x - last_x) + (y - last_y) * (y - last_y) >= distance2:
+            result.append(x)
+            result.append(y)
+            last_x, last_y = x, y
+    result.append(points[-2])
+    result.append(points[-1])
+    return result
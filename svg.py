@@ -0,0 +1,147 @@
+"""
+SVG export of the document model.
+
+The elements are streamed into the file in chunks of CHUNK elements, the document is never built as one string.
+Consecutive pen strokes (or lines) of the same color and width are merged into one <path> element (one subpath
+per shape) and the coordinates are quantized to PRECISION decimal places, the path points after the first one are
+relative, so the files stay small. A .svgz file is written gzip compressed.
+"""
+import base64
+from functools import lru_cache
+import gzip
+import io
+from xml.sax.saxutils import escape, quoteattr
+import raster
+
+# Decimal places of the coordinates (0.1 px is below what the canvas can show)
+PRECISION = 1
+# Number of elements written at once
+CHUNK = 512
+# Maximal number of shapes merged into one <path> element
+MAX_SUBPATHS = 1000
+# Line caps of the stroked shapes as drawn on the canvas (pen strokes have round caps, lines the Tk default butt caps)
+CAPS = {"pen": "round", "line": "butt"}
+
+# Tk color as an SVG color, Tk color names are converted to #rrggbb (SVG doesn't know all of them)
+@lru_cache(maxsize=256)
+def svg_color(value):
+    rgb = raster.color(value)
+    return "none" if rgb is None else "#%02x%02x%02x" % rgb[:3]
+
+# Number of quanta (units of 10^-precision) as a decimal number without trailing zeros, the steps of the pen strokes
+# are a few hundred different small numbers, so the texts are cached
+@lru_cache(maxsize=65536)
+def _quanta(value, precision):
+    if not precision:
+        return str(value)
+    whole, fraction = divmod(abs(value), 10 ** precision)
+    sign = "-" if value < 0 else ""
+    if not fraction:
+        return sign + str(whole)
+    return "%s%d.%s" % (sign, whole, ("%0*d" % (precision, fraction)).rstrip("0"))
+
+def _number(value, precision):
+    return _quanta(int(round(value * 10 ** precision)), precision)
+
+def _points(coords, precision):
+    return " ".join("%s,%s" % (_number(coords[i], precision), _number(coords[i + 1], precision))
+                    for i in range(0, len(coords) - 1, 2))
+
+# Path data of a polyline: an absolute moveto and relative linetos, the relative steps are computed from the quantized
+# points, so the rounding errors don't add up. A single point is a zero length segment (drawn as a dot by the round cap)
+def _path_data(coords, precision):
+    scale = 10 ** precision
+    quantized = [int(round(value * scale)) for value in coords]
+    x, y = quantized[0], quantized[1]
+    steps = []
+    for i in range(2, len(quantized) - 1, 2):
+        steps.append("%s %s" % (_quanta(quantized[i] - x, precision), _quanta(quantized[i + 1] - y, precision)))
+        x, y = quantized[i], quantized[i + 1]
+    return "M%s %sl%s" % (_quanta(quantized[0], precision), _quanta(quantized[1], precision), " ".join(steps) or "0 0")
+
+def _path(fill, width, data, cap="round"):
+    return '<path d="%s" fill="none" stroke="%s" stroke-width="%g" stroke-linecap="%s" stroke-linejoin="round"/>' % (
+        "".join(data), svg_color(fill), width, cap)
+
+# SVG element of one shape
+def shape_element(shape, precision=PRECISION):
+    kind = shape.kind
+    coords = shape.coords
+    if kind in ("pen", "line"):
+        return _path(shape.fill, shape.width, [_path_data(coords, precision)], CAPS[kind])
+    number = lambda value: _number(value, precision)
+    style = 'fill="%s" stroke="%s"' % (svg_color(shape.fill), svg_color(shape.outline))
+    if kind in ("circle", "point", "rectangle"):
+        x1, x2 = sorted((coords[0], coords[2]))
+        y1, y2 = sorted((coords[1], coords[3]))
+        if kind == "rectangle":
+            return '<rect x="%s" y="%s" width="%s" height="%s" %s/>' % (
+                number(x1), number(y1), number(x2 - x1), number(y2 - y1), style)
+        return '<ellipse cx="%s" cy="%s" rx="%s" ry="%s" %s/>' % (
+            number((x1 + x2) / 2), number((y1 + y2) / 2), number((x2 - x1) / 2), number((y2 - y1) / 2), style)
+    if kind == "polygon":
+        return '<polygon points="%s" %s/>' % (_points(coords, precision), style)
+    if kind == "image":
+        x1, y1, x2, y2 = shape.bbox()
+        buffer = io.BytesIO()
+        shape.picture().save(buffer, format="PNG")
+        return '<image x="%g" y="%g" width="%g" height="%g" href="data:image/png;base64,%s"/>' % (
+            x1, y1, x2 - x1, y2 - y1, base64.b64encode(buffer.getvalue()).decode("ascii"))
+    if kind == "text":
+        lines = shape.lines()
+        line_height = shape.size[1] / len(lines)
+        spans = "".join('<tspan x="%s" y="%s">%s</tspan>' % (number(coords[0]), number(coords[1] + index * line_height),
+                                                             escape(line))
+                        for index, line in enumerate(lines))
+        return '<text font-family=%s font-size="%gpt" fill="%s" dominant-baseline="text-before-edge" xml:space="preserve">%s</text>' % (
+            quoteattr(shape.font[0]), shape.font[1], svg_color(shape.fill), spans)
+    raise ValueError("Unknown shape kind: %r" % kind)
+
+def svg_elements(shapes, precision=PRECISION):
+    """
+    Generates the SVG elements of the shapes in the drawing order. Runs of consecutive pen strokes (or lines) with
+    the same color and width become one <path> element with a subpath per shape (at most MAX_SUBPATHS of them),
+    the drawing order doesn't change, so the output looks the same as with one element per shape. Pen strokes and lines
+    have different caps, so they are never merged together.
+    """
+    style = None
+    data = []
+    for shape in shapes:
+        if shape.kind in CAPS:
+            if data and ((shape.fill, shape.width, CAPS[shape.kind]) != style or len(data) >= MAX_SUBPATHS):
+                yield _path(style[0], style[1], data, style[2])
+                data = []
+            style = (shape.fill, shape.width, CAPS[shape.kind])
+            data.append(_path_data(shape.coords, precision))
+        else:
+            if data:
+                yield _path(style[0], style[1], data, style[2])
+                data = []
+            yield shape_element(shape, precision)
+    if data:
+        yield _path(style[0], style[1], data, style[2])
+
+# Writes the drawn shapes of the scene (hidden layers are left out) as an SVG file, the elements are written in chunks
+# (compressed by gzip if compress is True, by default if the path ends with .svgz), returns the number of elements
+def write_svg(scene, path, precision=PRECISION, compress=None):
+    if compress is None:
+        compress = path.lower().endswith(".svgz")
+    file = gzip.open(path, "wt", compresslevel=6, encoding="utf-8") if compress else open(path, "w", encoding="utf-8")
+    count = 0
+    with file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        file.write('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d">\n' % (
+            scene.width, scene.height, scene.width, scene.height))
+        file.write('<rect width="100%%" height="100%%" fill="%s"/>\n' % svg_color(scene.background))
+        chunk = []
+        for element in svg_elements(scene.drawn(), precision):
+            chunk.append(element)
+            if len(chunk) >= CHUNK:
+                file.write("\n".join(chunk) + "\n")
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            file.write("\n".join(chunk) + "\n")
+            count += len(chunk)
+        file.write("</svg>\n")
+    return count
@@ -0,0 +1,31 @@
+"""
+Startup checks: the time to the first frame stays in the budget (needs a display) and importing the application
+doesn't load the modules that are only needed for the exports (runs headless).
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Median startup time from the process start to the first frame in seconds (python bench.py startup --budget 0.5)
+BUDGET = 0.5
+
+@pytest.mark.skipif(not os.environ.get("DISPLAY"), reason="the first frame needs a display")
+def test_startup_budget():
+    import bench
+    result = bench.bench_startup(repeat=3, budget=BUDGET)
+    assert result["status"] == "ok", result
+    assert not result["failed"]
+
+def test_import_is_lazy():
+    code = "import json, sys\nimport paint\nprint(json.dumps(sorted(set(name.split('.')[0] for name in sys.modules))))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True).stdout
+    loaded = json.loads(output)
+    assert "PIL" not in loaded
+    assert "numpy" not in loaded
@@ -0,0 +1,196 @@
+from collections import OrderedDict
+import mmap
+import tempfile
+from tkinter import PhotoImage
+from PIL import Image as Img
+from imaging import ppm_data
+
+class TilePyramid(object):
+    """
+    Level-of-detail tile pyramid of a very large image. Level 0 has the full resolution, every next level has half the size.
+    The raw RGB tiles are kept in memory or spilled into a temporary memory-mapped cache file, so only the tiles
+    that are actually displayed have to be resident.
+
+    Attributes
+    ----------
+    size : tuple
+        (width, height) of the full resolution image
+    tile_size : int
+        width and height of the tiles in pixels
+    levels : list
+        (width, height) of every level
+    """
+
+    TILE_SIZE = 256
+
+    def __init__(self, image, tile_size=TILE_SIZE, spill=True):
+        image = image.convert("RGB")
+        self.size = image.size
+        self.tile_size = tile_size
+        self.levels = []
+        # (level, col, row) -> raw RGB bytes (in memory) or (offset, length) in the cache file (spilled)
+        self.tiles = {}
+        self.file = tempfile.TemporaryFile(prefix="paint-tiles-") if spill else None
+        offset = 0
+        level = image
+        while True:
+            self.levels.append(level.size)
+            index = len(self.levels) - 1
+            for row in range(self.grid(index)[1]):
+                for col in range(self.grid(index)[0]):
+                    data = level.crop(self.tile_box(index, col, row)).tobytes()
+                    if self.file:
+                        self.file.write(data)
+                        self.tiles[(index, col, row)] = (offset, len(data))
+                        offset += len(data)
+                    else:
+                        self.tiles[(index, col, row)] = data
+            if max(level.size) <= tile_size:
+                break
+            # Image.reduce() averages 2x2 blocks, which is much faster than a general resize
+            level = level.reduce(2)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.file else None
+
+    # Number of tile columns and rows of the level
+    def grid(self, level):
+        width, height = self.levels[level]
+        return (-(-width // self.tile_size), -(-height // self.tile_size))
+
+    # Tile rectangle in the level pixels
+    def tile_box(self, level, col, row):
+        width, height = self.levels[level]
+        x, y = col * self.tile_size, row * self.tile_size
+        return (x, y, min(x + self.tile_size, width), min(y + self.tile_size, height))
+
+    # The coarsest level that still has at least the resolution needed for the given scale (of the full resolution image)
+    def level_for(self, scale):
+        level = 0
+        while level + 1 < len(self.levels) and self.levels[level + 1][0] >= self.size[0] * scale:
+            level += 1
+        return level
+
+    # Lazily reads the tile from memory or from the memory-mapped cache file
+    def tile(self, level, col, row):
+        data = self.tiles[(level, col, row)]
+        if self.map is not None:
+            offset, length = data
+            data = self.map[offset:offset + length]
+        x1, y1, x2, y2 = self.tile_box(level, col, row)
+        return Img.frombytes("RGB", (x2 - x1, y2 - y1), data)
+
+    # Assembles the whole image in the given size from the closest level (used by the export)
+    def render(self, size):
+        level = self.level_for(size[0] / self.size[0])
+        image = Img.new("RGB", self.levels[level])
+        columns, rows = self.grid(level)
+        for row in range(rows):
+            for col in range(columns):
+                image.paste(self.tile(level, col, row), self.tile_box(level, col, row)[:2])
+        return image if image.size == tuple(size) else image.resize(tuple(size), Img.BILINEAR)
+
+    # Memory used by the tiles that are kept in memory (spilled tiles are paged in by the OS on demand)
+    def nbytes(self):
+        return 0 if self.map is not None else sum(len(data) for data in self.tiles.values())
+
+class TiledImage(object):
+    """
+    Canvas items of an image shape with a TilePyramid. Only the tiles that intersect the visible region of the canvas
+    get a canvas item, at the pyramid level that matches the displayed size. Tile PhotoImages are created lazily
+    and the least recently used ones are evicted when they take more than memory_cap bytes.
+
+    Attributes
+    ----------
+    canvas : Canvas
+        the Tk canvas the tiles are displayed on
+    shape : ImageShape
+        the image shape with the pyramid
+    tag : string
+        canvas tag shared by all tile items of the shape
+    memory_cap : int
+        maximal memory used by the tile PhotoImages in bytes
+    """
+
+    DEFAULT_MEMORY_CAP = 64 * 1024 * 1024
+
+    def __init__(self, canvas, shape, memory_cap=DEFAULT_MEMORY_CAP):
+        self.canvas = canvas
+        self.shape = shape
+        self.tag = "tiles%d" % id(shape)
+        self.memory_cap = memory_cap
+        self.items = {}
+        self.photos = OrderedDict()
+        self.nbytes = 0
+        self.zoom = 1.0
+
+    # Visible canvas region in canvas coordinates
+    def visible_region(self):
+        c = self.canvas
+        x1, y1 = c.canvasx(0), c.canvasy(0)
+        width, height = c.winfo_width(), c.winfo_height()
+        # The canvas is not mapped yet, its requested size is used instead
+        if width <= 1:
+            width, height = int(c.cget("width")), int(c.cget("height"))
+        return (x1, y1, x1 + width, y1 + height)
+
+    # Creates the items of newly visible tiles and deletes the items of tiles that are not visible anymore,
+    # zoom is the canvas zoom factor (canvas pixels per document pixel)
+    def refresh(self, zoom=None, region=None):
+        if zoom is not None:
+            self.zoom = zoom
+        pyramid = self.shape.pyramid
+        scale = self.shape.size[0] / pyramid.size[0] * self.zoom
+        level = pyramid.level_for(scale)
+        # factor converts the level pixels to canvas pixels
+        factor = scale * pyramid.size[0] / pyramid.levels[level][0]
+        x0, y0 = self.shape.bbox()[:2]
+        x0, y0 = x0 * self.zoom, y0 * self.zoom
+        rx1, ry1, rx2, ry2 = region or self.visible_region()
+        size = pyramid.tile_size * factor
+        columns, rows = pyramid.grid(level)
+        needed = set()
+        for row in range(max(0, int((ry1 - y0) // size)), min(rows, int((ry2 - y0) // size) + 1)):
+            for col in range(max(0, int((rx1 - x0) // size)), min(columns, int((rx2 - x0) // size) + 1)):
+                needed.add((level, col, row))
+        for key in list(self.items):
+            if key not in needed:
+                self.canvas.delete(self.items.pop(key))
+        state = "hidden" if self.shape.hidden else "normal"
+        for key in needed:
+            if key not in self.items:
+                tx1, ty1, tx2, ty2 = pyramid.tile_box(*key)
+                # Tile edges are rounded the same way for neighbouring tiles, so there are no seams between them
+                x1, y1 = int(x0 + tx1 * factor), int(y0 + ty1 * factor)
+                x2, y2 = int(x0 + tx2 * factor), int(y0 + ty2 * factor)
+                photo = self.photo(key, (max(1, x2 - x1), max(1, y2 - y1)))
+                self.items[key] = self.canvas.create_image(x1, y1, anchor="nw", image=photo, state=state, tags=self.tag)
+        self.evict()
+
+    def photo(self, key, size):
+        cache_key = key + size
+        if cache_key in self.photos:
+            self.photos.move_to_end(cache_key)
+            return self.photos[cache_key]
+        tile = self.shape.pyramid.tile(*key)
+        if tile.size != size:
+            tile = tile.resize(size, Img.BILINEAR)
+        photo = PhotoImage(width=size[0], height=size[1], data=ppm_data(tile), format="PPM")
+        self.photos[cache_key] = photo
+        self.nbytes += size[0] * size[1] * 4
+        return photo
+
+    # Evicts the least recently used PhotoImages that are not displayed until the memory cap is met
+    def evict(self):
+        displayed = {key for key in self.items}
+        for cache_key in list(self.photos):
+            if self.nbytes <= self.memory_cap:
+                break
+            if cache_key[:3] not in displayed:
+                width, height = cache_key[3:]
+                del self.photos[cache_key]
+                self.nbytes -= width * height * 4
+
+    def delete(self):
+        self.canvas.delete(self.tag)
+        self.items.clear()
+        self.photos.clear()
+        self.nbytes = 0
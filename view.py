@@ -0,0 +1,368 @@
+import bisect
+import io
+import math
+from tkinter import PhotoImage
+from tkinter import font as tkfont
+from imaging import ppm_data, TILED_PIXELS
+from spatial import intersects
+from stroke import decimate
+
+_font_metrics = {}
+
+# Width of the "0" character (the unit of Text widget widths) and the line height of the font in pixels,
+# measuring needs a Tk call, so the metrics are measured once per font and cached
+def font_metrics(font):
+    font = tuple(font)
+    if font not in _font_metrics:
+        measured = tkfont.Font(family=font[0], size=font[1])
+        _font_metrics[font] = (measured.measure("0"), measured.metrics("linespace"))
+    return _font_metrics[font]
+
+class CanvasView(object):
+    """
+    Tk canvas view of a Scene: creates, updates and deletes the canvas items that represent the scene shapes.
+    The document is scrollable and zoomable (canvas coordinates are the document coordinates multiplied by zoom) and only
+    the shapes that intersect the materialized region (the visible area with a margin of half a window on every side)
+    have canvas items. Shapes that enter the region when the view moves are materialized in batches scheduled by after(),
+    so scrolling and zooming stay responsive on drawings with very many shapes.
+
+    Attributes
+    ----------
+    canvas : Canvas
+        the Tk canvas the shapes are drawn on
+    scene : Scene
+        the document model that is displayed
+    background : LayerImages
+        raster images of the layers (see background.py), they're displayed in the materialized region too and the items
+        are stacked under the layers above the active one (None if there are none)
+    zoom : float
+        canvas pixels per document pixel
+    shapes : set
+        live shapes shown by the view, with or without a canvas item (baked shapes are shown by the background)
+    items : dict
+        canvas item id of every materialized shape (shape -> item id)
+    photos : dict
+        PhotoImage of every drawn image shape at the current zoom, the reference keeps the image alive (shape -> PhotoImage)
+    tiled : dict
+        TiledImage of every drawn image shape with a tile pyramid, their items value is the tiles tag (shape -> TiledImage)
+    region : tuple
+        materialized document area (x1, y1, x2, y2), None until the view is refreshed (then every shape is materialized)
+    visible : bool
+        False if the items are hidden (the live shapes belong to a hidden layer)
+    """
+
+    # Number of shapes materialized in one after() step
+    BATCH = 500
+    # Minimal distance of the points of the pen strokes at low zoom in window pixels
+    LOD_DISTANCE = 2.0
+    MIN_ZOOM = 1 / 32.0
+    MAX_ZOOM = 4.0
+
+    def __init__(self, canvas, scene, background=None):
+        self.canvas = canvas
+        self.scene = scene
+        self.background = background
+        self.zoom = 1.0
+        self.shapes = set()
+        self.items = {}
+        self.photos = {}
+        self.tiled = {}
+        self.region = None
+        self.visible = True
+        # Shapes waiting for materialization (in the drawing order) and the scheduled materialization step
+        self.pending = []
+        self.scheduled = None
+        # Sorted uids of the materialized shapes (None if it has to be sorted again), used to keep the drawing order
+        self.order = []
+        # Simplified coords of the pen strokes at low zoom (shape -> (zoom level, coords))
+        self.lod = {}
+        self.scroll_key = None
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __contains__(self, shape):
+        return shape in self.shapes
+
+    # Shows the shape in the view: its canvas item is created now if the shape intersects the materialized region,
+    # otherwise when the region reaches it. Image shapes can be given an already created PhotoImage (of zoom 1)
+    def draw(self, shape, photo=None):
+        self.shapes.add(shape)
+        if shape in self.items:
+            # The shape was drawn before it was added to the scene (e.g. a pen stroke), it has its uid now
+            self.order = None
+        else:
+            if photo is not None and self.zoom == 1.0:
+                self.photos[shape] = photo
+            if self.region is None or intersects(self.scene.index.box(shape), self.region):
+                self.materialize([shape])
+        self.update_scroll_region()
+
+    # Creates the canvas items of the shapes, an item is lowered under the item of the next materialized shape
+    # in the drawing order, so the stacking doesn't depend on the order in which the items were created
+    def materialize(self, shapes):
+        order = self.order
+        if order is None:
+            order = sorted(shape.uid for shape in self.items)
+        added = []
+        # The newest items are kept under the images of the layers above the active one
+        ceiling = self.background.ceiling() if self.background is not None else None
+        for shape in shapes:
+            if shape in self.items:
+                continue
+            item = self.create(shape)
+            below = ceiling
+            # Shapes that are not in the scene yet (uid 0) are the newest ones
+            if shape.uid:
+                index = bisect.bisect_right(order, shape.uid)
+                if index < len(order):
+                    successor = self.scene.shapes.get(order[index])
+                    if successor in self.items:
+                        below = self.items[successor]
+            if below is not None:
+                self.canvas.tag_lower(item, below)
+            added.append(shape.uid)
+        self.order = sorted(order + added) if added else order
+
+    # Creates the canvas item of the shape in the canvas coordinates
+    def create(self, shape):
+        c = self.canvas
+        zoom = self.zoom
+        state = "hidden" if shape.hidden or not self.visible else "normal"
+        # Pen strokes are polylines (not splines), the same geometry as the baked layers and the exports
+        if shape.kind == "pen":
+            item = c.create_line(*self.stroke_coords(shape), width=shape.width * zoom, fill=shape.fill, state=state,
+                                 capstyle="round", joinstyle="round")
+        elif shape.kind == "line":
+            item = c.create_line(*self.to_canvas(self.line_coords(shape)), width=shape.width * zoom, fill=shape.fill,
+                                 smooth=1, state=state)
+        elif shape.kind in ("circle", "point"):
+            item = c.create_oval(*self.to_canvas(shape.coords), fill=shape.fill, outline=shape.outline, state=state)
+        elif shape.kind == "rectangle":
+            item = c.create_rectangle(*self.to_canvas(shape.coords), fill=shape.fill, outline=shape.outline, state=state)
+        elif shape.kind == "polygon":
+            item = c.create_polygon(*self.to_canvas(shape.coords), fill=shape.fill, outline=shape.outline, state=state)
+        elif shape.kind == "image":
+            width, height = max(1, int(round(shape.size[0] * zoom))), max(1, int(round(shape.size[1] * zoom)))
+            # Pillow is imported by tiles.py, it's imported with the first image shape
+            from tiles import TilePyramid, TiledImage
+            if shape.pyramid is None and shape.image.mode != "RGBA" and width * height > TILED_PIXELS:
+                # Zoomed in too much for one PhotoImage, the image gets a tile pyramid and only its visible tiles are shown
+                shape.pyramid = TilePyramid(shape.image)
+            if shape.pyramid is not None:
+                tiled = self.tiled[shape] = TiledImage(c, shape)
+                tiled.refresh(zoom)
+                item = tiled.tag
+            else:
+                photo = self.photos.get(shape)
+                if photo is None:
+                    photo = self.photos[shape] = self.make_photo(shape.picture((width, height)))
+                item = c.create_image(*self.to_canvas(shape.coords), image=photo, state=state)
+        elif shape.kind == "text":
+            font = shape.font if zoom == 1.0 else (shape.font[0], max(1, int(round(shape.font[1] * zoom))))
+            item = c.create_text(*self.to_canvas(shape.coords), text=shape.text, fill=shape.fill, font=font, anchor="nw",
+                                 state=state)
+        else:
+            raise ValueError("Unknown shape kind: %r" % shape.kind)
+        self.items[shape] = item
+        return item
+
+    # Tk lines need at least two points, single point strokes are drawn as zero length segments
+    @staticmethod
+    def line_coords(shape):
+        coords = shape.coords.tolist()
+        if len(coords) == 2:
+            coords += coords
+        return coords
+
+    # Canvas coordinates of a pen stroke, at zoom 1/2 and lower the stroke is simplified (level of detail): points closer
+    # than LOD_DISTANCE window pixels to the previous point are left out, the simplified strokes are cached per zoom level
+    # (power of two)
+    def stroke_coords(self, shape):
+        coords = self.line_coords(shape)
+        if self.zoom <= 0.5 and len(coords) > 4:
+            level = int(math.log2(1 / self.zoom))
+            cached = self.lod.get(shape)
+            if cached is None or cached[0] != level:
+                cached = self.lod[shape] = (level, decimate(coords, self.LOD_DISTANCE * 2 ** level))
+            coords = cached[1]
+        return self.to_canvas(coords)
+
+    # Converts a PIL image into a Tk PhotoImage using in-memory PPM data, images with transparency (e.g. bucket fills)
+    # are passed as PNG data, PPM has no alpha channel
+    @staticmethod
+    def make_photo(image):
+        if image.mode == "RGBA":
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", compress_level=1)
+            return PhotoImage(width=image.size[0], height=image.size[1], data=buffer.getvalue(), format="PNG")
+        return PhotoImage(width=image.size[0], height=image.size[1], data=ppm_data(image), format="PPM")
+
+    # Canvas coordinates of flat document coordinates
+    def to_canvas(self, coords):
+        zoom = self.zoom
+        return list(coords) if zoom == 1.0 else [value * zoom for value in coords]
+
+    # Document coordinates of the window point (x, y), e.g. of a mouse event
+    def to_document(self, x, y):
+        return (self.canvas.canvasx(x) / self.zoom, self.canvas.canvasy(y) / self.zoom)
+
+    # Size of the canvas window (its requested size if it's not mapped yet)
+    def window_size(self):
+        c = self.canvas
+        width, height = c.winfo_width(), c.winfo_height()
+        if width <= 1:
+            width, height = int(c.cget("width")), int(c.cget("height"))
+        return width, height
+
+    # Visible document area (x1, y1, x2, y2)
+    def viewport(self):
+        width, height = self.window_size()
+        x1, y1 = self.to_document(0, 0)
+        return (x1, y1, x1 + width / self.zoom, y1 + height / self.zoom)
+
+    # The scroll region covers the document and one more window, so the drawing can be extended to the right and down
+    def update_scroll_region(self):
+        key = (self.scene.width, self.scene.height, self.zoom)
+        if key != self.scroll_key:
+            self.scroll_key = key
+            width, height = self.window_size()
+            self.canvas.config(scrollregion=(0, 0, int(self.scene.width * self.zoom) + width,
+                                             int(self.scene.height * self.zoom) + height))
+
+    # Sets the zoom factor, the document point under the window point (x, y) (the middle of the window by default)
+    # stays in place, all the items are materialized again in the new canvas coordinates
+    def set_zoom(self, zoom, x=None, y=None):
+        zoom = min(max(zoom, self.MIN_ZOOM), self.MAX_ZOOM)
+        if zoom == self.zoom:
+            return
+        width, height = self.window_size()
+        if x is None:
+            x, y = width / 2, height / 2
+        document_x, document_y = self.to_document(x, y)
+        self.clear_items()
+        self.photos.clear()
+        self.zoom = zoom
+        self.update_scroll_region()
+        scroll_width = int(self.scene.width * zoom) + width
+        scroll_height = int(self.scene.height * zoom) + height
+        self.canvas.xview_moveto((document_x * zoom - x) / scroll_width)
+        self.canvas.yview_moveto((document_y * zoom - y) / scroll_height)
+        self.refresh()
+
+    # Updates the materialized region after the visible area changed (scrolling, zooming, resizing of the window):
+    # nothing happens while the visible area stays inside the region, otherwise the region is centered on it again,
+    # shapes that left it lose their canvas items and shapes that entered it are queued for materialization
+    def refresh(self, event=None):
+        if event is not None:
+            # The window was resized
+            self.scroll_key = None
+        self.update_scroll_region()
+        for tiled in self.tiled.values():
+            tiled.refresh(self.zoom)
+        x1, y1, x2, y2 = self.viewport()
+        if self.region is not None and self.region[0] <= x1 and self.region[1] <= y1 and \
+                x2 <= self.region[2] and y2 <= self.region[3]:
+            return
+        margin_x, margin_y = (x2 - x1) / 2, (y2 - y1) / 2
+        self.region = (x1 - margin_x, y1 - margin_y, x2 + margin_x, y2 + margin_y)
+        inside = self.scene.index.query(self.region)
+        keep = set(inside)
+        for shape in list(self.items):
+            # The shape that is being drawn (not in the scene yet) keeps its item
+            if shape.uid and shape not in keep:
+                self.dematerialize(shape)
+        self.pending = [shape for shape in inside if shape in self.shapes and shape not in self.items]
+        if self.background is not None:
+            self.background.show(self.region, self.zoom)
+        if self.pending and self.scheduled is None:
+            self.scheduled = self.canvas.after(1, self.materialize_step)
+
+    def materialize_step(self):
+        self.scheduled = None
+        batch, self.pending = self.pending[:self.BATCH], self.pending[self.BATCH:]
+        self.materialize([shape for shape in batch if shape in self.shapes and not shape.hidden])
+        if self.pending:
+            self.scheduled = self.canvas.after(1, self.materialize_step)
+
+    # Updates the canvas item coordinates after the shape coords changed
+    def update(self, shape):
+        self.lod.pop(shape, None)
+        item = self.items.get(shape)
+        if item is not None:
+            coords = self.line_coords(shape) if shape.kind in ("pen", "line") else shape.coords.tolist()
+            self.canvas.coords(item, *self.to_canvas(coords))
+
+    # Hides or shows the shape, a shown shape without a canvas item is materialized if it is in the region
+    def set_hidden(self, shape, hidden):
+        shape.hidden = hidden
+        item = self.items.get(shape)
+        if item is not None:
+            self.canvas.itemconfigure(item, state="hidden" if hidden or not self.visible else "normal")
+        elif not hidden and shape in self.shapes and \
+                (self.region is None or intersects(self.scene.index.box(shape), self.region)):
+            self.materialize([shape])
+
+    # Hides or shows all the items (the layer of the live shapes was hidden or shown)
+    def set_visible(self, visible):
+        self.visible = visible
+        for shape, item in self.items.items():
+            self.canvas.itemconfigure(item, state="hidden" if shape.hidden or not visible else "normal")
+
+    # Shows the given live shapes instead of the current ones (e.g. the live shapes of another layer), the materialized
+    # region stays, the shapes in it are materialized in batches
+    def replace(self, shapes):
+        region = self.region
+        self.clear()
+        self.shapes.update(shapes)
+        if region is None:
+            self.materialize([shape for shape in shapes if not shape.hidden])
+            return
+        self.region = region
+        self.pending = [shape for shape in self.scene.index.query(region) if shape in self.shapes]
+        if self.pending:
+            self.scheduled = self.canvas.after(1, self.materialize_step)
+
+    # Deletes the canvas item of the shape, the shape stays in the view (and its PhotoImage in the cache)
+    def dematerialize(self, shape):
+        item = self.items.pop(shape, None)
+        if item is not None:
+            self.canvas.delete(item)
+            self.order = None
+        tiled = self.tiled.pop(shape, None)
+        if tiled:
+            tiled.delete()
+
+    # Removes the shape from the view, deletes its canvas item and releases its PhotoImage
+    def delete(self, shape):
+        self.shapes.discard(shape)
+        self.dematerialize(shape)
+        self.photos.pop(shape, None)
+        self.lod.pop(shape, None)
+
+    # Deletes all the canvas items, the shapes stay in the view and are materialized again by refresh()
+    def clear_items(self):
+        for item in self.items.values():
+            self.canvas.delete(item)
+        for tiled in self.tiled.values():
+            tiled.delete()
+        self.items.clear()
+        self.tiled.clear()
+        self.order = []
+        self.region = None
+        self.pending = []
+        if self.scheduled is not None:
+            self.canvas.after_cancel(self.scheduled)
+            self.scheduled = None
+
+    def clear(self):
+        self.clear_items()
+        self.shapes.clear()
+        self.photos.clear()
+        self.lod.clear()
+
+    # Draws all the scene shapes again (e.g. after the scene was loaded)
+    def redraw(self):
+        self.clear()
+        for shape in self.scene:
+            self.draw(shape)